@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from numba import jit
+from numba import jit, typed
 import numpy as np
 import math
 
@@ -10,115 +10,291 @@ import disc_model as dm
 import general_math as gm
 import live_data as ld
 
-#TODO: Possibly reinstate jit here (this is the fastest function though!)
-#@jit(nopython=True)
-def O(T,t_formation,d_formation, fe_star, z_formation, Al, Ti, Ca, Ni, Fe, Cr, Mg, Si, Na):
-    def O_cond_a(x):
-        O_cond_a = ((3.0130447356937058120666950537328292354655179252631569397635757923126220703125E-11)*x**9) + ((-2.807084698605554265497685913731407136850748429424129426479339599609375E-8)*x**8) + ((0.00001063495621534568083728367060558639423106797039508819580078125)*x**7) + ((-0.001953600072816120969410036423141718842089176177978515625)*x**6) + ((0.118782323977384363100640030097565613687038421630859375)*x**5) + ((20.507024807688964074259274639189243316650390625)*x**4) + ((-5057.821515620658828993327915668487548828125)*x**3) + ((473930.6469112207996658980846405029296875)*x**2) + ((-21956923.4987984411418437957763671875)*x) + 416374115.999850690364837646484375
-        return O_cond_a
-    def O_cond_b(x):
-        O_cond_b = ((-8.01816773465877753609994077705340824082210189017581964342727685046696706194779835641384124755859375E-21)*x**12) + ((1.0070898330734577065393492579489358624709802108123692099272972200196818448603153228759765625E-17)*x**11) + ((-4.70477569404908565433640843044907841217160647528938710593138239346444606781005859375E-15)*x**10) + ((8.019035866412573751495925971206519557686609456226278780377469956874847412109375E-13)*x**9) + ((7.052309561630735782856521997878271844351072417111936374567449092864990234375E-11)*x**8) + ((-3.59520457904541848210907433770755492474791026324965059757232666015625E-8)*x**7) + ((-0.000001434755643641682662121623718920471191040633129887282848358154296875)*x**6) + ((0.0015651353277274580692857153252361968043260276317596435546875)*x**5) + ((-0.0157179314971404616996242253890159190632402896881103515625)*x**4) + ((-69.6575055560066260795792913995683193206787109375)*x**3) + ((13076.950970530795530066825449466705322265625)*x**2) + ((-1011028.2469208813272416591644287109375)*x) + 29949276.2144540511071681976318359375
-        return O_cond_b
-    def O_cond_c(x):
-        O_cond_c = ((-1.935858687654345781991909840331329427273363148123906995386688320272453210581405091961215703122434206306934356689453125E-28)*x**14) + ((4.60031890387486682816812327205108474327971749643549747409456597969749924725846312867361120879650115966796875E-25)*x**13) + ((-4.04574720873363699965459756008350530694121082013269309076396174074119471697486005723476409912109375E-22)*x**12) + ((1.279783157740830553011536130703199131090575326909135702758979480364587288931943476200103759765625E-19)*x**11) + ((2.1961741772431609635338623975292609306017658151745884642647155260419822297990322113037109375E-17)*x**10) + ((-1.892855896132653454907952313138831504740170093292750408409119700081646442413330078125E-14)*x**9) + ((-2.40397966795433912086858782724643778840045715838869000435806810855865478515625E-12)*x**8) + ((2.65923217268813523813786637325744244275682603984023444354534149169921875E-9)*x**7) + ((3.52574456327930609681755268203229292112155235372483730316162109375E-7)*x**6) + ((-0.0003972032161178485503739976625325880377204157412052154541015625)*x**5) + ((-0.0236000284548833205722218053779215551912784576416015625)*x**4) + ((65.7878558825435533208292326889932155609130859375)*x**3) + ((-19576.4395998625623178668320178985595703125)*x**2) + ((2509944.56871254742145538330078125)*x) - 124785614.3718341290950775146484375
-        return O_cond_c        
+# Set this to use the compiled O condensation calculation (O_c) in O. It is faster, but LLVM evaluates the x**2.0 terms of the fits
+# as x*x, which can differ from Python's pow in the last bit. The fits cancel heavily, so the result can then change by up to ~1e-6
+use_compiled_oxygen = False
+
+# The exponents are floats so that the compiled copies of these (below) evaluate the powers with pow, as Python does.
+# With integer exponents numba expands them into multiplications instead, which changes the results much more
+def O_cond_a(x):
+    O_cond_a = ((3.0130447356937058120666950537328292354655179252631569397635757923126220703125E-11)*x**9.0) + ((-2.807084698605554265497685913731407136850748429424129426479339599609375E-8)*x**8.0) + ((0.00001063495621534568083728367060558639423106797039508819580078125)*x**7.0) + ((-0.001953600072816120969410036423141718842089176177978515625)*x**6.0) + ((0.118782323977384363100640030097565613687038421630859375)*x**5.0) + ((20.507024807688964074259274639189243316650390625)*x**4.0) + ((-5057.821515620658828993327915668487548828125)*x**3.0) + ((473930.6469112207996658980846405029296875)*x**2.0) + ((-21956923.4987984411418437957763671875)*x) + 416374115.999850690364837646484375
+    return O_cond_a
+
+def O_cond_b(x):
+    O_cond_b = ((-8.01816773465877753609994077705340824082210189017581964342727685046696706194779835641384124755859375E-21)*x**12.0) + ((1.0070898330734577065393492579489358624709802108123692099272972200196818448603153228759765625E-17)*x**11.0) + ((-4.70477569404908565433640843044907841217160647528938710593138239346444606781005859375E-15)*x**10.0) + ((8.019035866412573751495925971206519557686609456226278780377469956874847412109375E-13)*x**9.0) + ((7.052309561630735782856521997878271844351072417111936374567449092864990234375E-11)*x**8.0) + ((-3.59520457904541848210907433770755492474791026324965059757232666015625E-8)*x**7.0) + ((-0.000001434755643641682662121623718920471191040633129887282848358154296875)*x**6.0) + ((0.0015651353277274580692857153252361968043260276317596435546875)*x**5.0) + ((-0.0157179314971404616996242253890159190632402896881103515625)*x**4.0) + ((-69.6575055560066260795792913995683193206787109375)*x**3.0) + ((13076.950970530795530066825449466705322265625)*x**2.0) + ((-1011028.2469208813272416591644287109375)*x) + 29949276.2144540511071681976318359375
+    return O_cond_b
+
+def O_cond_c(x):
+    O_cond_c = ((-1.935858687654345781991909840331329427273363148123906995386688320272453210581405091961215703122434206306934356689453125E-28)*x**14.0) + ((4.60031890387486682816812327205108474327971749643549747409456597969749924725846312867361120879650115966796875E-25)*x**13.0) + ((-4.04574720873363699965459756008350530694121082013269309076396174074119471697486005723476409912109375E-22)*x**12.0) + ((1.279783157740830553011536130703199131090575326909135702758979480364587288931943476200103759765625E-19)*x**11.0) + ((2.1961741772431609635338623975292609306017658151745884642647155260419822297990322113037109375E-17)*x**10.0) + ((-1.892855896132653454907952313138831504740170093292750408409119700081646442413330078125E-14)*x**9.0) + ((-2.40397966795433912086858782724643778840045715838869000435806810855865478515625E-12)*x**8.0) + ((2.65923217268813523813786637325744244275682603984023444354534149169921875E-9)*x**7.0) + ((3.52574456327930609681755268203229292112155235372483730316162109375E-7)*x**6.0) + ((-0.0003972032161178485503739976625325880377204157412052154541015625)*x**5.0) + ((-0.0236000284548833205722218053779215551912784576416015625)*x**4.0) + ((65.7878558825435533208292326889932155609130859375)*x**3.0) + ((-19576.4395998625623178668320178985595703125)*x**2.0) + ((2509944.56871254742145538330078125)*x) - 124785614.3718341290950775146484375
+    return O_cond_c
+
+def O_rock(stellar_composition, Fe_factor, Al, Ti, Ca, Fe, Cr, Mg, Si, Na):
+    # Oxygen (relative to the stellar O abundance) locked up in rock, with Fe_factor O atoms per Fe atom
+    # stellar_composition is the relevant row of the stellar compositions
+    return ((1.5*(Al/Mg)*stellar_composition[0])+(2*(Ti/Mg)*(stellar_composition[1]))+((Ca/Mg)*(stellar_composition[2]))+(1)+(2*(Si/Mg)*(stellar_composition[6]))+(1.5*(Cr/Mg)*(stellar_composition[5]))+((Fe_factor)*(Fe/Mg)*(stellar_composition[4]))+(0.5*(Na/Mg)*(stellar_composition[7])))/((1/Mg)*(stellar_composition[8]))
+
+def O(T,t_formation,d_formation, fe_star, z_formation, Al, Ti, Ca, Ni, Fe, Cr, Mg, Si, Na, stellar_compositions=None):
+    if stellar_compositions is None:
+        stellar_compositions = ld._live_stellar_compositions
     floored_fe_star = math.floor(fe_star)
+    stellar_composition = stellar_compositions[floored_fe_star]
+    if use_compiled_oxygen:
+        return O_c(T, t_formation, stellar_composition, Al, Ti, Ca, Ni, Fe, Cr, Mg, Si, Na)
+    if T - 1.17393656*np.log(t_formation+0.005)+6.219888463073661 <= 128:
+        O_cond = 1
+    elif 128 < T - 1.17393656*np.log(t_formation+0.005)+6.219888463073661 <= 142.6 :
+        rock = O_rock(stellar_composition, 1.38, Al, Ti, Ca, Fe, Cr, Mg, Si, Na)
+        O_cond = rock + (O_cond_a(T - 1.17393656*np.log(t_formation+0.005)+6.219888463073661)*(1-rock))
+    elif 142.6 + 1.17393656*np.log(t_formation+0.005)-6.219888463073661 < T <= 180 :
+        O_cond = O_rock(stellar_composition, 1.38, Al, Ti, Ca, Fe, Cr, Mg, Si, Na)
+    elif 180 < T <= 220 :
+        O_cond = O_rock(stellar_composition, O_cond_b(T), Al, Ti, Ca, Fe, Cr, Mg, Si, Na)
+    elif 220 < T <= 325 :
+        O_cond = O_rock(stellar_composition, 0.651, Al, Ti, Ca, Fe, Cr, Mg, Si, Na)
+    elif 325 < T <= 409 :
+        O_cond = O_rock(stellar_composition, O_cond_c(T), Al, Ti, Ca, Fe, Cr, Mg, Si, Na)
+    else:
+        O_cond = O_rock(stellar_composition, 0, Al, Ti, Ca, Fe, Cr, Mg, Si, Na)  # No O is bound to Fe
+    return O_cond
+
+# Compiled versions of the above. O_c is O with the stellar composition row passed in explicitly instead of being read from live_data
+O_cond_a_compiled = jit(nopython=True)(O_cond_a)
+O_cond_b_compiled = jit(nopython=True)(O_cond_b)
+O_cond_c_compiled = jit(nopython=True)(O_cond_c)
+O_rock_compiled = jit(nopython=True)(O_rock)
+
+@jit(nopython=True)
+def O_c(T, t_formation, stellar_composition, Al, Ti, Ca, Ni, Fe, Cr, Mg, Si, Na):
     if T - 1.17393656*np.log(t_formation+0.005)+6.219888463073661 <= 128:
         O_cond = 1
-    elif 128 < T - 1.17393656*np.log(t_formation+0.005)+6.219888463073661 <= 142.6 :    
-        O_cond = ((1.5*(Al/Mg)*ld._live_stellar_compositions[floored_fe_star][0])+(2*(Ti/Mg)*(ld._live_stellar_compositions[floored_fe_star][1]))+((Ca/Mg)*(ld._live_stellar_compositions[floored_fe_star][2]))+(1)+(2*(Si/Mg)*(ld._live_stellar_compositions[floored_fe_star][6]))+(1.5*(Cr/Mg)*(ld._live_stellar_compositions[floored_fe_star][5]))+((1.38)*(Fe/Mg)*(ld._live_stellar_compositions[floored_fe_star][4]))+(0.5*(Na/Mg)*(ld._live_stellar_compositions[floored_fe_star][7])))/((1/Mg)*(ld._live_stellar_compositions[floored_fe_star][8])) + (O_cond_a(T - 1.17393656*np.log(t_formation+0.005)+6.219888463073661)*(1-((1.5*(Al/Mg)*ld._live_stellar_compositions[floored_fe_star][0])+(2*(Ti/Mg)*(ld._live_stellar_compositions[floored_fe_star][1]))+((Ca/Mg)*(ld._live_stellar_compositions[floored_fe_star][2]))+(1)+(2*(Si/Mg)*(ld._live_stellar_compositions[floored_fe_star][6]))+(1.5*(Cr/Mg)*(ld._live_stellar_compositions[floored_fe_star][5]))+((1.38)*(Fe/Mg)*(ld._live_stellar_compositions[floored_fe_star][4]))+(0.5*(Na/Mg)*(ld._live_stellar_compositions[floored_fe_star][7])))/((1/Mg)*(ld._live_stellar_compositions[floored_fe_star][8]))))
+    elif 128 < T - 1.17393656*np.log(t_formation+0.005)+6.219888463073661 <= 142.6 :
+        rock = O_rock_compiled(stellar_composition, 1.38, Al, Ti, Ca, Fe, Cr, Mg, Si, Na)
+        O_cond = rock + (O_cond_a_compiled(T - 1.17393656*np.log(t_formation+0.005)+6.219888463073661)*(1-rock))
     elif 142.6 + 1.17393656*np.log(t_formation+0.005)-6.219888463073661 < T <= 180 :
-        O_cond =  ((1.5*(Al/Mg)*ld._live_stellar_compositions[floored_fe_star][0])+(2*(Ti/Mg)*(ld._live_stellar_compositions[floored_fe_star][1]))+((Ca/Mg)*(ld._live_stellar_compositions[floored_fe_star][2]))+(1)+(2*(Si/Mg)*(ld._live_stellar_compositions[floored_fe_star][6]))+(1.5*(Cr/Mg)*(ld._live_stellar_compositions[floored_fe_star][5]))+((1.38)*(Fe/Mg)*(ld._live_stellar_compositions[floored_fe_star][4]))+(0.5*(Na/Mg)*(ld._live_stellar_compositions[floored_fe_star][7])))/((1/Mg)*(ld._live_stellar_compositions[floored_fe_star][8])) 
-    elif 180 < T <= 220 : 
-        O_cond =  ((1.5*(Al/Mg)*ld._live_stellar_compositions[floored_fe_star][0])+(2*(Ti/Mg)*(ld._live_stellar_compositions[floored_fe_star][1]))+((Ca/Mg)*(ld._live_stellar_compositions[floored_fe_star][2]))+(1)+(2*(Si/Mg)*(ld._live_stellar_compositions[floored_fe_star][6]))+(1.5*(Cr/Mg)*(ld._live_stellar_compositions[floored_fe_star][5]))+((O_cond_b(T))*(Fe/Mg)*(ld._live_stellar_compositions[floored_fe_star][4]))+(0.5*(Na/Mg)*(ld._live_stellar_compositions[floored_fe_star][7])))/((1/Mg)*(ld._live_stellar_compositions[floored_fe_star][8]))       
-    elif 220 < T <= 325 : 
-        O_cond =  ((1.5*(Al/Mg)*ld._live_stellar_compositions[floored_fe_star][0])+(2*(Ti/Mg)*(ld._live_stellar_compositions[floored_fe_star][1]))+((Ca/Mg)*(ld._live_stellar_compositions[floored_fe_star][2]))+(1)+(2*(Si/Mg)*(ld._live_stellar_compositions[floored_fe_star][6]))+(1.5*(Cr/Mg)*(ld._live_stellar_compositions[floored_fe_star][5]))+((0.651)*(Fe/Mg)*(ld._live_stellar_compositions[floored_fe_star][4]))+(0.5*(Na/Mg)*(ld._live_stellar_compositions[floored_fe_star][7])))/((1/Mg)*(ld._live_stellar_compositions[floored_fe_star][8]))
-    elif 325 < T <= 409 :    
-        O_cond = ((1.5*(Al/Mg)*ld._live_stellar_compositions[floored_fe_star][0])+(2*(Ti/Mg)*(ld._live_stellar_compositions[floored_fe_star][1]))+((Ca/Mg)*(ld._live_stellar_compositions[floored_fe_star][2]))+(1)+(2*(Si/Mg)*(ld._live_stellar_compositions[floored_fe_star][6]))+(1.5*(Cr/Mg)*(ld._live_stellar_compositions[floored_fe_star][5]))+((O_cond_c(T))*(Fe/Mg)*(ld._live_stellar_compositions[floored_fe_star][4]))+(0.5*(Na/Mg)*(ld._live_stellar_compositions[floored_fe_star][7])))/((1/Mg)*(ld._live_stellar_compositions[floored_fe_star][8]))
+        O_cond = O_rock_compiled(stellar_composition, 1.38, Al, Ti, Ca, Fe, Cr, Mg, Si, Na)
+    elif 180 < T <= 220 :
+        O_cond = O_rock_compiled(stellar_composition, O_cond_b_compiled(T), Al, Ti, Ca, Fe, Cr, Mg, Si, Na)
+    elif 220 < T <= 325 :
+        O_cond = O_rock_compiled(stellar_composition, 0.651, Al, Ti, Ca, Fe, Cr, Mg, Si, Na)
+    elif 325 < T <= 409 :
+        O_cond = O_rock_compiled(stellar_composition, O_cond_c_compiled(T), Al, Ti, Ca, Fe, Cr, Mg, Si, Na)
     else:
-        O_cond = ((1.5*(Al/Mg)*ld._live_stellar_compositions[floored_fe_star][0])+(2*(Ti/Mg)*(ld._live_stellar_compositions[floored_fe_star][1]))+((Ca/Mg)*(ld._live_stellar_compositions[floored_fe_star][2]))+(1)+(2*(Si/Mg)*(ld._live_stellar_compositions[floored_fe_star][6]))+(1.5*(Cr/Mg)*(ld._live_stellar_compositions[floored_fe_star][5]))+(0.5*(Na/Mg)*(ld._live_stellar_compositions[floored_fe_star][7])))/((1/Mg)*(ld._live_stellar_compositions[floored_fe_star][8]))
+        O_cond = O_rock_compiled(stellar_composition, 0, Al, Ti, Ca, Fe, Cr, Mg, Si, Na)  # No O is bound to Fe
     return O_cond
 
+# Array version of O_c: d_formation and the abundances are arrays with one entry per point, and stellar_compositions has one row per point
+@jit(nopython=True)
+def O_c_batch(d_formation, t_formation, stellar_compositions, Al, Ti, Ca, Ni, Fe, Cr, Mg, Si, Na):
+    toret = np.empty(len(d_formation))
+    for i in range(len(d_formation)):
+        toret[i] = O_c(dm.T_disc(d_formation[i], t_formation), t_formation, stellar_compositions[i], Al[i], Ti[i], Ca[i], Ni[i], Fe[i], Cr[i], Mg[i], Si[i], Na[i])
+    return toret
+
 @jit(nopython=True)
 def get_abundances_for_negative_z(elements, d_formation, t_formation):
     toret = []
+    T = dm.T_disc(d_formation, t_formation)
     for element in elements:
         # This is a bit horrible, but jit doesn't get on with dictionary lookups
         if element == ci.Element.Al:
-            toret.append(Al_c(dm.T_disc(d_formation, t_formation), t_formation))
+            toret.append(Al_c(T, t_formation))
         elif element == ci.Element.Ti:
-            toret.append(Ti_c(dm.T_disc(d_formation, t_formation), t_formation))
+            toret.append(Ti_c(T, t_formation))
         elif element == ci.Element.Ca:
-            toret.append(Ca_c(dm.T_disc(d_formation, t_formation), t_formation))
+            toret.append(Ca_c(T, t_formation))
         elif element == ci.Element.Ni:
-            toret.append(Ni_c(dm.T_disc(d_formation, t_formation), t_formation))
+            toret.append(Ni_c(T, t_formation))
         elif element == ci.Element.Fe:
-            toret.append(Fe_c(dm.T_disc(d_formation, t_formation), t_formation))
+            toret.append(Fe_c(T, t_formation))
         elif element == ci.Element.Cr:
-            toret.append(Cr_c(dm.T_disc(d_formation, t_formation), t_formation))
+            toret.append(Cr_c(T, t_formation))
         elif element == ci.Element.Mg:
-            toret.append(Mg_c(dm.T_disc(d_formation, t_formation), t_formation))
+            toret.append(Mg_c(T, t_formation))
         elif element == ci.Element.Si:
-            toret.append(Si_c(dm.T_disc(d_formation, t_formation), t_formation))
+            toret.append(Si_c(T, t_formation))
         elif element == ci.Element.Na:
-            toret.append(Na_c(dm.T_disc(d_formation, t_formation), t_formation))
+            toret.append(Na_c(T, t_formation))
         elif element == ci.Element.O:
             # This is filled in later. Ideally would use None, but then jit complains!
             toret.append(0)
         elif element == ci.Element.C:
-            toret.append(C_c(dm.T_disc(d_formation, t_formation), t_formation))
+            toret.append(C_c(T, t_formation))
         elif element == ci.Element.N:
-            toret.append(Nz_c(dm.T_disc(d_formation, t_formation), t_formation))
+            toret.append(Nz_c(T, t_formation))
         else:
             pass
     return toret
 
 @jit(nopython=True)
-def get_abundances_for_positive_z(elements, d_formation, z_formation, t_formation):
+def get_weighted_abundances(elements, weights, temperatures, t_formation):
+    # Sum of the condensed fraction of each element over a set of disc temperatures, each with some weight
     toret = []
-    x = gm.fznd(d_formation, z_formation)
     for element in elements:
         if element == ci.Element.O:
             # This is filled in later. Ideally would use None, but then jit complains!
             toret.append(0)
         else:
             element_abundance = 0
-            j = d_formation-3
-            for s in x:
+            for k in range(len(weights)):
+                s = weights[k]
+                T = temperatures[k]
                 # This is a bit horrible, but jit doesn't get on with dictionary lookups
                 if element == ci.Element.Al:
-                    element_abundance += s*Al_c(dm.T_disc(j, t_formation), t_formation)
+                    element_abundance += s*Al_c(T, t_formation)
                 elif element == ci.Element.Ti:
-                    element_abundance += s*Ti_c(dm.T_disc(j, t_formation), t_formation)
+                    element_abundance += s*Ti_c(T, t_formation)
                 elif element == ci.Element.Ca:
-                    element_abundance += s*Ca_c(dm.T_disc(j, t_formation), t_formation)
+                    element_abundance += s*Ca_c(T, t_formation)
                 elif element == ci.Element.Ni:
-                    element_abundance += s*Ni_c(dm.T_disc(j, t_formation), t_formation)
+                    element_abundance += s*Ni_c(T, t_formation)
                 elif element == ci.Element.Fe:
-                    element_abundance += s*Fe_c(dm.T_disc(j, t_formation), t_formation)
+                    element_abundance += s*Fe_c(T, t_formation)
                 elif element == ci.Element.Cr:
-                    element_abundance += s*Cr_c(dm.T_disc(j, t_formation), t_formation)
+                    element_abundance += s*Cr_c(T, t_formation)
                 elif element == ci.Element.Mg:
-                    element_abundance += s*Mg_c(dm.T_disc(j, t_formation), t_formation)
+                    element_abundance += s*Mg_c(T, t_formation)
                 elif element == ci.Element.Si:
-                    element_abundance += s*Si_c(dm.T_disc(j, t_formation), t_formation)
+                    element_abundance += s*Si_c(T, t_formation)
                 elif element == ci.Element.Na:
-                    element_abundance += s*Na_c(dm.T_disc(j, t_formation), t_formation)
+                    element_abundance += s*Na_c(T, t_formation)
                 elif element == ci.Element.C:
-                    element_abundance += s*C_c(dm.T_disc(j, t_formation), t_formation)
+                    element_abundance += s*C_c(T, t_formation)
                 elif element == ci.Element.N:
-                    element_abundance += s*Nz_c(dm.T_disc(j, t_formation), t_formation)
+                    element_abundance += s*Nz_c(T, t_formation)
                 else:
                     pass
-                j += 0.01
             toret.append(element_abundance)
     return toret
 
-def get_all_abundances(elements, d_formation, z_formation, t_formation, fe_star=None):  # fe_star only required if Oxygen is one of the elements
+@jit(nopython=True)
+def get_abundances_for_positive_z(elements, d_formation, z_formation, t_formation):
+    x = gm.fznd(d_formation, z_formation)
+    # Steps with exactly zero weight add nothing to the sum, so only the others are evaluated
+    # For narrow feeding zones, that's most of them
+    distances = np.empty(len(x))
+    weights = np.empty(len(x))
+    n_steps = 0
+    j = d_formation-3
+    for k in range(len(x)):
+        if x[k] != 0:
+            distances[n_steps] = j
+            weights[n_steps] = x[k]
+            n_steps += 1
+        j += 0.01
+    # The disc temperature at each step is the same for every element
+    temperatures = dm.T_disc_array(distances[:n_steps], t_formation)
+    return get_weighted_abundances(elements, weights[:n_steps], temperatures, t_formation)
+
+@jit(nopython=True)
+def get_abundances_for_positive_z_batch(elements, d_formation, z_formation, t_formation):
+    # get_abundances_for_positive_z for each point, as an (N, n_elements) array
+    toret = np.zeros((len(d_formation), len(elements)))
+    for i in range(len(d_formation)):
+        abundances = get_abundances_for_positive_z(elements, d_formation[i], z_formation[i], t_formation)
+        for j in range(len(elements)):
+            toret[i, j] = abundances[j]
+    return toret
+
+@jit(nopython=True)
+def get_quadrature_abundances_batch(elements, nodes, weights, d_formation, z_formation, t_formation):
+    # GaussHermiteQuadrature.get_abundances_for_positive_z for each point, as an (N, n_elements) array
+    toret = np.zeros((len(d_formation), len(elements)))
+    for i in range(len(d_formation)):
+        temperatures = dm.T_disc_array(d_formation[i] + z_formation[i]*nodes, t_formation)
+        abundances = get_weighted_abundances(elements, weights, temperatures, t_formation)
+        for j in range(len(elements)):
+            toret[i, j] = abundances[j]
+    return toret
+
+@jit(nopython=True)
+def get_condensation_table(elements, distances, t_formation):
+    toret = np.zeros((len(elements), len(distances)))
+    for i in range(len(distances)):
+        abundances = get_abundances_for_negative_z(elements, distances[i], t_formation)
+        for j in range(len(elements)):
+            toret[j, i] = abundances[j]
+    return toret
+
+# Precomputed condensed fraction of each element against log distance, for a single t_formation
+# The feeding zone integral in get_abundances_for_positive_z then becomes a dot product of the fznd weights with the (linearly interpolated) table,
+# rather than a disc temperature and condensation polynomial evaluation per element per step
+# This is an approximation, controlled by points_per_decade. Distances below min_distance (including those <= 0) are treated as fully hot
+class CondensationTable:
+
+    def __init__(self, t_formation, max_distance=None, elements=None, min_distance=0.001, points_per_decade=5000):
+        if max_distance is None:
+            max_distance = dm.S_disc(t_formation) + 3.01  # Feeding zones extend 3 AU either side of d_formation. Beyond the table, values are clamped
+        self.t_formation = t_formation
+        self.elements = [el for el in (ci.usual_elements if elements is None else elements) if el != ci.Element.O]
+        self.element_rows = {el: row for row, el in enumerate(self.elements)}
+        self.min_distance = min_distance
+        self.log_min_distance = np.log10(min_distance)
+        n_points = int(np.ceil(points_per_decade*(np.log10(max_distance) - self.log_min_distance))) + 1
+        self.log_distance_step = (np.log10(max_distance) - self.log_min_distance)/(n_points - 1)
+        log_distances = self.log_min_distance + self.log_distance_step*np.arange(n_points)
+        self.table = get_condensation_table(self.elements, 10**log_distances, t_formation)
+        self.hot_abundances = np.array(get_abundances_for_negative_z(self.elements, 0, t_formation))  # T_disc is 5000 K for d <= 0
+
+    def covers(self, elements, t_formation):
+        return t_formation == self.t_formation and all(el in self.element_rows or el == ci.Element.O for el in elements)
+
+    def get_abundances_for_positive_z(self, elements, d_formation, z_formation):
+        # Equivalent to get_abundances_for_positive_z (including the 0 placeholder for O)
+        weights = gm.fznd(d_formation, z_formation)
+        distances = d_formation - 3 + 0.01*np.arange(len(weights))
+        hot = distances < self.min_distance
+        positions = (np.log10(np.maximum(distances, self.min_distance)) - self.log_min_distance)/self.log_distance_step
+        lower = np.minimum(positions.astype(int), self.table.shape[1] - 2)
+        fractions = np.minimum(positions - lower, 1)
+        condensed = self.table[:, lower]*(1 - fractions) + self.table[:, lower + 1]*fractions
+        condensed[:, hot] = self.hot_abundances[:, np.newaxis]
+        all_abundances = np.dot(condensed, weights)
+        return [0 if el == ci.Element.O else all_abundances[self.element_rows[el]] for el in elements]
+
+# Gauss-Hermite quadrature for the feeding zone integral, as an alternative to the 601 step grid in get_abundances_for_positive_z
+# The feeding zone is a Gaussian in distance, so this is exact for condensed fractions which are polynomials of degree < 2*n_points in distance
+# In practice they have kinks at the condensation temperatures, so the error falls off more slowly than that: n_points controls the accuracy
+# Unlike the grid, the feeding zone is not truncated at 3 AU (though in practice z_formation is much smaller than that)
+class GaussHermiteQuadrature:
+
+    def __init__(self, n_points=40):
+        self.n_points = n_points
+        nodes, weights = np.polynomial.hermite.hermgauss(n_points)
+        self.nodes = np.sqrt(2)*nodes
+        self.weights = weights/np.sqrt(np.pi)
+
+    def get_abundances_for_positive_z(self, elements, d_formation, z_formation, t_formation):
+        # Equivalent to get_abundances_for_positive_z (including the 0 placeholder for O)
+        temperatures = dm.T_disc_array(d_formation + z_formation*self.nodes, t_formation)
+        return get_weighted_abundances(elements, self.weights, temperatures, t_formation)
+
+    def get_abundances_for_positive_z_batch(self, elements, d_formation, z_formation, t_formation):
+        return get_quadrature_abundances_batch(elements, self.nodes, self.weights, d_formation, z_formation, t_formation)
+
+# Numba has to work out the type of a (reflected) list of Elements every time it is passed into a jitted function,
+# which takes far longer than the calculation itself. A typed List only needs this once, so keep one for each list of elements
+_typed_elements = dict()
+
+def get_typed_elements(elements):
+    key = tuple(elements)
+    try:
+        return _typed_elements[key]
+    except KeyError:
+        typed_elements = typed.List(key)
+        _typed_elements[key] = typed_elements
+        return typed_elements
+
+# context is the ModelContext to take the live data from. None means the module level variables in live_data
+def get_all_abundances(elements, d_formation, z_formation, t_formation, fe_star=None, context=None):  # fe_star only required if Oxygen is one of the elements
+    context = ld.get_context(context)
     if z_formation <= 0:
-        abundances = get_abundances_for_negative_z(elements, d_formation, t_formation)
+        abundances = get_abundances_for_negative_z(get_typed_elements(elements), d_formation, t_formation)
+    elif context.condensation_table is not None and context.condensation_table.covers(elements, t_formation):
+        abundances = context.condensation_table.get_abundances_for_positive_z(elements, d_formation, z_formation)
+    elif context.feeding_zone_quadrature is not None:
+        abundances = context.feeding_zone_quadrature.get_abundances_for_positive_z(get_typed_elements(elements), d_formation, z_formation, t_formation)
     else:
-        abundances = get_abundances_for_positive_z(elements, d_formation, z_formation, t_formation)
+        abundances = get_abundances_for_positive_z(get_typed_elements(elements), d_formation, z_formation, t_formation)
     toret = dict(zip(elements, abundances))
     if ci.Element.O in elements:
         toret[ci.Element.O] = O(
@@ -135,7 +311,76 @@ def get_all_abundances(elements, d_formation, z_formation, t_formation, fe_star=
             toret[ci.Element.Cr],
             toret[ci.Element.Mg],
             toret[ci.Element.Si],
-            toret[ci.Element.Na]
+            toret[ci.Element.Na],
+            context.stellar_compositions
+        )
+    return toret
+
+# Batch version of get_all_abundances: d_formation (and optionally z_formation and fe_star) are arrays with one entry per point
+# Returns an (N, n_elements) array with columns in the same order as elements
+def get_all_abundances_batch(elements, d_formation, z_formation, t_formation, fe_star=None, context=None):
+    context = ld.get_context(context)
+    d_formation = np.atleast_1d(np.asarray(d_formation, dtype=float))
+    n_points = len(d_formation)
+    z_formation = np.broadcast_to(np.asarray(z_formation, dtype=float), (n_points,))
+    # Oxygen depends on the other abundances, so it is calculated afterwards (for all points at once, if use_compiled_oxygen is set)
+    other_elements = [element for element in elements if element != ci.Element.O]
+    typed_elements = get_typed_elements(other_elements)
+    toret = np.zeros((n_points, len(elements)))
+    other_columns = [index for index, element in enumerate(elements) if element != ci.Element.O]
+    # Same choice of method as get_all_abundances. Each compiled method does all of its points in one call
+    negative = z_formation <= 0
+    positive = ~negative
+    other_abundances = np.zeros((n_points, len(other_elements)))
+    if np.any(negative):
+        other_abundances[negative] = get_condensation_table(typed_elements, d_formation[negative], t_formation).T
+    if np.any(positive):
+        if context.condensation_table is not None and context.condensation_table.covers(other_elements, t_formation):
+            other_abundances[positive] = [context.condensation_table.get_abundances_for_positive_z(other_elements, d, z) for d, z in zip(d_formation[positive], z_formation[positive])]
+        elif context.feeding_zone_quadrature is not None:
+            other_abundances[positive] = context.feeding_zone_quadrature.get_abundances_for_positive_z_batch(typed_elements, d_formation[positive], z_formation[positive], t_formation)
+        else:
+            other_abundances[positive] = get_abundances_for_positive_z_batch(typed_elements, d_formation[positive], z_formation[positive], t_formation)
+    toret[:, other_columns] = other_abundances
+    if ci.Element.O in elements and not use_compiled_oxygen:
+        # The pure Python O calculation still goes point by point
+        fe_star = np.broadcast_to(fe_star, (n_points,))
+        O_column = elements.index(ci.Element.O)
+        columns = [toret[:, elements.index(element)].tolist() for element in [ci.Element.Al, ci.Element.Ti, ci.Element.Ca, ci.Element.Ni, ci.Element.Fe, ci.Element.Cr, ci.Element.Mg, ci.Element.Si, ci.Element.Na]]
+        for i, (Al, Ti, Ca, Ni, Fe, Cr, Mg, Si, Na) in enumerate(zip(*columns)):
+            toret[i, O_column] = O(
+                dm.T_disc(d_formation[i], t_formation),
+                t_formation,
+                d_formation[i],
+                fe_star[i],
+                z_formation[i],
+                Al,
+                Ti,
+                Ca,
+                Ni,
+                Fe,
+                Cr,
+                Mg,
+                Si,
+                Na,
+                context.stellar_compositions
+            )
+    elif ci.Element.O in elements:
+        columns = dict(zip(other_elements, toret[:, other_columns].T))
+        floored_fe_star = np.floor(np.broadcast_to(fe_star, (n_points,))).astype(int)
+        toret[:, elements.index(ci.Element.O)] = O_c_batch(
+            d_formation,
+            t_formation,
+            context.stellar_compositions[floored_fe_star],
+            columns[ci.Element.Al],
+            columns[ci.Element.Ti],
+            columns[ci.Element.Ca],
+            columns[ci.Element.Ni],
+            columns[ci.Element.Fe],
+            columns[ci.Element.Cr],
+            columns[ci.Element.Mg],
+            columns[ci.Element.Si],
+            columns[ci.Element.Na]
         )
     return toret
 
@@ -4,11 +4,12 @@ import numpy as np
 import abundance_model as am
 import disc_model as dm
 import chemistry_info as ci
+import pwd_utils as pu
 import live_data as ld
 import solar_abundances as sa
 
 def load_generic_float_data_csv(input_filename):
-    generic_csv = open('../data/' + input_filename)
+    generic_csv = open(pu.get_path_to_data() + input_filename)
     generic_list =  [row for row in csv.reader(generic_csv)]
     generic_array = np.asarray(generic_list)
     return generic_array.astype(np.float)
@@ -5,6 +5,7 @@ import chemistry_info as ci
 import geology_info as gi
 import graph_factory as gf
 import model_parameters as mp
+import pwd_utils as pu
 import timescale_interpolator as ti
 
 import csv
@@ -521,7 +522,7 @@ def example():
 
 def main():
     example()
-    wd_dict = read_wd_csv_into_dict('../data/WDInputData.csv')
+    wd_dict = read_wd_csv_into_dict(pu.get_path_to_data() + 'WDInputData.csv')
     batch_convert(wd_dict)
 
 if __name__ == '__main__':
@@ -4,6 +4,7 @@
 import collections
 import math
 import numpy as np
+import time
 
 import abundance_model as am
 import chemistry_info as ci
@@ -32,11 +33,25 @@ import white_dwarf_model as wdm
 #(<Element.C: 6>, -6.37123220460242),
 #(<Element.N: 7>, -7.199452361943866)])
 
+def update_live_geo_model(disc_abundances, context=None):
+    # This is to speed up performance by making sure we only need to fully initialise the geo_model (and by extension the partitioning model) once
+    # (per context: each context has its own geo_model)
+    context = ld.get_context(context)
+    if context.geo_model is None:
+        context.geo_model = gi.GeologyModel(disc_abundances)
+    else:
+        context.geo_model.reinit(disc_abundances)
+    context.geo_model.formation_cache = context.formation_cache
+    context.geo_model.warm_start_index = context.warm_start_index
+    context.geo_model.solver = context.formation_solver
+    return context.geo_model
+
 # TODOs:
 # Move enhancement_model argument somewhere else. Maybe make it a member of the PollutionModel class?
 # It's a bit awkward to force the user to manually ensure that t_disc is linear (i.e. not log(t_disc)) given that's how we return it at the end
 # And we should really model relative abundances as far as possible! The uncertainty on those should be smaller than the absolute values
-def complete_model_calculation(fe_star, t_sinceaccretion, d_formation, z_formation, N_c, N_o, f_c, f_o, pollutionfraction, t_disc, pressure, fO2, enhancement_model='NonEarthlike', t_formation=1.5, normalise_abundances=True, snapshot_wd_atm=True):
+# context is the ModelContext to take the live data from. None means the module level variables in live_data
+def complete_model_calculation(fe_star, t_sinceaccretion, d_formation, z_formation, N_c, N_o, f_c, f_o, pollutionfraction, t_disc, pressure, fO2, enhancement_model='NonEarthlike', t_formation=1.5, normalise_abundances=True, snapshot_wd_atm=True, context=None):
 
     #print()
     #print('cm42')
@@ -58,16 +73,22 @@ def complete_model_calculation(fe_star, t_sinceaccretion, d_formation, z_formati
     #if enhancement_model == 'Earthlike':
     #    normalise_abundances = False # Slight hack for testing purposes
 
+    context = ld.get_context(context)
+    profiler = context.profiler
+    if profiler is not None:
+        stage_start = time.perf_counter()
     diagnostics = dict()
     elements = ci.usual_elements
     # This limit on fe_star exists because outside of this range,
-    # ld._live_stellar_compositions[int(round(fe_star))] will give a KeyError (there are 958 compositions)
+    # context.stellar_compositions[int(round(fe_star))] will give a KeyError (there are 958 compositions)
     floored_fe_star = math.floor(fe_star)
     if 0 <= floored_fe_star <= 957:
         # TODO: Remove all magic numbers! Do foo.Mg or foo['Mg'] or something instead of foo[6]
         linear_d_formation = 10**(d_formation)
 
-        abundances = am.get_all_abundances(elements, linear_d_formation, z_formation, t_formation, fe_star)
+        abundances = am.get_all_abundances(elements, linear_d_formation, z_formation, t_formation, fe_star, context)
+        if profiler is not None:
+            stage_start = profiler.record('Abundances', stage_start)
 
         disc_abundances = dict()
         for el_index, element in enumerate(elements):
@@ -75,19 +96,20 @@ def complete_model_calculation(fe_star, t_sinceaccretion, d_formation, z_formati
                 # Mg is special
                 disc_abundances[element] = abundances[element]
             else:
-                disc_abundances[element] = abundances[element] * ld._live_stellar_compositions[floored_fe_star][el_index - 1 if el_index > 6 else el_index]
+                disc_abundances[element] = abundances[element] * context.stellar_compositions[floored_fe_star][el_index - 1 if el_index > 6 else el_index]
 
         diagnostics['DiscAbundances'] = disc_abundances
+        if profiler is not None:
+            stage_start = profiler.record('Disc abundances', stage_start)
 
-        # This is to speed up performance by making sure we only need to fully initialise the geo_model (and by extension the partitioning model) once
-        if ld._geo_model is None:
-            ld._geo_model = gi.GeologyModel(disc_abundances)
-        else:
-            ld._geo_model.reinit(disc_abundances)
+        geo_model = update_live_geo_model(disc_abundances, context)
+        if profiler is not None:
+            geo_model.last_iteration_count = None  # So that we only count solves which happen during this calculation
+            stage_start = profiler.record('Geology model', stage_start)
 
-        enhancement_model = em.EnhancementModel(enhancement_model)
+        enhancement_model = em.get_enhancement_model(enhancement_model)
         enhancements_dict, enhancements_diagnostics = enhancement_model.find_enhancements(
-            ld._geo_model,
+            geo_model,
             disc_abundances,
             elements,
             N_c,
@@ -98,6 +120,10 @@ def complete_model_calculation(fe_star, t_sinceaccretion, d_formation, z_formati
             fO2,
             normalise_abundances
         )
+        if profiler is not None:
+            stage_start = profiler.record('Enhancements', stage_start)
+            profiler.record_iterations(geo_model.last_iteration_count)
+            profiler.record_model_results(1, 1 if enhancements_dict is None else 0)
 
         if enhancements_dict is None:
             return None, None
@@ -110,10 +136,12 @@ def complete_model_calculation(fe_star, t_sinceaccretion, d_formation, z_formati
             t_sinceaccretion,
             t_disc,
             planetesimal_abundance,
-            ld._live_all_wd_timescales,
+            context.all_wd_timescales,
             pollutionfraction,
             snapshot_wd_atm
         )
+        if profiler is not None:
+            profiler.record('White dwarf model', stage_start)
     else:
         raise ValueError("Metallicity must be between 0 and 958")
     elements_present_dict = collections.OrderedDict(zip(elements, result))
@@ -121,3 +149,94 @@ def complete_model_calculation(fe_star, t_sinceaccretion, d_formation, z_formati
     for element in elements:
         toret[element] = elements_present_dict.get(element)
     return toret, diagnostics
+
+def broadcast_parameter(value, n_points):
+    # Parameters which are not used by a model may be None, which can't live in a float array
+    if value is None:
+        return [None]*n_points
+    return np.broadcast_to(np.asarray(value, dtype=float), (n_points,))
+
+def get_disc_abundances_batch(elements, abundances, floored_fe_star, context=None):
+    # Same as the disc_abundances loop in complete_model_calculation, but for an (N, n_elements) array of abundances
+    # The stellar compositions have no Mg column, so Mg is scaled by 1 and the remaining columns are shifted accordingly
+    compositions = ld.get_context(context).stellar_compositions[floored_fe_star]
+    scalings = np.ones(abundances.shape)
+    for el_index, element in enumerate(elements):
+        if el_index != 6:
+            scalings[:, el_index] = compositions[:, el_index - 1 if el_index > 6 else el_index]
+    return abundances*scalings
+
+# Batch version of complete_model_calculation. Each parameter can be either an array (one entry per point) or a scalar shared by all points
+# Returns an (N, n_elements) array of model abundances (columns ordered as ci.usual_elements) and a boolean array
+# flagging which points produced a result (complete_model_calculation would have returned None for the others)
+def complete_model_calculation_batch(fe_star, t_sinceaccretion, d_formation, z_formation, N_c, N_o, f_c, f_o, pollutionfraction, t_disc, pressure, fO2, enhancement_model='NonEarthlike', t_formation=1.5, normalise_abundances=True, snapshot_wd_atm=True, context=None):
+    context = ld.get_context(context)
+    profiler = context.profiler
+    if profiler is not None:
+        stage_start = time.perf_counter()
+    elements = ci.usual_elements
+    all_params = [fe_star, t_sinceaccretion, d_formation, z_formation, N_c, N_o, f_c, f_o, pollutionfraction, t_disc, pressure, fO2]
+    n_points = np.broadcast(*[param for param in all_params if param is not None]).size
+    fe_star, t_sinceaccretion, d_formation, z_formation, N_c, N_o, f_c, f_o, pollutionfraction, t_disc, pressure, fO2 = [broadcast_parameter(param, n_points) for param in all_params]
+
+    floored_fe_star = np.floor(fe_star).astype(int)
+    if np.any(floored_fe_star < 0) or np.any(floored_fe_star > 957):
+        raise ValueError("Metallicity must be between 0 and 958")
+    linear_d_formation = 10**(d_formation)
+
+    abundances = am.get_all_abundances_batch(elements, linear_d_formation, z_formation, t_formation, fe_star, context)
+    if profiler is not None:
+        stage_start = profiler.record('Abundances', stage_start, n_points)
+    disc_abundances = get_disc_abundances_batch(elements, abundances, floored_fe_star, context)
+    if profiler is not None:
+        stage_start = profiler.record('Disc abundances', stage_start, n_points)
+
+    # Only the planet formation (if the model needs it) is solved point by point: everything either side of it works on whole arrays
+    enhancement_model = em.get_enhancement_model(enhancement_model)
+    solved = np.ones(n_points, dtype=bool)
+    core_abundances = None
+    mantle_abundances = None
+    if enhancement_model.forms_planets(f_o[0]):
+        core_abundances = np.full((n_points, len(elements)), np.nan)
+        mantle_abundances = np.full((n_points, len(elements)), np.nan)
+        for i in range(n_points):
+            geo_model = update_live_geo_model(dict(zip(elements, disc_abundances[i])), context)
+            if profiler is not None:
+                geo_model.last_iteration_count = None
+                stage_start = profiler.record('Geology model', stage_start)
+            number_abundances = geo_model.form_a_planet_iteratively(pressure[i], fO2[i])[0]
+            if profiler is not None:
+                stage_start = profiler.record('Enhancements', stage_start)
+                profiler.record_iterations(geo_model.last_iteration_count)
+            if number_abundances is None:
+                solved[i] = False
+            else:
+                core_abundances[i] = [number_abundances[element][gi.Layer.core] for element in elements]
+                mantle_abundances[i] = [number_abundances[element][gi.Layer.mantle] for element in elements]
+    enhancements, valid = enhancement_model.find_enhancements_batch(
+        disc_abundances,
+        elements,
+        N_c,
+        N_o,
+        f_c,
+        f_o,
+        core_abundances,
+        mantle_abundances,
+        normalise_abundances
+    )
+    valid = valid & solved
+    if profiler is not None:
+        stage_start = profiler.record('Enhancements', stage_start, 0 if core_abundances is not None else n_points)
+        profiler.record_model_results(n_points, n_points - np.count_nonzero(valid))
+
+    result = wdm.process_abundances_batch(
+        t_sinceaccretion,
+        t_disc,
+        enhancements,
+        context.all_wd_timescales,
+        pollutionfraction,
+        snapshot_wd_atm
+    )
+    if profiler is not None:
+        profiler.record('White dwarf model', stage_start, n_points)
+    return result, valid
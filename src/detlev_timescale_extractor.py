@@ -4,6 +4,7 @@
 import collections
 import csv
 import chemistry_info as ci
+import pwd_utils as pu
 
 def load_detlev_data():
     toret = dict()
@@ -26,7 +27,7 @@ def load_detlev_data():
             toret[HorHe][g] = dict()
             T_vals = list()
             q_vals = list()
-            with open('../data/' + file_dict[HorHe][g]) as csvfile:
+            with open(pu.get_path_to_data() + file_dict[HorHe][g]) as csvfile:
                 read = csv.reader(csvfile, delimiter=',')
                 i = 0
                 for row in read:
@@ -131,7 +132,7 @@ def extract_timescales(data, HorHe, Teff, logg):
 
 def load_wd_data():
     toret = collections.OrderedDict()
-    with open('../data/WDInputData.csv') as csvfile:
+    with open(pu.get_path_to_data() + 'WDInputData.csv') as csvfile:
         read = csv.reader(csvfile, delimiter=',')
         i = 0
         for row in read:
@@ -4,6 +4,8 @@
 # This is more of a fragment abundance calculator now, rather than an enhancement model!
 
 from enum import Enum
+import numpy as np
+
 import chemistry_info as ci
 import geology_info as gi
 
@@ -21,6 +23,14 @@ class EnhancementModel():
             'Meteorite': self.find_enhancements_nonearthlike
         }
         self.model = self.known_models.get(self.model_type)
+        self.known_batch_models = {
+            'Earthlike': self.find_enhancements_earthlike_batch,
+            'NonEarthlike': self.find_enhancements_nonearthlike_batch,
+            'MantleOnly': self.find_enhancements_nonearthlike_batch,
+            'EarthMantle': self.find_enhancements_nonearthlike_batch,
+            'Meteorite': self.find_enhancements_nonearthlike_batch
+        }
+        self.batch_model = self.known_batch_models.get(self.model_type)
         if self.model is None:
             try:
                 model_str = str(model_type)
@@ -43,6 +53,25 @@ class EnhancementModel():
             ci.Element.Ni: {'default_e': 0, 'fill_core_first': False}
         }
 
+    def get_earthlike_reference_abundances(self, elements, normalise_abundances):
+        # Returns lists of the Earth's bulk, crust and core abundances of each element (and whether to fill the core first),
+        # in the order of elements. These never change, so they're only worked out once per process
+        key = (tuple(elements), normalise_abundances)
+        try:
+            return _earthlike_reference_abundances[key]
+        except KeyError:
+            earthlike_geo_model = get_earthlike_geo_model(normalise_abundances)
+            # Lists rather than numpy arrays: the loop in find_enhancements_earthlike works on one element at a time,
+            # and iterating over Python floats is faster than indexing an array (and gives exactly the same answers as before)
+            reference_abundances = (
+                [earthlike_geo_model.get_bulk_abundance(element) for element in elements],
+                [earthlike_geo_model.get_crust_abundance(element) for element in elements],
+                [earthlike_geo_model.get_core_abundance(element) for element in elements],
+                [self.earthlike_info[element]['fill_core_first'] for element in elements]
+            )
+            _earthlike_reference_abundances[key] = reference_abundances
+            return reference_abundances
+
     def find_enhancements(
         self,
         geo_model,
@@ -94,6 +123,81 @@ class EnhancementModel():
         }
         return enhancements, diagnostics_dict
 
+    def forms_planets(self, fragment_core_number_fraction):
+        # Whether find_enhancements needs a planet formation solve (i.e. whether find_enhancements_batch needs core and mantle abundances)
+        return self.model == self.find_enhancements_nonearthlike and fragment_core_number_fraction is not None
+
+    # Batch version of find_enhancements. disc_abundances is an (N, n_elements) array (columns ordered as elements), and each
+    # fraction is an array with one entry per point (or a list of None). Rather than a geo_model, the batch version takes (N, n_elements)
+    # arrays of the core and mantle abundances from each point's planet formation solve (only needed if forms_planets is True).
+    # Returns an (N, n_elements) array of enhancements, and which points produced a result (not counting any failed solves)
+    def find_enhancements_batch(
+        self,
+        disc_abundances,
+        elements,
+        parent_core_number_fraction,
+        parent_crust_number_fraction,
+        fragment_core_number_fraction,
+        fragment_crust_number_fraction,
+        core_abundances=None,
+        mantle_abundances=None,
+        normalise_abundances=True
+    ):
+        return self.batch_model(
+            disc_abundances,
+            elements,
+            parent_core_number_fraction,
+            parent_crust_number_fraction,
+            fragment_core_number_fraction,
+            fragment_crust_number_fraction,
+            core_abundances,
+            mantle_abundances,
+            normalise_abundances
+        )
+
+    def find_enhancements_nonearthlike_batch(self, disc_abundances, elements, parent_core_number_fraction, parent_crust_number_fraction, fragment_core_number_fraction, fragment_crust_number_fraction, core_abundances, mantle_abundances, normalise_abundances=True):
+        if fragment_core_number_fraction[0] is None:
+            # This means no differentiation took place
+            return disc_abundances, np.ones(len(disc_abundances), dtype=bool)
+        fragment_core_number_fraction = np.asarray(fragment_core_number_fraction, dtype=float)[:, np.newaxis]
+        fragment_mantle_number_fraction = 1 - fragment_core_number_fraction
+        enhancements = (fragment_mantle_number_fraction*mantle_abundances) + (fragment_core_number_fraction*core_abundances)
+        return enhancements, np.ones(len(enhancements), dtype=bool)
+
+    def find_enhancements_earthlike_batch(self, disc_abundances, elements, parent_core_number_fraction, parent_crust_number_fraction, fragment_core_number_fraction, fragment_crust_number_fraction, core_abundances_ignore, mantle_abundances_ignore, normalise_abundances=True):
+        # Same arithmetic as find_enhancements_earthlike, on (N, 1) arrays of fractions and (n_elements,) arrays of reference abundances
+        fractions = [parent_core_number_fraction, parent_crust_number_fraction, fragment_core_number_fraction, fragment_crust_number_fraction]
+        if any(fraction[0] is None for fraction in fractions):
+            # This means no differentiation took place
+            return disc_abundances, np.ones(len(disc_abundances), dtype=bool)
+        pc, pcr, fc, fcr = [np.asarray(fraction, dtype=float)[:, np.newaxis] for fraction in fractions]
+        # Points with a parent crust fraction of 1 (which the priors don't allow) would raise a ZeroDivisionError in find_enhancements_earthlike
+        with np.errstate(divide='ignore', invalid='ignore'):
+            parent_is_physical = (0.19 >= pc) & (pc >= 0) & (pcr >= 0) & (pc + pcr <= 1)
+            fragment_is_physical = (fc >= 0) & (fcr >= 0) & (fc + fcr <= 1)
+            fragment_is_physical &= ~((fc > pc) & (fcr > pcr))
+            fragment_is_physical &= ~((fc > (pc/(1-pcr))) & (fcr > 0.01))
+            fragment_is_physical &= ~(((pc/(1-pcr)) >= fc) & (fc >= pc) & (fc - pc > (pcr-fcr)*(pc/(1-pcr))))
+            valid = (fragment_is_physical & parent_is_physical)[:, 0]
+
+            parent_bulk_abundance, parent_crust_abundance, parent_core_abundance, fill_core_first = [np.array(reference) for reference in self.get_earthlike_reference_abundances(elements, normalise_abundances)]
+            fragment_mantle_number_fraction = 1 - (fc + fcr)
+            parent_mantle_number_fraction = 1 - (pc + pcr)
+            parent_mantle_abundance = (parent_bulk_abundance - ((parent_crust_abundance*pcr) + (parent_core_abundance*pc)))/parent_mantle_number_fraction
+            mantle_is_positive = parent_mantle_abundance >= 0
+            fragment_mantle_abundance = np.where(mantle_is_positive, parent_mantle_abundance, 0)
+            fragment_crust_abundance = np.where(mantle_is_positive | ~fill_core_first, parent_crust_abundance, (parent_bulk_abundance - (parent_core_abundance*pc))/pcr)
+            fragment_core_abundance = np.where(mantle_is_positive | fill_core_first, parent_core_abundance, (parent_bulk_abundance - (parent_crust_abundance*pcr))/pc)
+
+            fragment_bulk_abundance_term1 = fcr*fragment_crust_abundance
+            fragment_bulk_abundance_term2 = fragment_mantle_number_fraction*fragment_mantle_abundance
+            fragment_bulk_abundance_term3 = fc*fragment_core_abundance
+            fragment_bulk_abundance = fragment_bulk_abundance_term1 + fragment_bulk_abundance_term2 + fragment_bulk_abundance_term3
+
+            enhancements = disc_abundances*(fragment_bulk_abundance/parent_bulk_abundance)
+        enhancements[~valid] = np.nan
+        return enhancements, valid
+
     def find_enhancements_earthlike(self, geo_model_ignore, disc_abundances, elements, parent_core_number_fraction, parent_crust_number_fraction, fragment_core_number_fraction, fragment_crust_number_fraction, pressure, fO2, normalise_abundances=True, extra_output=False):
         if (parent_core_number_fraction is None) or (parent_crust_number_fraction is None) or (fragment_core_number_fraction is None) or (fragment_crust_number_fraction is None):
             # This means no differentiation took place
@@ -108,14 +212,11 @@ class EnhancementModel():
         if not (fragment_is_physical and parent_is_physical):
             return None, {'ParentCoreNumberFraction': parent_core_number_fraction}
         else:
-            # Ignore the input geo_model because it could be non-Earth-like, instead make a new one:
-            earthlike_geo_model = gi.GeologyModel(None, normalise_abundances)
+            # Ignore the input geo_model because it could be non-Earth-like, instead use the Earth reference abundances:
+            reference_abundances = self.get_earthlike_reference_abundances(elements, normalise_abundances)
             fragment_mantle_number_fraction = 1 - (fragment_core_number_fraction + fragment_crust_number_fraction)
             parent_mantle_number_fraction = 1 - (parent_core_number_fraction + parent_crust_number_fraction)
-            for element in elements:
-                parent_bulk_abundance = earthlike_geo_model.get_bulk_abundance(element)
-                parent_crust_abundance = earthlike_geo_model.get_crust_abundance(element)
-                parent_core_abundance = earthlike_geo_model.get_core_abundance(element)
+            for element, parent_bulk_abundance, parent_crust_abundance, parent_core_abundance, fill_core_first in zip(elements, *reference_abundances):
                 parent_mantle_abundance = (parent_bulk_abundance - ((parent_crust_abundance*parent_crust_number_fraction) + (parent_core_abundance*parent_core_number_fraction)))/parent_mantle_number_fraction
 
                 if parent_mantle_abundance >= 0:
@@ -124,7 +225,7 @@ class EnhancementModel():
                     fragment_core_abundance = parent_core_abundance
                 else:
                     fragment_mantle_abundance = 0
-                    if self.earthlike_info[element]['fill_core_first']:
+                    if fill_core_first:
                         fragment_crust_abundance = (parent_bulk_abundance - (parent_core_abundance*parent_core_number_fraction))/parent_crust_number_fraction
                         fragment_core_abundance = parent_core_abundance
                     else:
@@ -139,3 +240,28 @@ class EnhancementModel():
                 enhancements[element] = disc_abundances[element]*(fragment_bulk_abundance/parent_bulk_abundance)
         diagnostics_dict = {'ParentCoreNumberFraction': parent_core_number_fraction}
         return enhancements, diagnostics_dict
+
+# Constructing an EnhancementModel (and especially the Earth GeologyModel, which reads the PAMELA data files) on every likelihood call
+# is wasteful, because neither of them depend on the parameters. So keep one of each per process
+_enhancement_models = dict()
+_earthlike_geo_models = dict()
+_earthlike_reference_abundances = dict()
+
+def get_enhancement_model(model_type):
+    try:
+        return _enhancement_models[model_type]
+    except KeyError:
+        enhancement_model = EnhancementModel(model_type)  # Raises ValueError for unknown models, so they're never cached
+        _enhancement_models[model_type] = enhancement_model
+        return enhancement_model
+    except TypeError:
+        # model_type is unhashable, so can't be a known model. Let the constructor report it
+        return EnhancementModel(model_type)
+
+def get_earthlike_geo_model(normalise_abundances=True):
+    try:
+        return _earthlike_geo_models[normalise_abundances]
+    except KeyError:
+        earthlike_geo_model = gi.GeologyModel(None, normalise_abundances)
+        _earthlike_geo_models[normalise_abundances] = earthlike_geo_model
+        return earthlike_geo_model
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import numpy as np
+import time
+
+import abundance_model as am
+import chemistry_info as ci
+
+# Compares Gauss-Hermite feeding zone integration (am.GaussHermiteQuadrature) against the original 601 step grid
+# (am.get_abundances_for_positive_z), in terms of both accuracy and time per call
+
+def time_per_call(function, n_repeats):
+    function()  # Make sure everything is compiled before timing
+    start = time.perf_counter()
+    for i in range(n_repeats):
+        function()
+    return (time.perf_counter() - start)/n_repeats
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark feeding zone quadrature against the 601 step grid')
+    parser.add_argument('--n_samples', default=500, type=int, help='Number of random (d_formation, z_formation) points to compare')
+    parser.add_argument('--n_points', default=[10, 20, 40, 80, 160], nargs='+', type=int, help='Gauss-Hermite point counts to test')
+    parser.add_argument('--t_formation', default=1.5, type=float, help='Formation time /Myr')
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    elements = am.get_typed_elements([el for el in ci.usual_elements if el != ci.Element.O])
+    rng = np.random.default_rng(args.seed)
+    # Same ranges as the default prior: log10(d_formation) up to log10(S_disc(1.5)), z_formation up to 0.15
+    d_formations = 10**rng.uniform(-1.5, 2.78, args.n_samples)
+    z_formations = rng.uniform(0, 0.15, args.n_samples)
+    reference = np.array([am.get_abundances_for_positive_z(elements, d, z, args.t_formation) for d, z in zip(d_formations, z_formations)])
+
+    print('Method'.ljust(20) + ' | ' + 'Max abs error'.ljust(14) + ' | ' + 'Mean abs error'.ljust(14) + ' | ' + 'Time per call /us')
+    grid_time = time_per_call(lambda: [am.get_abundances_for_positive_z(elements, d, z, args.t_formation) for d, z in zip(d_formations, z_formations)], 3)/args.n_samples
+    print('601 step grid'.ljust(20) + ' | ' + str(0.0).ljust(14) + ' | ' + str(0.0).ljust(14) + ' | ' + str(round(grid_time*1e6, 2)))
+    for n_points in args.n_points:
+        quadrature = am.GaussHermiteQuadrature(n_points)
+        results = np.array([quadrature.get_abundances_for_positive_z(elements, d, z, args.t_formation) for d, z in zip(d_formations, z_formations)])
+        errors = np.abs(results - reference)
+        quadrature_time = time_per_call(lambda: [quadrature.get_abundances_for_positive_z(elements, d, z, args.t_formation) for d, z in zip(d_formations, z_formations)], 3)/args.n_samples
+        print(('Gauss-Hermite ' + str(n_points)).ljust(20) + ' | ' + ('%.3g' % np.max(errors)).ljust(14) + ' | ' + ('%.3g' % np.mean(errors)).ljust(14) + ' | ' + str(round(quadrature_time*1e6, 2)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import numpy as np
+
+from scipy import spatial
+
+import chemistry_info as ci
+
+# Caches the output of GeologyModel.form_a_planet_iteratively so that repeated (or, if a tolerance is set, nearby) solves can be skipped
+# Keys are built from the (normalised) bulk composition, pressure, fO2, temperature and nbot
+# With tolerance = 0 (the default) only exact repeats are matched, so results are unchanged
+# With tolerance > 0, bulk abundances are binned in log space (bin width = tolerance, in dex) and pressure/fO2 are binned linearly,
+# and any point falling in the same bin as a previous solve gets that solve's result. This is an approximation!
+class PlanetFormationCache:
+
+    def __init__(self, max_size=1000, tolerance=0, pressure_tolerance=None, fO2_tolerance=None):
+        self.max_size = max_size
+        self.tolerance = tolerance
+        self.pressure_tolerance = tolerance if pressure_tolerance is None else pressure_tolerance
+        self.fO2_tolerance = tolerance if fO2_tolerance is None else fO2_tolerance
+        self.results = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def empty_copy(self):
+        # A new, empty cache with the same settings
+        return PlanetFormationCache(self.max_size, self.tolerance, self.pressure_tolerance, self.fO2_tolerance)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __str__(self):
+        return 'PlanetFormationCache: ' + str(len(self)) + '/' + str(self.max_size) + ' entries, ' + str(self.hits) + ' hits, ' + str(self.misses) + ' misses (hit rate ' + str(round(100*self.get_hit_rate(), 2)) + '%)'
+
+    def get_hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits/total if total > 0 else 0
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.results = collections.OrderedDict()
+        self.reset_counters()
+
+    def quantise(self, value, tolerance):
+        if tolerance <= 0 or value is None:
+            return value
+        return int(np.floor(value/tolerance))
+
+    def quantise_abundance(self, abundance):
+        if self.tolerance <= 0 or abundance <= 0:
+            return abundance
+        return int(np.floor(np.log10(abundance)/self.tolerance))
+
+    def make_key(self, bulk_abundances, pressure, fO2, temp=None, nbot=None):
+        composition_key = tuple((element, self.quantise_abundance(abundance)) for element, abundance in bulk_abundances.items())
+        return (
+            composition_key,
+            self.quantise(pressure, self.pressure_tolerance),
+            self.quantise(fO2, self.fO2_tolerance),
+            temp,
+            nbot
+        )
+
+    def get(self, key):
+        # Returns (True, result) on a hit and (False, None) on a miss. A cached result may itself be None (failed solve)
+        try:
+            result = self.results[key]
+        except KeyError:
+            self.misses += 1
+            return False, None
+        self.results.move_to_end(key)
+        self.hits += 1
+        return True, result
+
+    def add(self, key, result):
+        if self.max_size <= 0:
+            return
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+
+# Keeps a spatial index of recently converged planet formation solutions, so that a new solve can be seeded (warm started)
+# with the w_met and Ds of the nearest previous solution rather than starting from scratch
+# Points are placed in a space of pressure, fO2 and log bulk abundance ratios (relative to Mg) of the elements which matter most for partitioning
+# The KD-tree is only rebuilt every rebuild_interval insertions: solutions added since the last rebuild are searched by brute force
+class WarmStartIndex:
+
+    def __init__(self, max_size=2000, rebuild_interval=100, pressure_scale=10, fO2_scale=1, ratio_elements=None):
+        self.max_size = max_size
+        self.rebuild_interval = rebuild_interval
+        self.pressure_scale = pressure_scale  # Distances are measured in units of pressure_scale GPa, fO2_scale log units and 1 dex
+        self.fO2_scale = fO2_scale
+        self.ratio_elements = ratio_elements if ratio_elements is not None else [ci.Element.Fe, ci.Element.Si, ci.Element.Ni, ci.Element.O, ci.Element.Cr, ci.Element.C]
+        self.points = collections.deque(maxlen=max_size)
+        self.solutions = collections.deque(maxlen=max_size)
+        self.tree = None
+        self.tree_size = 0
+        self.insertions_since_rebuild = 0
+        self.iteration_histograms = {True: collections.Counter(), False: collections.Counter()}  # Keyed by whether the solve was warm started
+
+    def empty_copy(self):
+        # A new, empty index with the same settings
+        return WarmStartIndex(self.max_size, self.rebuild_interval, self.pressure_scale, self.fO2_scale, self.ratio_elements)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __str__(self):
+        toret = 'WarmStartIndex: ' + str(len(self)) + '/' + str(self.max_size) + ' solutions'
+        for label, stats in self.get_iteration_stats().items():
+            if stats['solves'] > 0:
+                toret += ', ' + str(stats['solves']) + ' ' + label + ' solves (mean ' + str(round(stats['mean_iterations'], 2)) + ' iterations, max ' + str(stats['max_iterations']) + ')'
+        return toret
+
+    def get_iteration_stats(self):
+        toret = dict()
+        for warm, label in [(True, 'warm'), (False, 'cold')]:
+            histogram = self.iteration_histograms[warm]
+            n_solves = sum(histogram.values())
+            toret[label] = {
+                'solves': n_solves,
+                'mean_iterations': sum(count*frequency for count, frequency in histogram.items())/n_solves if n_solves > 0 else None,
+                'max_iterations': max(histogram.keys()) if n_solves > 0 else None,
+                'histogram': dict(sorted(histogram.items()))
+            }
+        return toret
+
+    def make_point(self, bulk_abundances, pressure, fO2):
+        mg_abundance = max(bulk_abundances.get(ci.Element.Mg, 0), self.minimum_abundance())
+        point = [pressure/self.pressure_scale, fO2/self.fO2_scale]
+        for element in self.ratio_elements:
+            point.append(np.log10(max(bulk_abundances.get(element, 0), self.minimum_abundance())/mg_abundance))
+        return np.array(point)
+
+    def minimum_abundance(self):
+        return 1e-30  # Avoids taking the log of 0
+
+    def rebuild(self):
+        if len(self.points) > 0:
+            self.tree = spatial.cKDTree(np.array(self.points))
+        else:
+            self.tree = None
+        self.tree_size = len(self.points)
+        self.insertions_since_rebuild = 0
+
+    def find_nearest(self, point):
+        # Returns the stored (w_met, Ds) closest to point, or None if nothing has been stored yet
+        if len(self.points) == 0:
+            return None
+        best_index = None
+        best_distance = np.inf
+        # Once the deque is full, appending discards from the left, so the tree's indices are offset by the number of discarded points
+        n_discarded = min(self.insertions_since_rebuild, self.tree_size + self.insertions_since_rebuild - len(self.points))
+        if self.tree is not None:
+            distance, index = self.tree.query(point)
+            index -= n_discarded
+            if index >= 0:
+                best_distance = distance
+                best_index = index
+        for index in range(max(len(self.points) - self.insertions_since_rebuild, 0), len(self.points)):
+            distance = np.linalg.norm(self.points[index] - point)
+            if distance < best_distance:
+                best_distance = distance
+                best_index = index
+        if best_index is None:
+            return None
+        return self.solutions[best_index]
+
+    def add(self, point, w_met, Ds):
+        self.points.append(point)
+        self.solutions.append((w_met, dict(Ds)))
+        self.insertions_since_rebuild += 1
+        if self.insertions_since_rebuild >= self.rebuild_interval:
+            self.rebuild()
+
+    def record_iterations(self, iteration_count, warm_started):
+        self.iteration_histograms[warm_started][iteration_count] += 1
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+import chemistry_info as ci
+
+# Alternative solvers for the core-mantle differentiation fixed point in GeologyModel.form_a_planet_iteratively
+# The fixed point is over the state (Ds, w_met): calculate the layer abundances from (Ds, w_met), then recalculate the Ds from those abundances
+# PicardSolver just calls the original iteration scheme (GeologyModel.form_a_planet_picard), which remains the reference
+# The accelerated solvers work on the vector [log10(D) for each partitioning element] + [w_met], apply the same O and Si caps,
+# and use the same convergence check (GeologyModel.check_convergence) as the reference. They do not fall back on the grid method
+# All solvers return (abundances, w_met, Ds, all_Ds), or None for each if they fail to converge, and set geo_model.last_iteration_count
+
+class PicardSolver:
+
+    def __init__(self):
+        self.name = 'picard'
+
+    def solve(self, geo_model, pressure, fO2, temp=None, nbot=None, initial_w_met=None, initial_Ds=None, return_all_Ds=False):
+        return geo_model.form_a_planet_picard(pressure, fO2, temp, nbot, initial_w_met, initial_Ds, return_all_Ds)
+
+class SolveState:
+    # The state of a single solve, kept separate from the solver so that one solver can be used for several solves at once
+    # (e.g. by copies of a ModelContext on different threads)
+
+    def __init__(self, passive_Ds, active_elements, calculate_mantle):
+        self.passive_Ds = passive_Ds
+        self.active_elements = active_elements
+        self.calculate_mantle = calculate_mantle
+
+class AcceleratedSolver:
+    # Base class for solvers which treat the differentiation as a vector fixed point problem x = G(x)
+
+    def __init__(self, fallback_iterations=50, o_cap=0.3, si_cap=1):
+        self.name = None
+        self.fallback_iterations = fallback_iterations  # If still not converged after this many iterations, hand over to the reference scheme
+        self.o_cap = o_cap
+        self.si_cap = si_cap
+        self.minimum_D = 1e-300
+
+    def apply_caps(self, Ds):
+        Ds[ci.Element.Si] = min(Ds[ci.Element.Si], self.si_cap)
+        Ds[ci.Element.O] = min(Ds[ci.Element.O], self.o_cap)
+        return Ds
+
+    def calculate_Ds(self, geo_model, pressure, fO2, abundances, temp, nbot):
+        return self.apply_caps(geo_model.pamela.get_all_partition_coefficients(pressure, fO2, abundances, temp, nbot))
+
+    def set_up(self, geo_model, pressure, fO2, temp, nbot, initial_w_met, initial_Ds):
+        Ds = geo_model.pamela.get_all_partition_coefficients(pressure, fO2, None, temp, nbot)
+        if initial_Ds is not None:
+            if set(initial_Ds.keys()) != set(geo_model.pamela.ele_set):
+                print('Warning! Initial Ds do not have the same set of elements as PAMELA')
+            for ele in geo_model.pamela.ele_set:
+                try:
+                    Ds[ele] = initial_Ds[ele]
+                except KeyError:
+                    pass
+        Ds = self.apply_caps(Ds)
+        # Only the Ds of elements which are present (and actually partition) are solved for, in log space
+        # The other Ds have no influence on the solution, so they just take the value from the latest evaluation
+        active_elements = [element for element in geo_model.convergence_elements if Ds.get(element, 0) > 0]
+        # Mantle abundances only matter if S is present, as in the reference scheme
+        bulk_S = geo_model.get_bulk_abundance(ci.Element.S)
+        state = SolveState(dict(Ds), active_elements, bulk_S is not None and bulk_S != 0)
+        w_met = initial_w_met if initial_w_met is not None else 0.5
+        return state, self.to_vector(state, Ds, w_met)
+
+    def to_vector(self, state, Ds, w_met):
+        # Ds are floored so that a D which underflows to 0 mid-solve doesn't break the log space iteration
+        return np.append(np.log10(np.maximum([Ds[element] for element in state.active_elements], self.minimum_D)), w_met)
+
+    def to_Ds(self, state, x):
+        Ds = dict(state.passive_Ds)
+        for element, log_D in zip(state.active_elements, x[:-1]):
+            Ds[element] = 10**log_D
+        return Ds
+
+    def G(self, geo_model, state, x, pressure, fO2, temp, nbot):
+        # One step of the reference scheme: returns the new state and the abundances it was calculated from
+        Ds = self.to_Ds(state, x)
+        abundances, w_met = geo_model.calculate_layer_abundances(Ds, x[-1], state.calculate_mantle)
+        new_Ds = self.calculate_Ds(geo_model, pressure, fO2, abundances, temp, nbot)
+        if np.all(np.isfinite(list(new_Ds.values()))):
+            state.passive_Ds = new_Ds
+        return self.to_vector(state, new_Ds, w_met), Ds, new_Ds
+
+    def solve(self, geo_model, pressure, fO2, temp=None, nbot=None, initial_w_met=None, initial_Ds=None, return_all_Ds=False):
+        all_Ds = list()
+        state, x = self.set_up(geo_model, pressure, fO2, temp, nbot, initial_w_met, initial_Ds)
+        self.reset(state)
+        iteration_count = 0
+        prev_gx = None  # The last finite plain (Picard) step, to fall back on if an accelerated step goes somewhere unphysical
+        while True:
+            gx, Ds, new_Ds = self.G(geo_model, state, x, pressure, fO2, temp, nbot)
+            iteration_count += 1
+            geo_model.last_iteration_count = iteration_count
+            if iteration_count > self.fallback_iterations:
+                return self.fall_back(geo_model, state, x, iteration_count, pressure, fO2, temp, nbot, return_all_Ds, all_Ds)
+            if not np.all(np.isfinite(gx)):
+                if prev_gx is None:
+                    print('Warning! Failed to converge!')
+                    return None, None, None, None
+                self.reset(state)
+                x = prev_gx
+                prev_gx = None
+                continue
+            if return_all_Ds:
+                all_Ds.append(Ds)
+            if geo_model.check_convergence(new_Ds, Ds):
+                break
+            prev_gx = gx
+            x = self.next_iterate(state, x, gx)
+            x = self.to_vector(state, self.apply_caps(self.to_Ds(state, x)), min(max(x[-1], 0), 1))
+        if return_all_Ds:
+            all_Ds.append(new_Ds)
+        abundances, w_met = geo_model.calculate_abundances(new_Ds, gx[-1], True)
+        return abundances, w_met, new_Ds, all_Ds if return_all_Ds else None
+
+    def fall_back(self, geo_model, state, x, iteration_count, pressure, fO2, temp, nbot, return_all_Ds, all_Ds):
+        if not np.all(np.isfinite(x)):
+            x = self.to_vector(state, state.passive_Ds, 0.5)
+        result = geo_model.form_a_planet_picard(pressure, fO2, temp, nbot, x[-1], self.to_Ds(state, x), return_all_Ds)
+        geo_model.last_iteration_count += iteration_count
+        if return_all_Ds and result[3] is not None:
+            result = result[0], result[1], result[2], all_Ds + result[3]
+        return result
+
+    def reset(self, state):
+        pass
+
+    def next_iterate(self, state, x, gx):
+        return gx
+
+class AndersonSolver(AcceleratedSolver):
+    # Anderson acceleration (Walker & Ni 2011), mixing the last `depth` iterates
+    # damping = 1 takes the full Anderson step. If the residual grows by more than restart_factor the history is discarded
+
+    def __init__(self, depth=5, damping=1, restart_factor=2, fallback_iterations=50, o_cap=0.3, si_cap=1):
+        super().__init__(fallback_iterations, o_cap, si_cap)
+        self.name = 'anderson'
+        self.depth = depth
+        self.damping = damping
+        self.restart_factor = restart_factor
+
+    def reset(self, state):
+        state.x_history = list()
+        state.f_history = list()
+
+    def next_iterate(self, state, x, gx):
+        f = gx - x
+        if len(state.f_history) > 0 and np.linalg.norm(f) > self.restart_factor*np.linalg.norm(state.f_history[-1]):
+            self.reset(state)
+        state.x_history.append(x)
+        state.f_history.append(f)
+        if len(state.f_history) > self.depth + 1:
+            state.x_history.pop(0)
+            state.f_history.pop(0)
+        if len(state.f_history) == 1:
+            return x + self.damping*f
+        delta_f = np.diff(np.array(state.f_history), axis=0).T
+        delta_x = np.diff(np.array(state.x_history), axis=0).T
+        gamma = np.linalg.lstsq(delta_f, f, rcond=None)[0]
+        toret = x + self.damping*f - np.dot(delta_x + self.damping*delta_f, gamma)
+        if not np.all(np.isfinite(toret)):
+            self.reset(state)
+            return gx
+        return toret
+
+class SecantSolver(AcceleratedSolver):
+    # Damped quasi-Newton solve of F(x) = G(x) - x = 0 using Broyden's (secant) update of the inverse Jacobian
+    # The inverse Jacobian starts at -I, so the first step is the reference (Picard) step
+    # If the residual grows by more than restart_factor the Jacobian estimate is reset
+
+    def __init__(self, damping=1, restart_factor=2, fallback_iterations=50, o_cap=0.3, si_cap=1):
+        super().__init__(fallback_iterations, o_cap, si_cap)
+        self.name = 'secant'
+        self.damping = damping
+        self.restart_factor = restart_factor
+
+    def reset(self, state):
+        state.H = None
+        state.prev_x = None
+        state.prev_f = None
+
+    def next_iterate(self, state, x, gx):
+        f = gx - x
+        if state.H is None or np.linalg.norm(f) > self.restart_factor*np.linalg.norm(state.prev_f):
+            state.H = -np.identity(len(x))
+        else:
+            dx = x - state.prev_x
+            df = f - state.prev_f
+            H_df = np.dot(state.H, df)
+            denominator = np.dot(dx, H_df)
+            if denominator != 0:
+                state.H += np.outer(dx - H_df, np.dot(dx, state.H))/denominator
+        state.prev_x = x
+        state.prev_f = f
+        toret = x - self.damping*np.dot(state.H, f)
+        if not np.all(np.isfinite(toret)):
+            self.reset(state)
+            return gx
+        return toret
+
+known_solvers = {
+    'picard': PicardSolver,
+    'anderson': AndersonSolver,
+    'secant': SecantSolver
+}
+
+def get_solver(solver_name):
+    try:
+        return known_solvers[solver_name]()
+    except KeyError:
+        raise ValueError('Unknown formation solver: ' + str(solver_name) + '. Known solvers: ' + ', '.join(known_solvers.keys()))
@@ -25,6 +25,42 @@ class Layer(Enum):
         # So I do this, which is much quicker:
         return self.value
 
+class LayerAbundances:
+    # Compact representation of abundances by element and layer, used inside the planet formation solve in place of dict[Element][Layer]
+    # values is an (n_elements x n_layers) array, with rows in the order of elements and columns indexed by Layer.value
+    # Only the columns for the layers listed in layers have been calculated. to_dict (and get) give the equivalent of the old nested dict at the API boundary
+    def __init__(self, elements, element_indices, values, layers):
+        self.elements = elements  # A tuple. Callers can cache anything derived from it, and check whether it has changed with ==
+        self.element_indices = element_indices
+        self.values = values
+        self.layers = layers
+
+    def __len__(self):
+        return len(self.elements)
+
+    def get(self, element, layer, default=None):
+        if layer not in self.layers:
+            return default
+        try:
+            return self.values[self.element_indices[element], layer.value]
+        except KeyError:
+            return default
+
+    def get_layer(self, layer, positions):
+        # Returns the abundances in layer of the rows given by positions (where -1 means absent, i.e. 0), or None if layer has not been calculated
+        if layer not in self.layers:
+            return None
+        return np.append(self.values[:, layer.value], 0)[positions]
+
+    def get_positions(self, elements):
+        return np.array([self.element_indices.get(element, -1) for element in elements], dtype=int)
+
+    def to_dict(self):
+        toret = dict()
+        for element, row in zip(self.elements, self.values.tolist()):
+            toret[element] = {layer: row[layer.value] for layer in self.layers}
+        return toret
+
 class GeologyModel():
 
     # normalise_abundances is only ever set to False for testing purposes.
@@ -68,8 +104,14 @@ class GeologyModel():
         }
         self.core_relative_mass = None
         self.mantle_relative_mass = None
+        self.formation_cache = None  # Optionally set to a formation_cache.PlanetFormationCache
+        self.warm_start_index = None  # Optionally set to a formation_cache.WarmStartIndex
+        self.last_iteration_count = None
+        self.solver = None  # Optionally set to one of the solvers in formation_solvers. If None, form_a_planet_picard is used
+        self.layer_abundance_setup = None
 
     def reinit(self, bulk_abundance_overrides=None):
+        self.layer_abundance_setup = None
         self.apply_bulk_abundances(bulk_abundance_overrides)
         self.normalise_non_mantle_abundances()
         self.fill_in_mantle_abundances()
@@ -389,44 +431,52 @@ class GeologyModel():
         return solution_abundances, solution_cnf, solution_Ds
 
     def calculate_abundances(self, Ds, core_number_fraction, calculate_mantle=False):
+        layer_abundances, total_core_abundance = self.calculate_layer_abundances(Ds, core_number_fraction, calculate_mantle)
+        return layer_abundances.to_dict(), total_core_abundance
+
+    def get_layer_abundance_setup(self, elements):
+        # Everything calculate_layer_abundances needs which depends only on the elements (and the bulk composition), so it isn't rebuilt every iteration
+        if self.layer_abundance_setup is None or self.layer_abundance_setup[0] != elements:
+            bulk_abundances = list()
+            for element in elements:
+                bulk_abundance_by_number = self.get_bulk_abundance(element)
+                if bulk_abundance_by_number is None:
+                    # TODO: It's pointless to calculate any Ds for which the bulk abundance is 0. Could be an easy performance gain
+                    bulk_abundance_by_number = 0
+                bulk_abundances.append(bulk_abundance_by_number)
+            self.layer_abundance_setup = (
+                elements,
+                {element: index for index, element in enumerate(elements)},
+                np.array(bulk_abundances, dtype=float),
+                np.array([self.get_mu(element) for element in elements], dtype=float),
+                np.array([element == ci.Element.Placeholder for element in elements])
+            )
+        return self.layer_abundance_setup[1:]
+
+    def calculate_layer_abundances(self, Ds, core_number_fraction, calculate_mantle=False):
+        # Equivalent to calculate_abundances, but returns a LayerAbundances
+        elements = tuple(Ds.keys())
+        element_indices, bulk_abundance_by_number, mu, is_placeholder = self.get_layer_abundance_setup(elements)
+        D = np.fromiter(Ds.values(), dtype=float, count=len(elements))
         mantle_number_fraction = 1 - core_number_fraction
-        abundances = dict()
-        for element, D in Ds.items():
-            abundances[element] = dict()
-            bulk_abundance_by_number = self.get_bulk_abundance(element)
-            if bulk_abundance_by_number is None:
-                # TODO: It's pointless to calculate any Ds for which the bulk abundance is 0. Could be an easy performance gain
-                bulk_abundance_by_number = 0
-            abundances[element][Layer.bulk] = bulk_abundance_by_number
-            mu = self.get_mu(element)
-            if element == ci.Element.Placeholder:  # This used to be special logic for Oxygen
-                # Then "D" is not actually D
-                # This calculation assumes mu = 1...
-                abundances[element][Layer.core] = D
-                if calculate_mantle:
-                    abundances[element][Layer.mantle] = (bulk_abundance_by_number - (D*core_number_fraction))/(1 - core_number_fraction)
-            else:
-                metal_abundance = mu * bulk_abundance_by_number * ((D * core_number_fraction) / (mantle_number_fraction + (D * core_number_fraction)))
-                abundances[element][Layer.core] = metal_abundance
-                if calculate_mantle:
-                    # We only need to calculate mantle stuff on the final iteration, otherwise it just wastes time (unless S is present...)
-                    sil_abundance = bulk_abundance_by_number * (1 - (mu * (1 - (mantle_number_fraction / (mantle_number_fraction + (D * core_number_fraction))))))
-                    abundances[element][Layer.mantle] = sil_abundance
-        total_mantle_abundance = 0
-        total_core_abundance = 0
+        values = np.zeros((len(elements), len(Layer)))
+        values[:, Layer.bulk.value] = bulk_abundance_by_number
+        metal_abundance = mu * bulk_abundance_by_number * ((D * core_number_fraction) / (mantle_number_fraction + (D * core_number_fraction)))
+        # For the Placeholder (this used to be special logic for Oxygen), "D" is not actually D. This calculation assumes mu = 1...
+        core_abundances = np.where(is_placeholder, D, metal_abundance)
+        if calculate_mantle:
+            # We only need to calculate mantle stuff on the final iteration, otherwise it just wastes time (unless S is present...)
+            sil_abundance = bulk_abundance_by_number * (1 - (mu * (1 - (mantle_number_fraction / (mantle_number_fraction + (D * core_number_fraction))))))
+            mantle_abundances = np.where(is_placeholder, (bulk_abundance_by_number - (D*core_number_fraction))/(1 - core_number_fraction), sil_abundance)
 
         # Badro/Siebert O
-        for e in abundances.keys():
-            total_core_abundance += abundances[e][Layer.core]
-            if calculate_mantle:
-                total_mantle_abundance += abundances[e][Layer.mantle]
+        # Totals are summed sequentially (np.sum sums pairwise) so that results match the original element by element loop exactly
+        total_core_abundance = np.cumsum(core_abundances)[-1]
         inv_core_abundance = 1/total_core_abundance
+        values[:, Layer.core.value] = core_abundances*inv_core_abundance
         if calculate_mantle:
-            inv_mantle_abundance = 1/total_mantle_abundance
-        for e in abundances.keys():
-            abundances[e][Layer.core] *= inv_core_abundance
-            if calculate_mantle:
-                abundances[e][Layer.mantle] *= inv_mantle_abundance
+            inv_mantle_abundance = 1/np.cumsum(mantle_abundances)[-1]
+            values[:, Layer.mantle.value] = mantle_abundances*inv_mantle_abundance
 
         # Fischer O
         # This logic keeps O the same, normalises everything else. Reinstate if using old O calculation
@@ -444,7 +494,8 @@ class GeologyModel():
         #        if calculate_mantle:
         #            abundances[e][Layer.mantle] *= (1 - abundances[ci.Element.O][Layer.mantle])*inv_mantle_abundance
         #total_core_abundance /= (1 - abundances[ci.Element.O][Layer.core])
-        return abundances, total_core_abundance
+        layers = (Layer.bulk, Layer.core, Layer.mantle) if calculate_mantle else (Layer.bulk, Layer.core)
+        return LayerAbundances(elements, element_indices, values, layers), total_core_abundance
 
     def check_convergence(self, Ds, prev_Ds, tolerance=0.01):
         #important_elements = None # This will check all elements
@@ -467,7 +518,45 @@ class GeologyModel():
                     return False
         return True
 
+    def get_bulk_abundances(self):
+        return {element: info[Layer.bulk] for element, info in self.element_info.items()}
+
+    def copy_formation_result(self, result):
+        # Copies the output of form_a_planet_iteratively so that cached results can't be modified by the caller
+        abundances, w_met, Ds, all_Ds = result
+        if abundances is None:
+            return None, None, None, None
+        return {element: dict(layers) for element, layers in abundances.items()}, w_met, dict(Ds), all_Ds
+
     def form_a_planet_iteratively(self, pressure, fO2, temp=None, nbot=None, initial_w_met=None, initial_Ds=None, return_all_Ds=False):  # ..with no crust
+        # Only plain solves are cached or warm started: if the caller supplies a starting point, that is used instead
+        use_cache = self.formation_cache is not None and initial_w_met is None and initial_Ds is None and not return_all_Ds
+        use_warm_start = self.warm_start_index is not None and initial_w_met is None and initial_Ds is None
+        if use_cache or use_warm_start:
+            bulk_abundances = self.get_bulk_abundances()
+        if use_cache:
+            cache_key = self.formation_cache.make_key(bulk_abundances, pressure, fO2, temp, nbot)
+            hit, cached_result = self.formation_cache.get(cache_key)
+            if hit:
+                return self.copy_formation_result(cached_result)
+        if use_warm_start:
+            warm_start_point = self.warm_start_index.make_point(bulk_abundances, pressure, fO2)
+            nearest_solution = self.warm_start_index.find_nearest(warm_start_point)
+            if nearest_solution is not None:
+                initial_w_met, initial_Ds = nearest_solution
+        if self.solver is None:
+            result = self.form_a_planet_picard(pressure, fO2, temp, nbot, initial_w_met, initial_Ds, return_all_Ds)
+        else:
+            result = self.solver.solve(self, pressure, fO2, temp, nbot, initial_w_met, initial_Ds, return_all_Ds)
+        if use_warm_start:
+            self.warm_start_index.record_iterations(self.last_iteration_count, nearest_solution is not None)
+            if result[0] is not None:
+                self.warm_start_index.add(warm_start_point, result[1], result[2])
+        if use_cache:
+            self.formation_cache.add(cache_key, self.copy_formation_result(result))
+        return result
+
+    def form_a_planet_picard(self, pressure, fO2, temp=None, nbot=None, initial_w_met=None, initial_Ds=None, return_all_Ds=False):
         # Setup: Don't touch!
         w_met = initial_w_met if initial_w_met is not None else 0.5
         w_sil = 1 - w_met
@@ -525,9 +614,9 @@ class GeologyModel():
             calculate_mantle = False
             if abundances is None:
                 calculate_mantle = True
-            elif abundances[ci.Element.S].get(Layer.core, 0) != 0 or abundances[ci.Element.S].get(Layer.mantle, 0) != 0:
+            elif abundances.get(ci.Element.S, Layer.core, 0) != 0 or abundances.get(ci.Element.S, Layer.mantle, 0) != 0:
                 calculate_mantle = True
-            abundances, w_met = self.calculate_abundances(Ds, w_met, calculate_mantle)
+            abundances, w_met = self.calculate_layer_abundances(Ds, w_met, calculate_mantle)
 
             if not average_next_iteration:
                 # To prevent 'cheating', we are only allowed to declare convergence if we didn't do a nudge this iteration
@@ -538,6 +627,7 @@ class GeologyModel():
 
             w_sil = 1 - w_met
             iteration_count += 1
+            self.last_iteration_count = iteration_count
             if iteration_count % nudge_iterations == 0:
                 # Next iteration, we'll give the algorithm a nudge
                 average_next_iteration = True
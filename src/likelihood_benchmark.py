@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import itertools
+import json
+import numpy as np
+import platform
+import sys
+import time
+
+from argparse import Namespace
+
+import complete_model as cm
+import manager as mn
+import model_parameters as mp
+import numba
+import pwd_utils as pu
+
+# Times cm.complete_model_calculation for each enhancement model across a fixed set of representative parameter values,
+# writes the results to a JSON file, and compares them against a stored reference and (optionally) a timing baseline
+# The reference (committed alongside this file) only holds the model output for each case, so that changes to the answer
+# (e.g. from editing the PAMELA parameter files or the solver settings) are caught. Everything needed is in data/, so this runs offline
+# Timings are only comparable between runs on the same machine, so the timing baseline is kept locally:
+# create one with --save_baseline before making a change, then run again afterwards to compare
+
+default_reference = pu.get_path_to_parent() + 'src/likelihood_benchmark_reference.json'
+default_baseline = 'likelihood_benchmark_baseline.json'
+
+# Stellar compositions file for each enhancement model: EarthMantle and Meteorite are meant to be used with the solar composition
+compositions_files = {
+    'Earthlike': 'StellarCompositionsSortFE.csv',
+    'NonEarthlike': 'StellarCompositionsSortFE.csv',
+    'MantleOnly': 'StellarCompositionsSortFE.csv',
+    'EarthMantle': 'SolarComposition.csv',
+    'Meteorite': 'SolarComposition.csv'
+}
+
+# Each case is the enhancement model's default parameter values (from mp.default_values), with these changes
+feeding_zone_sizes = {
+    'FeedingZone': 0.05,
+    'NoFeedingZone': 0
+}
+pressures = {
+    'LowPressure': 5,
+    'HighPressure': 54
+}
+formation_distances = {  # log10(AU)
+    'Inner': -0.5,
+    'Outer': 0.3
+}
+# The defaults have no accretion history, which skips most of the white dwarf model
+t_sinceaccretion = 0.1
+fragment_core_frac = 0.3  # Only used if the enhancement model has no default
+
+def get_cases():
+    toret = dict()
+    for enhancement_model, (fz_name, fz), (pressure_name, pressure), (distance_name, distance) in itertools.product(compositions_files.keys(), feeding_zone_sizes.items(), pressures.items(), formation_distances.items()):
+        toret['_'.join([enhancement_model, fz_name, pressure_name, distance_name])] = (enhancement_model, fz, pressure, distance)
+    return toret
+
+def get_parameters(enhancement_model, feeding_zone_size, pressure, formation_distance):
+    defaults = mp.default_values[enhancement_model]
+    return [
+        defaults[mp.ModelParameter.metallicity],
+        t_sinceaccretion,
+        formation_distance,
+        feeding_zone_size,
+        defaults[mp.ModelParameter.parent_core_frac],
+        defaults[mp.ModelParameter.parent_crust_frac],
+        fragment_core_frac if defaults[mp.ModelParameter.fragment_core_frac] is None else defaults[mp.ModelParameter.fragment_core_frac],
+        defaults[mp.ModelParameter.fragment_crust_frac],
+        defaults[mp.ModelParameter.pollution_frac],
+        10**defaults[mp.ModelParameter.accretion_timescale],
+        pressure,
+        defaults[mp.ModelParameter.oxygen_fugacity]
+    ]
+
+def get_context(enhancement_model, wd_data_filename, N_wd):
+    manager = mn.Manager(Namespace(
+        wd_data_filename=wd_data_filename,
+        stellar_compositions_filename=compositions_files[enhancement_model],
+        n_live_points=None,
+        enhancement_model=enhancement_model,
+        pollution_model_names=None
+    ))
+    context = manager.create_context(N_wd)
+    context.enhancement_model = enhancement_model
+    return context
+
+def time_case(context, parameters, n_repeats):
+    # The first call includes any compilation, so is timed separately
+    start = time.perf_counter()
+    result, diagnostics = cm.complete_model_calculation(*parameters, context.enhancement_model, context=context)
+    first_call_time = time.perf_counter() - start
+    times = list()
+    for i in range(n_repeats):
+        start = time.perf_counter()
+        cm.complete_model_calculation(*parameters, context.enhancement_model, context=context)
+        times.append(time.perf_counter() - start)
+    return {
+        'first_call_us': 1e6*first_call_time,
+        'median_us': 1e6*float(np.median(times)),
+        'min_us': 1e6*float(np.min(times)),
+        'valid': result is not None,
+        'result': None if result is None else [None if value is None else float(value) for value in result.values()]
+    }
+
+def run_benchmarks(n_repeats, wd_data_filename='WDInputData.csv', N_wd=0, case_filter=None):
+    contexts = dict()
+    cases = dict()
+    for case_name, (enhancement_model, feeding_zone_size, pressure, formation_distance) in get_cases().items():
+        if case_filter is not None and case_filter not in case_name:
+            continue
+        if enhancement_model not in contexts:
+            contexts[enhancement_model] = get_context(enhancement_model, wd_data_filename, N_wd)
+        cases[case_name] = time_case(contexts[enhancement_model], get_parameters(enhancement_model, feeding_zone_size, pressure, formation_distance), n_repeats)
+        print(case_name.ljust(50) + ' | ' + ('%.1f' % cases[case_name]['median_us']).rjust(10) + ' us' + ('' if cases[case_name]['valid'] else ' (no result)'))
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'numba': numba.__version__,
+            'machine': platform.machine()
+        },
+        'settings': {
+            'n_repeats': n_repeats,
+            'wd_data_filename': wd_data_filename,
+            'N_wd': N_wd
+        },
+        'cases': cases
+    }
+
+def get_reference(results):
+    # Just the model output from results, without the timings (which depend on the machine)
+    return {
+        'settings': {setting: value for setting, value in results['settings'].items() if setting != 'n_repeats'},
+        'cases': {case_name: {'valid': case['valid'], 'result': case['result']} for case_name, case in results['cases'].items()}
+    }
+
+def compare_to_reference(results, reference, result_tolerance=1e-6):
+    # Returns a list of problems: cases whose output changed
+    problems = list()
+    for case_name, case in results['cases'].items():
+        reference_case = reference['cases'].get(case_name)
+        if reference_case is None:
+            print('No reference for ' + case_name)
+            continue
+        if case['valid'] != reference_case['valid']:
+            problems.append(case_name + ' validity changed: ' + str(reference_case['valid']) + ' -> ' + str(case['valid']))
+        elif case['valid']:
+            for value, reference_value in zip(case['result'], reference_case['result']):
+                if (value is None) != (reference_value is None) or (value is not None and not np.isclose(value, reference_value, rtol=result_tolerance, atol=0)):
+                    problems.append(case_name + ' output changed: ' + str(reference_case['result']) + ' -> ' + str(case['result']))
+                    break
+    return problems
+
+def compare_to_baseline(results, baseline, time_tolerance=0.2):
+    # Returns a list of problems: cases which got slower by more than time_tolerance (as a fraction)
+    problems = list()
+    for case_name, case in results['cases'].items():
+        baseline_case = baseline['cases'].get(case_name)
+        if baseline_case is None:
+            print('No baseline for ' + case_name)
+            continue
+        ratio = case['median_us']/baseline_case['median_us']
+        print(case_name.ljust(50) + ' | ' + ('%.1f' % baseline_case['median_us']).rjust(10) + ' -> ' + ('%.1f' % case['median_us']).rjust(10) + ' us (x' + ('%.2f' % ratio) + ')')
+        if ratio > 1 + time_tolerance:
+            problems.append(case_name + ' is slower: ' + ('%.1f' % baseline_case['median_us']) + ' -> ' + ('%.1f' % case['median_us']) + ' us')
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark complete_model_calculation for each enhancement model')
+    parser.add_argument('--n_repeats', default=20, type=int, help='Number of timed calls per case (after one untimed call)')
+    parser.add_argument('--output', default='likelihood_benchmark.json', type=str, help='JSON file to write the results to')
+    parser.add_argument('--reference', default=default_reference, type=str, help='JSON file of model outputs to compare against')
+    parser.add_argument('--save_reference', action='store_true', help='Overwrite the reference with these model outputs instead of comparing')
+    parser.add_argument('--baseline', default=default_baseline, type=str, help='JSON file of previous timings (from this machine) to compare against')
+    parser.add_argument('--save_baseline', action='store_true', help='Overwrite the baseline with these timings instead of comparing')
+    parser.add_argument('--time_tolerance', default=0.2, type=float, help='Fractional slowdown which counts as a regression')
+    parser.add_argument('--filter', default=None, type=str, help='Only run cases whose name contains this')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.n_repeats, case_filter=args.filter)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results written to ' + args.output)
+    problems = list()
+    if args.save_reference:
+        with open(args.reference, 'w') as f:
+            json.dump(get_reference(results), f, indent=2)
+        print('Reference written to ' + args.reference)
+    else:
+        with open(args.reference) as f:
+            problems += compare_to_reference(results, json.load(f))
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Baseline written to ' + args.baseline)
+    else:
+        try:
+            with open(args.baseline) as f:
+                problems += compare_to_baseline(results, json.load(f), args.time_tolerance)
+        except FileNotFoundError:
+            print('No baseline found at ' + args.baseline + ' (use --save_baseline to create one): only checking the model output')
+    if len(problems) > 0:
+        print(str(len(problems)) + ' regression(s):')
+        for problem in problems:
+            print(problem)
+        sys.exit(1)
+    print('No regressions')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import csv
+import time
+
+# Opt-in instrumentation for the likelihood calculation (cm.complete_model_calculation and the likelihood evaluation in loglike_functions)
+# Records the time spent in (and number of calls to) each stage, a histogram of planet formation solver iteration counts,
+# and how many model calculations failed (returned None, so the point was ignored)
+# Set ModelContext.profiler (or ld._profiler) to one of these to switch it on. When it's None, nothing is recorded
+# The stages are timed with time.perf_counter, so the overhead is roughly a microsecond per stage
+
+# The stages in the order they happen
+stages = [
+    'Abundances',  # am.get_all_abundances
+    'Disc abundances',  # Scaling the abundances by the stellar composition
+    'Geology model',  # Setting up the GeologyModel (GeologyModel.reinit)
+    'Enhancements',  # EnhancementModel.find_enhancements (including any planet formation solve)
+    'White dwarf model',  # wdm.process_abundances
+    'Likelihood'  # WhiteDwarf.log_likelihood
+]
+
+class LikelihoodProfiler:
+
+    def __init__(self):
+        self.reset()
+
+    def __str__(self):
+        return 'LikelihoodProfiler: ' + str(self.model_calls) + ' model calculations (' + str(round(100*self.get_failure_fraction(), 2)) + '% failed), ' + ', '.join([stage + ' ' + str(round(1000*self.total_times[stage], 1)) + ' ms' for stage in stages])
+
+    def reset(self):
+        self.total_times = collections.OrderedDict([(stage, 0.0) for stage in stages])
+        self.calls = collections.OrderedDict([(stage, 0) for stage in stages])
+        self.iteration_counts = collections.Counter()  # Number of solver iterations -> number of solves which took that many
+        self.model_calls = 0
+        self.failed_model_calls = 0
+
+    def record(self, stage, start_time, n_calls=1):
+        # Adds the time since start_time to stage, and returns the current time so that the next stage can start from it
+        now = time.perf_counter()
+        self.total_times[stage] += now - start_time
+        self.calls[stage] += n_calls
+        return now
+
+    def record_iterations(self, iteration_count):
+        if iteration_count is not None:
+            self.iteration_counts[iteration_count] += 1
+
+    def record_model_results(self, n_calls, n_failed):
+        self.model_calls += n_calls
+        self.failed_model_calls += n_failed
+
+    def get_failure_fraction(self):
+        return self.failed_model_calls/self.model_calls if self.model_calls > 0 else 0
+
+    def merge(self, other):
+        # Add the counts from another profiler (e.g. one which was used in a worker process)
+        for stage in stages:
+            self.total_times[stage] += other.total_times[stage]
+            self.calls[stage] += other.calls[stage]
+        self.iteration_counts.update(other.iteration_counts)
+        self.model_calls += other.model_calls
+        self.failed_model_calls += other.failed_model_calls
+
+    def write(self, filename):
+        total_time = sum(self.total_times.values())
+        with open(filename, 'w', newline='', encoding='utf-8') as f:
+            to_write = csv.writer(f)
+            to_write.writerow(['Model calculations:', self.model_calls])
+            to_write.writerow(['Failed model calculations:', self.failed_model_calls])
+            to_write.writerow(['Failure fraction:', self.get_failure_fraction()])
+            to_write.writerow([])
+            to_write.writerow(['Stage', 'Calls', 'Total time /s', 'Time per call /us', 'Fraction of time'])
+            for stage in stages:
+                calls = self.calls[stage]
+                to_write.writerow([
+                    stage,
+                    calls,
+                    self.total_times[stage],
+                    1e6*self.total_times[stage]/calls if calls > 0 else None,
+                    self.total_times[stage]/total_time if total_time > 0 else None
+                ])
+            to_write.writerow([])
+            to_write.writerow(['Solver iterations', 'Number of solves'])
+            for iteration_count in sorted(self.iteration_counts.keys()):
+                to_write.writerow([iteration_count, self.iteration_counts[iteration_count]])
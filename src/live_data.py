@@ -1,20 +1,23 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import collections
 import csv
 import numpy as np
 
+import formation_solvers as fs
+import likelihood_profiler as lp
+
 # This file is a bit of a hack. It exists because we need to pass external information into the prior function,
 # but the prior function can only contain one argument (cube) otherwise pymultinest complains.
 # So the idea here is that the manager will update the following variables, which can then be accessed by the prior
-# TODO: Make a more elegant design that doesn't have these pseudo-global variables!
-# Maybe some sort of static function in the Manager?
-# Or maybe make the pollution model class into a subclass of a pymultinest solver, then use self.wd_abundances etc
-# Then you still have to 'publish' the data but at least it's contained in an object
-# Or some hybrid solution where the pollution model subclass has a self.live_data which is given a LiveData object containing the live data
+# These pseudo-global variables are still supported, but ModelContext (below) contains the same data in an object
+# which can be passed to the prior and likelihood explicitly
 
 _live_model = None
 _live_prior = None
+_live_model_plan = None
+_enhancement_model = None
 _live_all_wd_errors = None
 _live_all_wd_abundances = None
 _live_t_mg = None
@@ -24,8 +27,96 @@ _live_stellar_compositions = None
 #_live_non_zero_wd_timescales = None
 _live_all_wd_timescales = None
 _geo_model = None
+_formation_cache = None
+_warm_start_index = None
+_formation_solver = None
+_condensation_table = None
+_feeding_zone_quadrature = None
+_profiler = None
 _live_elements_present = None
 _live_q = None
 _live_mass = None
 _live_type = None
 _live_white_dwarf = None
+_live_upper_bounds = None
+_live_lower_bounds = None
+
+# The same information as above, but gathered into an object which can be passed around explicitly
+# This means several models (or white dwarfs) can be run at once, each with its own ModelContext
+# Code which takes a context also accepts None, meaning the module level variables above (via global_context)
+context_attributes = collections.OrderedDict([
+    ('model', '_live_model'),
+    ('prior', '_live_prior'),
+    ('model_plan', '_live_model_plan'),
+    ('enhancement_model', '_enhancement_model'),
+    ('white_dwarf', '_live_white_dwarf'),
+    ('all_wd_abundances', '_live_all_wd_abundances'),
+    ('all_wd_errors', '_live_all_wd_errors'),
+    ('all_wd_timescales', '_live_all_wd_timescales'),
+    ('upper_bounds', '_live_upper_bounds'),
+    ('lower_bounds', '_live_lower_bounds'),
+    ('elements_present', '_live_elements_present'),
+    ('t_mg', '_live_t_mg'),
+    ('q', '_live_q'),
+    ('mass', '_live_mass'),
+    ('type', '_live_type'),
+    ('stellar_compositions', '_live_stellar_compositions'),
+    ('geo_model', '_geo_model'),
+    ('formation_cache', '_formation_cache'),
+    ('warm_start_index', '_warm_start_index'),
+    ('formation_solver', '_formation_solver'),
+    ('condensation_table', '_condensation_table'),
+    ('feeding_zone_quadrature', '_feeding_zone_quadrature'),
+    ('profiler', '_profiler')
+])
+
+class ModelContext:
+
+    def __init__(self, **kwargs):
+        for attribute in context_attributes:
+            setattr(self, attribute, kwargs.pop(attribute, None))
+        if len(kwargs) > 0:
+            raise KeyError('Unrecognised model context attributes: ' + ', '.join(kwargs.keys()))
+
+    def __repr__(self):
+        return 'ModelContext(' + str(self.model) + ', ' + str(self.prior) + ', ' + str(self.white_dwarf) + ')'
+
+    def copy(self):
+        # A shallow copy, except that the copy gets its own geology model (which holds the state of each planet formation solve),
+        # model plan (which refers back to its context), and formation cache, warm start index, formation solver and profiler
+        # (as in Manager.create_context with share_caches=False), so that the copy can be run at the same time as the original
+        toret = ModelContext(**{attribute: getattr(self, attribute) for attribute in context_attributes})
+        toret.geo_model = None
+        toret.model_plan = None
+        if self.formation_cache is not None:
+            toret.formation_cache = self.formation_cache.empty_copy()
+        if self.warm_start_index is not None:
+            toret.warm_start_index = self.warm_start_index.empty_copy()
+        if self.formation_solver is not None:
+            toret.formation_solver = fs.get_solver(self.formation_solver.name)
+        if self.profiler is not None:
+            toret.profiler = lp.LikelihoodProfiler()
+        return toret
+
+class GlobalContext:
+    # Reads and writes the module level variables, so that anything taking a context still works with the old approach of setting ld._live_model etc
+
+    def __getattr__(self, attribute):
+        try:
+            return globals()[context_attributes[attribute]]
+        except KeyError:
+            raise AttributeError('Unrecognised model context attribute: ' + attribute)
+
+    def __setattr__(self, attribute, value):
+        if attribute not in context_attributes:
+            raise AttributeError('Unrecognised model context attribute: ' + attribute)
+        globals()[context_attributes[attribute]] = value
+
+global_context = GlobalContext()
+
+def get_context(context=None):
+    return global_context if context is None else context
+
+def capture_global_context():
+    # Snapshot of the module level variables as a ModelContext
+    return ModelContext(**{attribute: getattr(global_context, attribute) for attribute in context_attributes})
@@ -2,17 +2,25 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
+import time
 
+import chemistry_info as ci
 import complete_model as cm
 import live_data as ld
 import model_parameters as mp
+import prior_functions as pf
 
-def evaluate_log_likelihood(model_result, min_likelihood=mp.minimum_likelihood):
+def evaluate_log_likelihood(model_result, min_likelihood=mp.minimum_likelihood, context=None):
     if model_result is None:
         #like = min_likelihood  # For testing purposes only
         like = 1.1*min_likelihood  # ...So these points should be ignored (no information gained)
     else:
-        like = ld._live_white_dwarf.log_likelihood(model_result, min_likelihood)
+        context = ld.get_context(context)
+        if context.profiler is not None:
+            stage_start = time.perf_counter()
+        like = context.white_dwarf.log_likelihood(model_result, min_likelihood)
+        if context.profiler is not None:
+            context.profiler.record('Likelihood', stage_start)
         # First check if we violate any bounds:
         #for el, el_result in model_result.items():
         #    upper_bound = ld._live_upper_bounds[el]
@@ -43,14 +51,10 @@ def evaluate_log_likelihood(model_result, min_likelihood=mp.minimum_likelihood):
 
     return like
 
-def universal_loglike(cube):
+def universal_loglike(cube, context=None):
 
-    parameter_indices = mp.parameter_indices(ld._live_model)
-
-    input_values = list()
-    for param in mp.get_model_params_in_order():
-        to_append = cube[parameter_indices[param]] if mp.model_uses_parameter(ld._live_model, param) else mp.default_values[ld._enhancement_model][param]
-        input_values.append(to_append)
+    context = ld.get_context(context)
+    input_values = pf.get_live_model_plan(context).get_input_values(cube)
 
     # Could rethink the structure of this part. (call model.execute() and go into this function: ?)
 
@@ -74,14 +78,15 @@ def universal_loglike(cube):
         10**input_values[9], #t_disc
         input_values[10], #pressure
         input_values[11], #fO2 (oxygen fugacity relative to Iron Wuestite buffer, in log units)
-        ld._enhancement_model
+        context.enhancement_model,
+        context=context
     )
 
     min_likelihood = mp.minimum_likelihood              # Any points with likelihood less than this are ignored
                                                         # --> use for errors, but not for bounds violations
                                                         #( = -1e90 by default in the model, -1e100 by default in pymultinest)
 
-    like = evaluate_log_likelihood(model_result, min_likelihood)
+    like = evaluate_log_likelihood(model_result, min_likelihood, context)
     return like
 
     #if model_result is None:
@@ -109,3 +114,41 @@ def universal_loglike(cube):
     #        #like = min_likelihood # For testing purposes only
     #        like = 0.9*min_likelihood
     #return like
+
+def evaluate_log_likelihood_batch(model_results, valid, min_likelihood=mp.minimum_likelihood, context=None):
+    context = ld.get_context(context)
+    like = np.full(len(valid), 1.1*min_likelihood)  # Points with no model result are ignored, as in evaluate_log_likelihood
+    if np.any(valid):
+        if context.profiler is not None:
+            stage_start = time.perf_counter()
+        like[valid] = context.white_dwarf.log_likelihood_batch(model_results[valid], ci.usual_elements, min_likelihood)
+        if context.profiler is not None:
+            context.profiler.record('Likelihood', stage_start, np.count_nonzero(valid))
+    return like
+
+# Equivalent to calling universal_loglike on each row of cubes, an (N, n_dims) array. Returns an array of N log likelihoods
+def universal_loglike_batch(cubes, context=None):
+    context = ld.get_context(context)
+    cubes = np.atleast_2d(np.asarray(cubes, dtype=float))
+    input_values = pf.get_live_model_plan(context).get_input_values_batch(cubes)
+
+    model_results, valid = cm.complete_model_calculation_batch(
+        input_values[0], #fe_star
+        input_values[1], #t_sinceaccretion
+        input_values[2], #d_formation
+        input_values[3], #z_formation
+        input_values[4], #N_c
+        input_values[5], #N_o
+        input_values[6], #f_c
+        input_values[7], #f_o
+        input_values[8], #pollutionfraction
+        10**np.asarray(input_values[9]), #t_disc
+        input_values[10], #pressure
+        input_values[11], #fO2 (oxygen fugacity relative to Iron Wuestite buffer, in log units)
+        context.enhancement_model,
+        context=context
+    )
+
+    min_likelihood = mp.minimum_likelihood
+
+    return evaluate_log_likelihood_batch(model_results, valid, min_likelihood, context)
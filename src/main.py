@@ -4,9 +4,22 @@
 import argparse as ap
 import manager as mn
 import pwd_utils as pu
+import subprocess
+import sys
+
+def relaunch_under_mpi(n_ranks):
+    if pu.get_mpi_comm() is None:
+        raise ImportError('Running with --mpi_ranks requires mpi4py')
+    command = ['mpirun', '-np', str(n_ranks), sys.executable] + sys.argv
+    print('Relaunching as: ' + ' '.join(command))
+    subprocess.run(command, check=True)
 
 def main():
     arguments = pu.parse_command_line_arguments()
+    if arguments.mpi_ranks > 1 and pu.get_mpi_size() == 1:
+        # Then we haven't been started by mpirun (or equivalent) yet
+        relaunch_under_mpi(arguments.mpi_ranks)
+        return
     manager = mn.Manager(arguments)
     manager.run()
 
@@ -2,18 +2,29 @@
 # -*- coding: utf-8 -*-
 
 import collections
+import concurrent.futures
+import copy
 import csv
 import itertools
 import numpy as np
 import os
 import warnings
 
+from pathlib import Path
+
+import abundance_model as am
 import chemistry_info as ci
+import formation_cache as fc
+import formation_solvers as fs
+import likelihood_profiler as lp
 import live_data as ld
 import model_analyser as ma
 import model_parameters as mp
 import pollution_model as pm
+import prior_functions as pf
 import pwd_utils as pu
+import run_journal as rj
+import samplers as smp
 import stellar_composition as sc
 import timescale_interpolator as ti
 import white_dwarf as wd
@@ -29,6 +40,69 @@ class Manager:
         except AttributeError:
             # Then seed was not supplied: assume -1
             self.seed = -1
+        try:
+            formation_cache_size = args.formation_cache_size
+            formation_cache_tolerance = args.formation_cache_tolerance
+        except AttributeError:
+            # Then the cache was not configured: leave it switched off
+            formation_cache_size = 0
+            formation_cache_tolerance = 0
+        try:
+            formation_cache_pressure_tolerance = args.formation_cache_pressure_tolerance
+            formation_cache_fO2_tolerance = args.formation_cache_fO2_tolerance
+        except AttributeError:
+            # Then only match exact pressures and fO2s
+            formation_cache_pressure_tolerance = 0
+            formation_cache_fO2_tolerance = 0
+        self.formation_cache = fc.PlanetFormationCache(formation_cache_size, formation_cache_tolerance, formation_cache_pressure_tolerance, formation_cache_fO2_tolerance) if formation_cache_size > 0 else None
+        try:
+            warm_start = args.warm_start
+        except AttributeError:
+            warm_start = False
+        self.warm_start_index = fc.WarmStartIndex() if warm_start else None
+        try:
+            solver_name = args.solver
+        except AttributeError:
+            solver_name = 'picard'
+        self.formation_solver = fs.get_solver(solver_name)
+        try:
+            use_condensation_table = args.condensation_table
+        except AttributeError:
+            use_condensation_table = False
+        self.condensation_table = am.CondensationTable(1.5) if use_condensation_table else None  # 1.5 is the default t_formation in complete_model
+        try:
+            feeding_zone_points = args.feeding_zone_points
+        except AttributeError:
+            feeding_zone_points = 0
+        self.feeding_zone_quadrature = am.GaussHermiteQuadrature(feeding_zone_points) if feeding_zone_points > 0 else None
+        try:
+            profile = args.profile
+        except AttributeError:
+            profile = False
+        self.profiler = lp.LikelihoodProfiler() if profile else None
+        try:
+            sampler_name = args.sampler
+            sampler_workers = args.sampler_workers
+        except AttributeError:
+            sampler_name = 'multinest'
+            sampler_workers = 1
+        self.sampler = smp.get_sampler(sampler_name, sampler_workers)
+        try:
+            self.workers = args.workers
+        except AttributeError:
+            self.workers = 1
+        self.args = args  # Kept so that worker processes can build their own Manager
+        # Under MPI, every rank runs this Manager so that they can all take part in each MultiNest run,
+        # but only rank 0 writes output or analyses the results
+        self.mpi_comm = pu.get_mpi_comm()
+        self.mpi_rank = 0 if self.mpi_comm is None else self.mpi_comm.Get_rank()
+        self.is_root = self.mpi_rank == 0
+        if self.workers > 1 and self.mpi_comm is not None and self.mpi_comm.Get_size() > 1:
+            raise ValueError('Cannot use both worker processes and MPI: use one or the other')
+        if not self.sampler.uses_mpi and self.mpi_comm is not None and self.mpi_comm.Get_size() > 1:
+            raise ValueError('The ' + self.sampler.name + ' sampler cannot be run under MPI: use --sampler_workers to run it in parallel instead')
+        self.executor = None  # If set, models are submitted to this pool rather than run here
+        self.pending_models = dict()  # (N_wd, model_name) -> future, for models submitted to self.executor but not yet collected
         if args.pollution_model_names is not None and len(args.pollution_model_names) == 1 and args.pollution_model_names[0].startswith('Hierarchy'):
             # Then we're running a hierarchy which will dynamically create models to run
             self.model_names = None
@@ -47,6 +121,12 @@ class Manager:
             self.parameter_hierarchy = None
             self.hierarchy_name = None
         self.timescale_interpolator = ti.TimescaleInterpolator()
+        try:
+            validate_timescales = args.validate_timescales
+        except AttributeError:
+            validate_timescales = False
+        if validate_timescales:
+            self.timescale_interpolator.check_grids()
         self.final_hierarchy = None
         self.white_dwarfs = list()
         self.default_logg = 8
@@ -62,18 +142,33 @@ class Manager:
         # I assume there will only ever be one of these:
         self.analyser = ma.ModelAnalyser(None)
         self.executed_models = dict()
+        try:
+            use_journal = args.journal
+        except AttributeError:
+            use_journal = False
+        self.journal = rj.RunJournal(self.get_journal_filename(), self.is_root) if use_journal else None
 
     def get_output_dir(self, wd_name):
         filename = pu.get_path_to_pylluted_dir() + wd_name + '/'
         self.create_dir(filename)
         return filename
 
+    def get_run_name(self):
+        return pu.hierarchy_abbreviations[self.hierarchy_name] if self.model_names is None else '_'.join(self.model_names)
+
+    def get_journal_filename(self):
+        # One journal per input file and run configuration, named along the same lines as the stats files
+        self.create_dir(pu.get_path_to_pylluted_dir())
+        return pu.get_path_to_pylluted_dir() + 'journal_' + Path(self.wd_data_filename).stem + '_p' + str(self.n_live_points) + '_' + self.get_run_name() + '_' + pu.abbreviations[self.enhancement_model] + '.jsonl'
+
     def get_chains_dir(self, wd_name):
         filename = self.get_output_dir(wd_name) + 'c/' # Choosing a short name because of the 100 character limit
         self.create_dir(filename)
         return filename
 
     def create_dir(self, dir_to_make):
+        if not self.is_root:
+            return
         try:
             os.makedirs(dir_to_make)
         except FileExistsError:
@@ -426,28 +521,12 @@ class Manager:
         return generic_array.astype(np.float)
 
     # TODO Maybe calculate live data for all runs and index in later?
-    def publish_live_data(self, N_wd):
-        # TODO: at some point I would like to simplify this to just ld._live_white_dwarf = self.white_dwarfs[N_wd]
-
-        #non_zero_wd_abundances = list()
-        #non_zero_wd_errors = list()
-        #non_zero_wd_timescales = list()
-        all_wd_abundances = list()
-        all_wd_errors = list()
-        all_wd_timescales = list()
-        elements_present = list()
-
+    def create_context(self, N_wd, model_name=None, prior_name='Default', share_caches=True):
+        # All the live data for white dwarf N_wd (and model_name, if given) as an ld.ModelContext
+        # If share_caches is False, the context gets its own formation cache, warm start index, formation solver and profiler,
+        # so that it can be run at the same time as other contexts (its profiler can be merged into self.profiler afterwards)
         white_dwarf = self.white_dwarfs[N_wd]
-        ld._live_white_dwarf = white_dwarf
-        wd_name = white_dwarf.name
-
-        all_wd_timescales = white_dwarf.get_timescales_as_array(ci.usual_elements)
         abundances, errors, upper_bounds, lower_bounds = white_dwarf.get_abundance_arrays(ci.usual_elements)
-        ld._live_all_wd_abundances = abundances
-        ld._live_all_wd_errors = errors
-        ld._live_all_wd_timescales = all_wd_timescales
-        ld._live_upper_bounds = upper_bounds
-        ld._live_lower_bounds = lower_bounds
 
         #for el in ci.usual_elements:
         #    wd_abundance = self.wd_abundances[wd_name][el]
@@ -460,27 +539,58 @@ class Manager:
         #        non_zero_wd_timescales.append(self.wd_timescales[wd_name][el])
         #        elements_present.append(el)
 
-        #ld._live_non_zero_wd_abundances = np.transpose(non_zero_wd_abundances)
-        #ld._live_non_zero_wd_errors = np.transpose(non_zero_wd_errors)
-        #ld._live_non_zero_wd_timescales = np.transpose(non_zero_wd_timescales)
+        formation_cache = self.formation_cache
+        warm_start_index = self.warm_start_index
+        formation_solver = self.formation_solver
+        profiler = self.profiler
+        if not share_caches:
+            if formation_cache is not None:
+                formation_cache = formation_cache.empty_copy()
+            if warm_start_index is not None:
+                warm_start_index = warm_start_index.empty_copy()
+            formation_solver = fs.get_solver(formation_solver.name)
+            if profiler is not None:
+                profiler = lp.LikelihoodProfiler()
+        context = ld.ModelContext(
+            white_dwarf=white_dwarf,
+            all_wd_abundances=abundances,
+            all_wd_errors=errors,
+            all_wd_timescales=white_dwarf.get_timescales_as_array(ci.usual_elements),
+            upper_bounds=upper_bounds,
+            lower_bounds=lower_bounds,
+            elements_present=white_dwarf.get_elements_present(),
+            t_mg=white_dwarf.timescale_dict[ci.Element.Mg],
+            q=white_dwarf.get_logq().value,
+            mass=white_dwarf.get_mass().value,
+            type=white_dwarf.get_atmospheric_type().value,
+            stellar_compositions=self.stellar_compositions,
+            formation_cache=formation_cache,
+            warm_start_index=warm_start_index,
+            formation_solver=formation_solver,
+            condensation_table=self.condensation_table,
+            feeding_zone_quadrature=self.feeding_zone_quadrature,
+            profiler=profiler
+        )
+        if model_name is not None:
+            context.model = model_name
+            context.enhancement_model = self.enhancement_model
+            context.prior = prior_name
+            context.model_plan = pf.ModelPlan(model_name, self.enhancement_model, prior_name, context)
+        return context
 
-        #ld._live_all_wd_abundances = np.transpose(all_wd_abundances)
-        #ld._live_all_wd_errors = np.transpose(all_wd_errors)
-        #ld._live_all_wd_timescales = np.transpose(all_wd_timescales)
-        #ld._live_upper_bounds = self.wd_abundance_upper_bounds[wd_name]
-        #ld._live_lower_bounds = self.wd_abundance_lower_bounds[wd_name]
-
-        ld._live_t_mg = white_dwarf.timescale_dict[ci.Element.Mg]
-        ld._live_stellar_compositions = self.stellar_compositions  # TODO: This doesn't need to be updated every time
-        ld._live_q = white_dwarf.get_logq().value
-        ld._live_mass = white_dwarf.get_mass().value
-        ld._live_type = white_dwarf.get_atmospheric_type().value
-        ld._live_elements_present = white_dwarf.get_elements_present()
+    def publish_live_data(self, N_wd):
+        # Copy the white dwarf dependent parts of the context into the module level live data
+        # (which is still used by the analyser, and by anything that doesn't pass a context around)
+        context = self.create_context(N_wd)
+        for attribute in ld.context_attributes:
+            if attribute not in ['model', 'prior', 'model_plan', 'enhancement_model', 'geo_model']:
+                setattr(ld.global_context, attribute, getattr(context, attribute))
 
     def publish_live_model(self, model_name, prior_name='Default'):
         ld._live_model = model_name
         ld._enhancement_model = self.enhancement_model
         ld._live_prior = prior_name
+        ld._live_model_plan = pf.ModelPlan(model_name, self.enhancement_model, prior_name)
 
     def load_models(self, model_names=None):
         models_already_loaded = self.models is not None and len(self.models.keys()) > 0
@@ -493,21 +603,94 @@ class Manager:
         for model_name in self.model_names:
             self.models[model_name] = pm.PollutionModel(model_name, self.enhancement_model, self.default_prior, self.n_live_points, self.seed)
 
-    def execute_models(self, N_wd):
+    def mark_executed(self, N_wd, model_name, model, record=True):
+        if N_wd not in self.executed_models.keys():
+            self.executed_models[N_wd] = list()
+        self.executed_models[N_wd].append(model_name)
+        if record and self.journal is not None:
+            wd_name = self.white_dwarfs[N_wd].name
+            self.journal.record_model(N_wd, wd_name, model_name, model.prior_name, self.enhancement_model, model.live_points, model.get_full_prefix(self.get_chains_dir(wd_name), N_wd))
+
+    def load_completed_models(self, N_wd):
+        # Treat any model the journal says has already finished (in this or a previous run) as executed
+        # Anything else gets run as usual, and MultiNest will resume from its resume files if a previous run got partway through
+        if self.journal is None:
+            return
+        wd_name = self.white_dwarfs[N_wd].name
+        for model_name, model in self.models.items():
+            if model_name not in self.executed_models.get(N_wd, list()) and self.journal.get_completed_model(wd_name, model_name, model.prior_name, self.enhancement_model, model.live_points) is not None:
+                print('Run journal shows model ' + model_name + ' with prior ' + model.prior_name + ' has already been run for ' + wd_name + ': skipping')
+                self.mark_executed(N_wd, model_name, model, False)
+
+    def get_systems_to_run(self, systems_to_run):
+        # Leave out any systems the journal says are finished
+        if self.journal is None:
+            return list(systems_to_run)
+        toret = list()
+        for system in systems_to_run:
+            if self.journal.is_system_completed(self.white_dwarfs[system].name):
+                print('Run journal shows ' + self.white_dwarfs[system].name + ' has already been run: skipping')
+            else:
+                toret.append(system)
+        return toret
+
+    def execute_models(self, N_wd, speculative_models=None):
         white_dwarf = self.white_dwarfs[N_wd]
         if self.models is not None:
             self.publish_live_data(N_wd)
+            self.load_completed_models(N_wd)
+            if self.executor is not None:
+                self.execute_models_concurrently(N_wd, speculative_models)
+                return
             for model_name, model in self.models.items():
                 if model_name not in self.executed_models.get(N_wd, list()):
                     # Then we haven't already run this one, so must do so. Otherwise, we can ignore.
                     self.publish_live_model(model_name, model.prior_name)
                     print('About to run model ' + model_name + ' with prior ' + model.prior_name)
-                    model.execute(N_wd, self.get_chains_dir(white_dwarf.name))
-                    if N_wd not in self.executed_models.keys():
-                        self.executed_models[N_wd] = list()
-                    self.executed_models[N_wd].append(model_name)
+                    model.execute(N_wd, self.get_chains_dir(white_dwarf.name), self.create_context(N_wd, model_name, model.prior_name), self.sampler)
+                    if self.formation_cache is not None:
+                        print(self.formation_cache)
+                    if self.warm_start_index is not None:
+                        print(self.warm_start_index)
+                    self.mark_executed(N_wd, model_name, model)
+
+    def submit_model(self, N_wd, model_name, prior_name):
+        if (N_wd, model_name) not in self.pending_models and model_name not in self.executed_models.get(N_wd, list()):
+            # Hierarchy models are built on the fly, so the worker needs to be told what the model contains
+            self.pending_models[(N_wd, model_name)] = self.executor.submit(execute_model_in_worker, N_wd, model_name, prior_name, mp.model_definitions_dict[model_name])
+
+    def execute_models_concurrently(self, N_wd, speculative_models=None):
+        # Submit every model before waiting on any of them, so that they all run at once
+        # speculative_models (a dict of model name -> prior name) are submitted but not waited for: they might be needed by a later call
+        for model_name, model in self.models.items():
+            print('Submitting model ' + model_name + ' with prior ' + model.prior_name)
+            self.submit_model(N_wd, model_name, model.prior_name)
+        if speculative_models is not None:
+            for model_name, prior_name in speculative_models.items():
+                print('Speculatively submitting model ' + model_name + ' with prior ' + prior_name)
+                self.submit_model(N_wd, model_name, prior_name)
+        for model_name, model in self.models.items():
+            future = self.pending_models.pop((N_wd, model_name), None)
+            if future is not None:
+                model.result = self.collect_worker_result(future)
+                self.mark_executed(N_wd, model_name, model)
+
+    def collect_worker_result(self, future):
+        # Workers send back their profiler along with the result (see execute_model_in_worker)
+        result, profiler = future.result()
+        if self.profiler is not None and profiler is not None:
+            self.profiler.merge(profiler)
+        return result
+
+    def cancel_speculative_models(self, N_wd):
+        # Any speculative models still pending were not needed. Those already running can't be stopped, but will just be ignored
+        for key in [key for key in self.pending_models.keys() if key[0] == N_wd]:
+            self.pending_models.pop(key).cancel()
 
     def compare(self, N_wd):
+        if not self.is_root:
+            # Only rank 0 analyses the chains, but every rank needs the best model so that they all run the same models next
+            return self.mpi_comm.bcast(None, root=0)
         wd_name = self.white_dwarfs[N_wd].name
         print('Comparing models for ' + wd_name)
         self.publish_live_data(N_wd)
@@ -532,13 +715,57 @@ class Manager:
                 model.best_model = True
             else:
                 model.best_model = False
+        if self.mpi_comm is not None:
+            self.mpi_comm.bcast(max_ln_Z_name, root=0)
         return max_ln_Z_name
 
     def run(self, systems_to_run=None):
         if systems_to_run is None:  # Run the whole input file by default
             systems_to_run = range(len(self.white_dwarfs))
-        for system in systems_to_run:
-            self.run_system(system)
+        systems_to_run = self.get_systems_to_run(systems_to_run)
+        if self.workers > 1:
+            self.run_in_parallel(systems_to_run)
+        else:
+            for system in systems_to_run:
+                self.run_system(system)
+
+    def run_in_parallel(self, systems_to_run):
+        # Each worker process builds its own Manager (so loads the input data once) and then takes tasks from the pool
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=initialise_worker, initargs=(self.args,)) as executor:
+            if self.use_hierarchy and len(systems_to_run) < self.workers:
+                # Too few systems to keep every worker busy, so run the systems one at a time here
+                # and share out the models within each hierarchy step instead
+                self.executor = executor
+                try:
+                    for system in systems_to_run:
+                        self.run_system(system)
+                finally:
+                    self.executor = None
+            elif self.use_hierarchy:
+                # Each step of a hierarchy depends on the comparison before it, so each worker runs whole systems
+                futures = collections.OrderedDict()
+                for system in systems_to_run:
+                    futures[system] = executor.submit(run_system_in_worker, system)
+                for system, future in futures.items():
+                    self.final_hierarchy = future.result()
+                    print('Final hierarchy for ' + self.white_dwarfs[system].name + ': ' + str(self.final_hierarchy))
+            else:
+                # Every (system, model) pair is independent, so each one is a separate task
+                # The chains are written to disk by the workers, then compared and analysed here, one system at a time
+                futures = collections.OrderedDict()
+                for system in systems_to_run:
+                    self.load_completed_models(system)
+                    for model_name, model in self.models.items():
+                        if model_name not in self.executed_models.get(system, list()):
+                            futures[(system, model_name)] = executor.submit(execute_model_in_worker, system, model_name, model.prior_name)
+                for system in systems_to_run:
+                    for model_name, model in self.models.items():
+                        future = futures.get((system, model_name))
+                        if future is not None:
+                            model.result = self.collect_worker_result(future)
+                            self.mark_executed(system, model_name, model)
+                    self.compare(system)
+                    self.analyse_models(system)
 
     def build_model(self, hierarchy_level_list):
         # Make a pollution model consisting of the parameters in the relevent hierarchy levels of the parameter hierarchy
@@ -581,7 +808,14 @@ class Manager:
                     print('Attempting to register ' + base_model_name + ' and ' + comparison_model_name)
                     self.models[base_model_name] = pm.PollutionModel(base_model_name, self.enhancement_model, self.default_prior, self.n_live_points, self.seed)
                     self.models[comparison_model_name] = pm.PollutionModel(comparison_model_name, self.enhancement_model, self.default_prior, self.n_live_points, self.seed)
-                    self.execute_models(system_to_run)
+                    speculative_models = None
+                    if self.executor is not None and self.parameter_hierarchy.get(max_hierarchy_level+2) is not None:
+                        # Whichever way this comparison goes, one of these will be the comparison model at the next step
+                        # so start them both now rather than waiting for the comparison
+                        speculative_models = collections.OrderedDict()
+                        speculative_models[self.build_model(accepted_hierarchy_levels + [max_hierarchy_level+1, max_hierarchy_level+2])] = self.default_prior
+                        speculative_models[self.build_model(accepted_hierarchy_levels + [max_hierarchy_level+2])] = self.default_prior
+                    self.execute_models(system_to_run, speculative_models)
                     best_model = self.compare(system_to_run)
                     max_hierarchy_level += 1
                     if comparison_model_name == best_model:
@@ -604,11 +838,14 @@ class Manager:
                 self.final_hierarchy = [int(c) for c in best_model if c.isdigit()]
             ap_models = self.register_models_with_altered_priors(best_model, white_dwarf.name)
             self.execute_models(system_to_run)
-            for ap_model in ap_models:
-                self.analyser.compare_two_models(self.models[ap_model], self.models[best_model], output_dir, system_to_run, len(white_dwarf.get_elements_present()))
-                for other_ap_model in ap_models:
-                    if ap_model is not other_ap_model:  # Using 'is not' rather than '!=' checks that they are (not) actually the same object instance, rather than (not) objects of equal value, which is want we want here
-                        self.analyser.compare_two_models(self.models[ap_model], self.models[other_ap_model], output_dir, system_to_run, len(white_dwarf.get_elements_present()))
+            if self.is_root:
+                for ap_model in ap_models:
+                    self.analyser.compare_two_models(self.models[ap_model], self.models[best_model], output_dir, system_to_run, len(white_dwarf.get_elements_present()))
+                    for other_ap_model in ap_models:
+                        if ap_model is not other_ap_model:  # Using 'is not' rather than '!=' checks that they are (not) actually the same object instance, rather than (not) objects of equal value, which is want we want here
+                            self.analyser.compare_two_models(self.models[ap_model], self.models[other_ap_model], output_dir, system_to_run, len(white_dwarf.get_elements_present()))
+            if self.executor is not None:
+                self.cancel_speculative_models(system_to_run)
             self.analyse_models(system_to_run)
 
         else:
@@ -617,6 +854,8 @@ class Manager:
             self.analyse_models(system_to_run)
 
     def analyse_models(self, N_wd):
+        if not self.is_root:
+            return
         suppress_graphical_output = False # This flag is a workaround (It exists because I found that if running a lot of systems in one go, the graphical output can cause weird crashes)
         if suppress_graphical_output:
             print('Warning! Graphical output is being suppressed. Switch it on in manager.py -> Manager class -> analyse_models')
@@ -625,7 +864,7 @@ class Manager:
         self.create_dir(self.get_output_dir(wd_name))
         self.analyser.update_graph_dir(self.get_output_dir(wd_name))
         self.publish_live_data(N_wd)
-        hierarchy_name = pu.hierarchy_abbreviations[self.hierarchy_name] if self.model_names is None else '_'.join(self.model_names)
+        hierarchy_name = self.get_run_name()
         stats_file = self.get_output_dir(wd_name) + wd_name + '_p' + str(self.n_live_points) + '_' + hierarchy_name + '_' + pu.abbreviations[self.enhancement_model] + '_stats.csv'
         print('Writing to file: ' + stats_file)
         with open(stats_file, 'w', newline='', encoding='utf-8') as f:
@@ -802,4 +1041,33 @@ class Manager:
 #                    self.wd_errors[wd_name],
 #                    mk2_fits_and_errors[3]
 #                )
+        if self.profiler is not None:
+            profile_file = stats_file[:-len('_stats.csv')] + '_profile.csv'
+            print('Writing likelihood profile to file: ' + profile_file)
+            print(self.profiler)
+            self.profiler.write(profile_file)
+            self.profiler.reset()
+        if self.journal is not None:
+            self.journal.record_system(N_wd, wd_name, stats_file)
+
+# The Manager belonging to this worker process (only used when running with more than one worker)
+_worker_manager = None
+
+def initialise_worker(args):
+    global _worker_manager
+    worker_args = copy.copy(args)
+    worker_args.workers = 1
+    _worker_manager = Manager(worker_args)
+
+def execute_model_in_worker(N_wd, model_name, prior_name, model_definition=None):
+    if model_definition is not None:
+        mp.model_definitions_dict[model_name] = model_definition
+    model = pm.PollutionModel(model_name, _worker_manager.enhancement_model, prior_name, _worker_manager.n_live_points, _worker_manager.seed)
+    if _worker_manager.profiler is not None:
+        _worker_manager.profiler.reset()  # So that each task only sends back its own timings
+    model.execute(N_wd, _worker_manager.get_chains_dir(_worker_manager.white_dwarfs[N_wd].name), _worker_manager.create_context(N_wd, model_name, prior_name), _worker_manager.sampler)
+    return model.result, _worker_manager.profiler
 
+def run_system_in_worker(N_wd):
+    _worker_manager.run_system(N_wd)
+    return _worker_manager.final_hierarchy
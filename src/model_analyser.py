@@ -6,7 +6,6 @@ import corner
 import csv
 import matplotlib.pyplot as plt
 import numpy as np
-import pymultinest as pn
 from scipy.special import erfcinv
 from scipy.special import lambertw as W
 from scipy import stats as stat
@@ -24,6 +23,7 @@ import live_data as ld
 import model_parameters as mp
 import pollution_model as pm
 import pwd_utils as pu
+import samplers as smp
 import solar_abundances as sa
 import white_dwarf as wd
 
@@ -73,8 +73,8 @@ class ModelAnalyser:
 
         norm_log = (-0.5*np.log(2.0*np.pi*err_data*err_data)).sum()
 
-        retrieved_M1 = pn.Analyzer(n_params = n_params, outputfiles_basename = basename_M1)
-        retrieved_M2 = pn.Analyzer(n_params = (n_params-n_removed), outputfiles_basename = basename_M2)
+        retrieved_M1 = smp.get_analyzer(n_params, basename_M1)
+        retrieved_M2 = smp.get_analyzer(n_params-n_removed, basename_M2)
         s_M1 = retrieved_M1.get_stats()
         s_M2 = retrieved_M2.get_stats()
 
@@ -801,7 +801,7 @@ class ModelAnalyser:
         return count / len(stats_object)
 
     def get_stats_weightpost_and_best_fit(self, model, observation_number, chains_dir):
-        a = pn.Analyzer(n_params = model.get_n_dims(), outputfiles_basename = model.get_full_prefix(chains_dir, observation_number))
+        a = smp.get_analyzer(model.get_n_dims(), model.get_full_prefix(chains_dir, observation_number))
         stats = a.get_stats()
         weightpost = a.get_equal_weighted_posterior()[:, 0:model.get_n_dims()]  # This is basically just excluding the final column of the ...post_equal_weights.dat file
         best_fit = a.get_best_fit()
@@ -33,9 +33,52 @@
 import csv
 import numpy as np
 
+from numba import jit
+
 import chemistry_info as ci
 import geology_info as gi # gi imports this file - ideally remove circularity
 
+# Compiled equivalent of the numpy code in PartitionModel.calculate_log_gammas (see there for the matrix form)
+# x is the alloy composition without Fe. Terms which are nan (from x = 0) are dropped, as in the numpy version
+# Only the order of the summations differs, so results agree to floating point precision
+@jit(nopython=True, error_model='numpy')
+def calculate_log_gammas_kernel(x, eps, logg0, T0_over_T):
+    n = len(x)
+    one = 0.0
+    for j in range(n):
+        one += eps[j, j]*(x[j] + np.log(1 - x[j]))
+    two = 0.0
+    three = 0.0
+    row_sums = np.zeros(n)
+    for j in range(n):
+        xj = x[j]
+        log_1_minus_xj_over_xj = np.log(1 - xj)/xj
+        one_over_1_minus_xj = 1/(1 - xj)
+        xj_term = xj/(2*(1 - xj)**2)
+        for k in range(n):
+            if k == j:
+                continue
+            xk = x[k]
+            e = eps[j, k]
+            log_1_minus_xk_over_xk = np.log(1 - xk)/xk
+            one_over_1_minus_xk = 1/(1 - xk)
+            eps_xj2_xk2 = e*xj**2*xk**2
+            if k > j:
+                two_jk = -e*xk*xj*(1 + log_1_minus_xj_over_xj + log_1_minus_xk_over_xk) + 0.5*eps_xj2_xk2*(one_over_1_minus_xj + one_over_1_minus_xk - 1)
+                if not np.isnan(two_jk):
+                    two += two_jk
+            three_jk = e*xj*xk*(1 + log_1_minus_xk_over_xk - one_over_1_minus_xj) - eps_xj2_xk2*(one_over_1_minus_xj + one_over_1_minus_xk + xj_term - 1)
+            if not np.isnan(three_jk):
+                three += three_jk
+            one_jk = -e*xk*(1 + log_1_minus_xk_over_xk - one_over_1_minus_xj) + e*xk**2*xj*(one_over_1_minus_xj + one_over_1_minus_xk + xj_term - 1)
+            if not np.isnan(one_jk):
+                row_sums[j] += one_jk
+    loggFe = one + two + three
+    logg = np.empty(n)
+    for j in range(n):
+        logg[j] = loggFe + (T0_over_T*logg0[j]) - eps[j, j]*np.log(1 - x[j]) + row_sums[j]
+    return loggFe, logg
+
 class PartitionModel:
     
     def __init__(self, file_params, file_interactions, file_composition, file_es=None):
@@ -97,6 +140,10 @@ class PartitionModel:
         
         self.load_fischer_es(file_es)
 
+        self.use_compiled_kernels = True  # If False, fall back on the (slower, but easier to read) pure numpy gamma calculation
+
+        self.prepare_partitioning_arrays()
+
     def load_partition_parameters(self, file_params):
         with open(file_params, encoding='utf-8') as csvfile:
             read = csv.reader(csvfile, delimiter=' ')
@@ -172,16 +219,55 @@ class PartitionModel:
                 self.alloy_els.append(ci.Element[row[0]])
                 self.alloy = np.append(self.alloy, np.array(float(row[1])))
     
+    def prepare_partitioning_arrays(self):
+        # Everything in the innermost loop (calculate_D) works on arrays indexed by position in logg0name (i.e. alloy_els[1:])
+        # so that no Element-keyed dicts need to be built or hashed per call
+        self.els_to_iterate_over = [el for el in self.partitioners if el in self.logg0name + [ci.Element.Fe]]  # Filter out elements that we don't have partitioning info for
+        self.special_elements = [ci.Element.Fe, ci.Element.S, ci.Element.Placeholder]
+        self.standard_elements = [el for el in self.els_to_iterate_over if el not in self.special_elements]
+        self.standard_gamma_indices = np.array([self.logg0name.index(el) for el in self.standard_elements], dtype=int)
+        self.standard_positions = np.array([self.els_to_iterate_over.index(el) for el in self.standard_elements], dtype=int)
+        self.special_positions = [(self.els_to_iterate_over.index(el), el) for el in self.special_elements if el in self.els_to_iterate_over]
+        self.standard_parameters = self.get_standard_parameter_arrays()
+        self.standard_uses_gammaFe = np.array([self.source[el] in ['f1', 'f2', 'b'] for el in self.standard_elements])
+        self.fischer_indices_i = np.array([self.logg0name.index(el_i) for el_i, el_j in self.fischer_es.keys()], dtype=int)
+        self.fischer_indices_j = np.array([self.logg0name.index(el_j) for el_i, el_j in self.fischer_es.keys()], dtype=int)
+        self.fischer_e_values = np.array(list(self.fischer_es.values()))
+        self.fischer_masses = np.array([ci.get_element_mass(el_j) for el_i, el_j in self.fischer_es.keys()])
+        # Compositions passed around as arrays are aligned with ele_set:
+        self.ele_set_indices = {el: index for index, el in enumerate(self.ele_set)}
+        self.ele_set_masses = np.array([ci.get_element_mass(el) for el in self.ele_set])
+        self.alloy_positions = np.array([self.ele_set_indices.get(el, -1) for el in self.alloy_els], dtype=int)  # -1 means not in ele_set, i.e. 0
+        self.layer_abundance_positions = (None, None)  # Cached positions of ele_set in the most recently seen LayerAbundances layout
+        self.eps_table_T = None  # The eps table only depends on T, which is fixed for each planet formation, so cache the most recent one
+        self.eps_table = None
+
+    def get_standard_parameter_arrays(self, params=None):
+        # Returns a, b, c, d, v as arrays aligned with self.standard_elements
+        if params is None:
+            params = [self.a, self.b, self.c, self.d, self.v]
+        return [np.array([param[el] for el in self.standard_elements]) for param in params[:5]]
+
     def calculate_gammas(self, T=None, composition=None):
         if T is None:
             T = self.T0
+        loggFe, logg = self.calculate_log_gammas(T, composition)
+        gammas = dict(zip(self.logg0name, np.exp(logg)))
+        gammas[ci.Element.Fe] = np.exp(loggFe)
+        #gammas[ci.Element.O] *= np.exp(4.29 - (16500/T))  # This is a hack to account for Badro's gamma parametrisation for O
+        return gammas
+
+    def calculate_log_gammas(self, T, composition=None):
+        # Returns ln(gamma_Fe), and an array of ln(gamma) for the elements in logg0name
         if composition is None:
             x = self.alloy[1:]
         else:
             x = composition[1:]
-        xk = np.tile(x,[len(x),1])
-        xj = np.transpose(xk)
         eps = self.construct_eps_table(T, x)
+        if self.use_compiled_kernels:
+            return calculate_log_gammas_kernel(x, eps, self.logg0, self.T0/T)
+        xk = x[np.newaxis, :]  # Broadcasting these gives the same matrices as np.tile, without building them
+        xj = x[:, np.newaxis]
         with np.errstate(divide='ignore',invalid='ignore'):
             log_1_minus_xj_over_xj = np.log(1-xj)/xj
             log_1_minus_xk_over_xk = np.log(1-xk)/xk
@@ -210,18 +296,16 @@ class PartitionModel:
             one = one - np.diag(np.diag(one))
             one = np.sum(one,axis=1)
             logg = loggFe + ((self.T0/T)*self.logg0) - np.transpose(np.diag(eps))*np.log(1-x) + np.transpose(one)
-            gammas = dict(zip(self.logg0name, np.exp(logg)))
-            gammas[ci.Element.Fe] = np.exp(loggFe)
-            #gammas[ci.Element.O] *= np.exp(4.29 - (16500/T))  # This is a hack to account for Badro's gamma parametrisation for O
-            return gammas
+            return loggFe, logg
 
     def construct_eps_table(self, T, alloy_composition_without_Fe):
+        if T == self.eps_table_T:
+            return self.eps_table
         scaling_factor = self.T0/T  # T0 is the reference temperature
         eps = scaling_factor*self.eps
-        for el_i, el_j in self.fischer_es.keys():
-            i = self.logg0name.index(el_i)
-            j = self.logg0name.index(el_j)
-            eps[i][j] = self.calculate_eps_from_e(el_i, el_j, T)
+        # Equivalent to calling calculate_eps_from_e for each Fischer e, but vectorised
+        if len(self.fischer_e_values) > 0:
+            eps[self.fischer_indices_i, self.fischer_indices_j] = ((self.fischer_e_values*self.fischer_masses*self.e_T0)/(0.242*T)) - (self.fischer_masses/55.85) + 1
         
         # Damp Si/O interaction above certain core concentrations:
         # This causes convergence problems! Disabling it for now
@@ -236,6 +320,9 @@ class PartitionModel:
             o_index_2 = self.logg0name.index(ci.Element.O)
             eps[si_index_2][o_index_2] *= damping_factor
             eps[o_index_2][si_index_2] *= damping_factor
+        else:
+            self.eps_table_T = T
+            self.eps_table = eps
         return eps
     
     def interaction_damping_function(self, X_Si_core, X_O_core):
@@ -252,101 +339,111 @@ class PartitionModel:
         return ((e*M_j*self.e_T0)/(0.242*T)) - (M_j/55.85) + 1
     
     def calculate_D(self, P, T, dIW, nbot, log10_gammaFe_sil, core_composition=None, mantle_composition=None, params=None):
-        first_iteration = core_composition is None # This should be a functional proxy
-        
+        return dict(zip(self.els_to_iterate_over, self.calculate_D_array(P, T, dIW, nbot, log10_gammaFe_sil, core_composition, mantle_composition, params)))
+
+    def calculate_D_array(self, P, T, dIW, nbot, log10_gammaFe_sil, core_composition=None, mantle_composition=None, params=None):
+        # Returns the Ds as an array aligned with self.els_to_iterate_over
+        # Compositions can be dicts, or arrays aligned with self.ele_set
         if core_composition is None:
             alloy_composition = self.alloy
             core_composition = dict()
             for el_index, el in enumerate(self.alloy_els):
                 core_composition[el] = alloy_composition[el_index]
-        else:
+        elif isinstance(core_composition, dict):
             alloy_composition = self.convert_core_composition_to_alloy_composition(core_composition)
+        else:
+            alloy_composition = np.append(core_composition, 0)[self.alloy_positions]
         
-        gammas = self.calculate_gammas(T, alloy_composition)
-        els_to_iterate_over = [el for el in self.partitioners if el in self.logg0name + [ci.Element.Fe]]  # Filter out elements that we don't have partitioning info for
-        d_dict = dict()
-        for e in els_to_iterate_over:
-            p_v = params[4] if params is not None else self.v
-            if e != ci.Element.Fe:
-                logkd_app, sigma_logkd_app_2 = self.calculate_logKD_app(P, T, nbot, e, params) # When iterating over composition, we don't need to recalculate this
-                loggamma = np.log10(gammas[e])
-                loggammaFe = np.log10(gammas[ci.Element.Fe])
-                if e == ci.Element.Placeholder:  # This used to be Oxygen - for Fischer O parametrisation we need to use this logic!
-                    logX_met = logkd_app - loggamma - log10_gammaFe_sil + (0.5*dIW) + (2*loggammaFe)
-                    #sigma_log_dfe_2 = ((self.sigv[e]/4.)**2)*dIW**2
-                    #sigma_logX_met = np.sqrt(sigma_logkd_app_2 + sigma_log_dfe_2)
-                    # Need to cap this somewhere below 100% of the core:
-                    logX_met = min(-1, logX_met)
-                    d_dict[e] = 10**logX_met
-                    #mkdSd_o[e] = (10**(logX_met + sigma_logX_met), 10**(logX_met - sigma_logX_met))
-                elif e == ci.Element.S:
-                    # See Boujibar+ 2014 eqs 6 and 11
-                    # gammas not needed - but they are used for how other elements interact with S
-                    
-                    # Maybe replace this with Terry-Ann Suer's 2017 paper! (equation 8 of https://www.sciencedirect.com/science/article/pii/S0012821X17301954)
-                    
-                    if mantle_composition is None:
-                        # Use a very rough approximation of Earth. Doesn't matter much - this is just an initial guess
-                        X_FeO = 0.06
-                        X_FeO_sil_wt_percent = 2
-                        X_CaO = 0.03
-                        X_MgO = 0.2
-                        X_TiO2 = 0.001
-                        X_Na2O = 0.002
-                        X_K2O = 0.001
-                    else:
-                        # The logic here is that I'm assuming all these elements in the silicate are fully oxidised.
-                        # (And that this accounts for all the Oxygen)
-                        # So to get X for FeO, it's just the fraction of Fe out of everything that's not oxygen
-                        # So X_FeO = X_Fe/(1 - X_O)
-                        # This can probably afford to be v. rough: it's only to do part of the calculation for Sulfur after all
-                        X_O = mantle_composition[ci.Element.O]
-                        oxygen_modifier = 1/(1-X_O)
-                        
-                        # If these are not present in the dict at this stage, it means they are not present
-                        # in the bulk composition. Hence a default value of 0
-                        
-                        X_FeO = oxygen_modifier*mantle_composition.get(ci.Element.Fe, 0)
-                        X_CaO = oxygen_modifier*mantle_composition.get(ci.Element.Ca, 0)
-                        X_MgO = oxygen_modifier*mantle_composition.get(ci.Element.Mg, 0)
-                        X_TiO2 = oxygen_modifier*mantle_composition.get(ci.Element.Ti, 0)
-                        # Dividing the next ones by 2 because there's half as many Na2(O) as Na(O)
-                        X_Na2O = 0.5*oxygen_modifier*mantle_composition.get(ci.Element.Na, 0)
-                        X_K2O = 0.5*oxygen_modifier*mantle_composition.get(ci.Element.K, 0)
-                        # I'm assuming the FeO wt % is directly proportional to the molar %
-                        # and taking the constant from cells K3 and G3 here: https://www.researchgate.net/publication/308404683_Sulfur_partitioning_calculator
-                        # This is potentially inaccurate
-                        X_FeO_sil_wt_percent = 127.5862069*X_FeO
-                    
-                    core_composition_by_mass = self.convert_composition_to_mass(core_composition)
-                    X_Si = core_composition_by_mass[ci.Element.Si]
-                    X_C = core_composition_by_mass[ci.Element.C]
-                    X_Fe = core_composition_by_mass[ci.Element.Fe]
-                    X_Ni = core_composition_by_mass[ci.Element.Ni]
-                    X_O = core_composition_by_mass[ci.Element.O]
-                    
-                    
-                    
-                    logCs = self.calculate_logCs(X_FeO, X_CaO, X_MgO, X_TiO2, X_Na2O, X_K2O)
-                    S_interactions = self.calculate_S_interactions(X_Si, X_C, X_Fe, X_Ni, X_O)
-                    
-                    logD = np.log10(X_FeO_sil_wt_percent) - logCs + logkd_app + S_interactions
-                    d_dict[e] = 10**logD
-                else:
-                    additional_term = ((1 - (0.5*p_v[e]))*loggammaFe) if self.source[e] in ['f1', 'f2', 'b'] else 0  # We take care of gamma_0 elsewhere by setting it to 0 in the input file
-                    logD = logkd_app - loggamma + (0.5*p_v[e]*(log10_gammaFe_sil - (0.5*dIW))) + additional_term
-                    #sigma_log_dfe_2 = ((self.sigv[e]/4.)**2)*dIW**2
-                    #sigma_logD = np.sqrt(sigma_logkd_app_2 + sigma_log_dfe_2)
-                    d_dict[e] = 10**logD
-                    #mkdSd_o[e] = (10**(logD + sigma_logD), 10**(logD - sigma_logD))
-            else:
-                loggammaFe = np.log10(gammas[ci.Element.Fe])
+        ln_gammaFe, ln_gammas = self.calculate_log_gammas(T, alloy_composition)
+        loggammas = np.log10(np.exp(ln_gammas))
+        loggammaFe = np.log10(np.exp(ln_gammaFe))
+        Ds = np.zeros(len(self.els_to_iterate_over))
+
+        # All elements without special treatment can be done at once:
+        p_a, p_b, p_c, p_d, p_v = self.standard_parameters if params is None else self.get_standard_parameter_arrays(params)
+        logkd_app = p_a + p_b/T + p_c*P/T + p_d*nbot  # As in calculate_logKD_app
+        additional_term = np.where(self.standard_uses_gammaFe, (1 - (0.5*p_v))*loggammaFe, 0)  # We take care of gamma_0 elsewhere by setting it to 0 in the input file
+        logD = logkd_app - loggammas[self.standard_gamma_indices] + (0.5*p_v*(log10_gammaFe_sil - (0.5*dIW))) + additional_term
+        Ds[self.standard_positions] = 10**logD
+
+        for position, e in self.special_positions:
+            if e == ci.Element.Fe:
                 logdfe = self.calculate_logDFe(log10_gammaFe_sil, dIW, loggammaFe) # When iterating over composition, we don't need to recalculate this
                 #sigma_log_dfe_2 = ((self.sigv[e]/4.)**2)*dIW**2 #This isn't very nice
-                d_dict[e] = 10**logdfe
+                Ds[position] = 10**logdfe
                 #mkdSd_o[e] = (10**(logdfe + sigma_log_dfe_2), 10**(logdfe - sigma_log_dfe_2))
-        return d_dict
+            elif e == ci.Element.Placeholder:  # This used to be Oxygen - for Fischer O parametrisation we need to use this logic!
+                logkd_app, sigma_logkd_app_2 = self.calculate_logKD_app(P, T, nbot, e, params)
+                loggamma = loggammas[self.logg0name.index(e)]
+                logX_met = logkd_app - loggamma - log10_gammaFe_sil + (0.5*dIW) + (2*loggammaFe)
+                #sigma_log_dfe_2 = ((self.sigv[e]/4.)**2)*dIW**2
+                #sigma_logX_met = np.sqrt(sigma_logkd_app_2 + sigma_log_dfe_2)
+                # Need to cap this somewhere below 100% of the core:
+                logX_met = min(-1, logX_met)
+                Ds[position] = 10**logX_met
+                #mkdSd_o[e] = (10**(logX_met + sigma_logX_met), 10**(logX_met - sigma_logX_met))
+            elif e == ci.Element.S:
+                Ds[position] = self.calculate_D_S(P, T, nbot, core_composition, mantle_composition, params)
+        return Ds
+
+    def calculate_D_S(self, P, T, nbot, core_composition, mantle_composition, params=None):
+        e = ci.Element.S
+        logkd_app, sigma_logkd_app_2 = self.calculate_logKD_app(P, T, nbot, e, params)
+        # See Boujibar+ 2014 eqs 6 and 11
+        # gammas not needed - but they are used for how other elements interact with S
+        
+        # Maybe replace this with Terry-Ann Suer's 2017 paper! (equation 8 of https://www.sciencedirect.com/science/article/pii/S0012821X17301954)
+        
+        if mantle_composition is None:
+            # Use a very rough approximation of Earth. Doesn't matter much - this is just an initial guess
+            X_FeO = 0.06
+            X_FeO_sil_wt_percent = 2
+            X_CaO = 0.03
+            X_MgO = 0.2
+            X_TiO2 = 0.001
+            X_Na2O = 0.002
+            X_K2O = 0.001
+        else:
+            # The logic here is that I'm assuming all these elements in the silicate are fully oxidised.
+            # (And that this accounts for all the Oxygen)
+            # So to get X for FeO, it's just the fraction of Fe out of everything that's not oxygen
+            # So X_FeO = X_Fe/(1 - X_O)
+            # This can probably afford to be v. rough: it's only to do part of the calculation for Sulfur after all
+            X_O = self.get_composition_value(mantle_composition, ci.Element.O)
+            oxygen_modifier = 1/(1-X_O)
+            
+            # If these are not present in the dict at this stage, it means they are not present
+            # in the bulk composition. Hence a default value of 0
+            
+            X_FeO = oxygen_modifier*self.get_composition_value(mantle_composition, ci.Element.Fe)
+            X_CaO = oxygen_modifier*self.get_composition_value(mantle_composition, ci.Element.Ca)
+            X_MgO = oxygen_modifier*self.get_composition_value(mantle_composition, ci.Element.Mg)
+            X_TiO2 = oxygen_modifier*self.get_composition_value(mantle_composition, ci.Element.Ti)
+            # Dividing the next ones by 2 because there's half as many Na2(O) as Na(O)
+            X_Na2O = 0.5*oxygen_modifier*self.get_composition_value(mantle_composition, ci.Element.Na)
+            X_K2O = 0.5*oxygen_modifier*self.get_composition_value(mantle_composition, ci.Element.K)
+            # I'm assuming the FeO wt % is directly proportional to the molar %
+            # and taking the constant from cells K3 and G3 here: https://www.researchgate.net/publication/308404683_Sulfur_partitioning_calculator
+            # This is potentially inaccurate
+            X_FeO_sil_wt_percent = 127.5862069*X_FeO
+        
+        if isinstance(core_composition, dict):
+            core_composition_by_mass = self.convert_composition_to_mass(core_composition)
+        else:
+            core_masses = core_composition*self.ele_set_masses
+            core_composition_by_mass = core_masses/np.cumsum(core_masses)[-1]  # Summed sequentially, as in convert_composition_to_mass
+        X_Si = self.get_composition_value(core_composition_by_mass, ci.Element.Si)
+        X_C = self.get_composition_value(core_composition_by_mass, ci.Element.C)
+        X_Fe = self.get_composition_value(core_composition_by_mass, ci.Element.Fe)
+        X_Ni = self.get_composition_value(core_composition_by_mass, ci.Element.Ni)
+        X_O = self.get_composition_value(core_composition_by_mass, ci.Element.O)
+
+        logCs = self.calculate_logCs(X_FeO, X_CaO, X_MgO, X_TiO2, X_Na2O, X_K2O)
+        S_interactions = self.calculate_S_interactions(X_Si, X_C, X_Fe, X_Ni, X_O)
         
+        logD = np.log10(X_FeO_sil_wt_percent) - logCs + logkd_app + S_interactions
+        return 10**logD
+
     # NB: Corgne+ 2008 parametrise KD_app as shown here, but Fischer+ 2015 actually parametrise KD instead, which is why the fischer_update corrections exist
     def calculate_logKD_app(self, P, T, nbot, e, params=None):
         # allow parameters to be updated to propagate error through model
@@ -428,8 +525,13 @@ class PartitionModel:
         return Ds
 
     def get_all_partition_coefficients(self, pressure, fO2, abundances=None, temp=None, nbot=None):
-        core_composition = self.convert_abundance_dict_to_layer_composition(gi.Layer.core, abundances)
-        mantle_composition = self.convert_abundance_dict_to_layer_composition(gi.Layer.mantle, abundances)
+        # abundances can be a dict[Element][Layer] or a geology_info.LayerAbundances
+        if isinstance(abundances, gi.LayerAbundances):
+            core_composition = self.convert_layer_abundances_to_layer_composition(gi.Layer.core, abundances)
+            mantle_composition = self.convert_layer_abundances_to_layer_composition(gi.Layer.mantle, abundances)
+        else:
+            core_composition = self.convert_abundance_dict_to_layer_composition(gi.Layer.core, abundances)
+            mantle_composition = self.convert_abundance_dict_to_layer_composition(gi.Layer.mantle, abundances)
         Ds = self.calculate_partition_coefficients(pressure, fO2, core_composition, mantle_composition, temp, nbot)
         for element in self.non_partitioners:
             Ds[element] = 0
@@ -447,6 +549,21 @@ class PartitionModel:
                 return None
         return composition
     
+    def convert_layer_abundances_to_layer_composition(self, layer, abundances):
+        # Array equivalent of convert_abundance_dict_to_layer_composition: returns an array aligned with ele_set, or None
+        if len(abundances) == 0:
+            return None
+        if self.layer_abundance_positions[0] != abundances.elements:
+            self.layer_abundance_positions = (abundances.elements, abundances.get_positions(self.ele_set))
+        return abundances.get_layer(layer, self.layer_abundance_positions[1])
+
+    def get_composition_value(self, composition, element):
+        # Works for dicts, and arrays aligned with ele_set. Missing elements are not present, i.e. 0
+        if isinstance(composition, dict):
+            return composition.get(element, 0)
+        index = self.ele_set_indices.get(element)
+        return 0 if index is None else composition[index]
+
     def convert_core_composition_to_alloy_composition(self, core_composition):
         alloy = np.array([core_composition.get(element, 0) for element in self.alloy_els])
         return alloy
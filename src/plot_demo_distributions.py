@@ -7,6 +7,7 @@ import csv
 import geology_info as gi
 import model_parameters as mp
 import numpy as np
+import pwd_utils as pu
 
 def load_hollands_distributions():
     teffs = list()
@@ -16,7 +17,7 @@ def load_hollands_distributions():
     file_name = 'WDInputData'
     min_row = 1
     max_row = 201
-    with open('../data/' + file_name + '.csv', encoding='utf-8') as config_csv:
+    with open(pu.get_path_to_data() + file_name + '.csv', encoding='utf-8') as config_csv:
         row_count = 0
         for row in csv.reader(config_csv, delimiter=','):
             if min_row <= row_count <= max_row:
@@ -3,13 +3,14 @@
 
 from pathlib import Path
 
+import functools
 import json
 
 import loglike_functions as lf
 import model_parameters as mp
 import prior_functions as pf
 import pwd_utils as pu
-import pymultinest as pn
+import samplers as smp
 
 class PollutionModel:
     
@@ -24,6 +25,7 @@ class PollutionModel:
         self.set_model_params(model_definition)
         self.prior = pf.universal_prior
         self.loglike = lf.universal_loglike
+        self.loglike_batch = lf.universal_loglike_batch
         self.verbose = verbose
         self.live_points = live_points
         self.seed = seed
@@ -74,7 +76,7 @@ class PollutionModel:
     def get_model_params(self):
         return self.params
     
-    def execute(self, observation_number, output_dir):
+    def execute(self, observation_number, output_dir, context=None, sampler=None):
         # What other parameters should (could) this have?
         # - Core/mantle/crust compositions
         # - Core/crust fractions of fragment/parent
@@ -94,31 +96,45 @@ class PollutionModel:
         print(self.seed)
         print(self.minimum_likelihood)
         
+        if sampler is None:
+            sampler = smp.MultiNestSampler()
+        print(sampler.name)
+        
         disable_filename_error = False
-        max_file_length = 78 # 100 minus 22 characters that PyMultiNest will add
+        max_file_length = sampler.max_prefix_length
         
-        if not disable_filename_error and len(self.get_full_prefix(output_dir, observation_number)) > max_file_length:
+        if not disable_filename_error and max_file_length is not None and len(self.get_full_prefix(output_dir, observation_number)) > max_file_length:
             raise IOError('\nOutput path ' + self.get_full_prefix(output_dir, observation_number) + ' is too long!\nLength was ' + str(len(self.get_full_prefix(output_dir, observation_number))) + ', but max length is ' + str(max_file_length) + ' so that the full names fit in 100 characters\nThe 100 character limit is hardcoded in MultiNest v3.10.\nIf you are using MultiNest 3.11 or later, you should be able to just disable this error (line 97 in ' + str(Path(__file__).resolve()) + ')\n(This is untested though!)')
         
         #progress_plotter = pn.ProgressPlotter(n_params = self.get_n_dims(), outputfiles_basename = self.get_full_prefix(observation_number))
         #progress_plotter.start()
         
-        self.result = pn.solve(
-            LogLikelihood=self.loglike,
-            Prior=self.prior,
-            n_dims=self.get_n_dims(),
-            outputfiles_basename = self.get_full_prefix(output_dir, observation_number),
-            verbose=self.verbose,
-            n_live_points=self.live_points,
-            seed=self.seed,
-            #evidence_tolerance = 0.5,
-            #sampling_efficiency = 0.8,
-            #multimodal = False,
-            log_zero = self.minimum_likelihood  # if likelihood < minimum_likelihood, point gets ignored (use this for errors)
+        # pymultinest only passes the cube, so the context (if any) is bound in here. Otherwise the module level live data is used
+        if context is None:
+            prior = self.prior
+            loglike = self.loglike
+            loglike_batch = self.loglike_batch
+        else:
+            prior = functools.partial(self.prior, context=context)
+            loglike = functools.partial(self.loglike, context=context)
+            loglike_batch = functools.partial(self.loglike_batch, context=context)
+
+        self.result = sampler.run(
+            prior,
+            loglike,
+            loglike_batch,  # Only used by samplers which can evaluate many points at once
+            self.get_n_dims(),
+            self.get_full_prefix(output_dir, observation_number),
+            self.live_points,
+            self.seed,
+            self.verbose,
+            self.minimum_likelihood  # if likelihood < minimum_likelihood, point gets ignored (use this for errors)
         )
         #progress_plotter.stop()
-        print('evidence: %(logZ).1f +- %(logZerr).1f' % self.result)
-        print("MultiNest Model " + self.get_full_prefix(output_dir, observation_number) + " Completed")
-        with open('%sparams.json' % self.get_full_prefix(output_dir, observation_number), 'w') as f:
-            json.dump(self.params, f, indent=2)
+        if pu.get_mpi_rank() == 0:
+            # Under MPI, every rank takes part in the sampling but only rank 0 writes output
+            print('evidence: %(logZ).1f +- %(logZerr).1f' % self.result)
+            print("MultiNest Model " + self.get_full_prefix(output_dir, observation_number) + " Completed")
+            with open('%sparams.json' % self.get_full_prefix(output_dir, observation_number), 'w') as f:
+                json.dump(self.params, f, indent=2)
         #self.results[str(stellar_composition)] = 'Result of executing ' + str(self) + ' on composition ' + str(stellar_composition)
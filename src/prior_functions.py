@@ -29,17 +29,24 @@ parameters_to_cycle_through = [
     mp.ModelParameter.oxygen_fugacity
 ]
 
-def get_fragment_crust_frac_upper_limit(cube, parameter_indices):
+# Limit functions take the cube, the cube index of each parameter, and the ModelContext being run (which must not be None)
+def get_fragment_crust_frac_upper_limit(cube, parameter_indices, context):
     return 1 - cube[parameter_indices[mp.ModelParameter.fragment_core_frac]]
 
-def get_pollution_frac_lower_limit(cube, parameter_indices):
-    return ld._live_white_dwarf.estimate_minimum_pollution_fraction(ci.usual_elements) - 0.5 # you can't be too far below this limit!
+def get_pollution_frac_lower_limit(cube, parameter_indices, context):
+    return context.white_dwarf.estimate_minimum_pollution_fraction(ci.usual_elements) - 0.5 # you can't be too far below this limit!
 
-def get_pollution_frac_upper_limit(cube, parameter_indices):
-    return ld._live_white_dwarf.estimate_maximum_pollution_fraction(ci.usual_elements) + 1.5 # The 1.5 is a safety factor: your reference element could happen to be underabundant. need a bigger margin at the top end
+def get_pollution_frac_upper_limit(cube, parameter_indices, context):
+    return context.white_dwarf.estimate_maximum_pollution_fraction(ci.usual_elements) + 1.5 # The 1.5 is a safety factor: your reference element could happen to be underabundant. need a bigger margin at the top end
 
-def get_t_sinceaccretion_upper_limit(cube, parameter_indices):
-    return ((12*ld._live_t_mg)+(10**(cube[parameter_indices[mp.ModelParameter.accretion_timescale]])))/1000000  # NB the variable we're indexing into here is the accretion timescale, not the time since accretion!
+def get_t_sinceaccretion_upper_limit(cube, parameter_indices, context):
+    return ((12*context.t_mg)+(10**(cube[parameter_indices[mp.ModelParameter.accretion_timescale]])))/1000000  # NB the variable we're indexing into here is the accretion timescale, not the time since accretion!
+
+# These limits depend on the white dwarf but not on the cube, so a ModelPlan only needs to evaluate them once
+white_dwarf_dependent_limits = [
+    get_pollution_frac_lower_limit,
+    get_pollution_frac_upper_limit
+]
 
 prior_limits_dict = {
     'Default': {
@@ -124,29 +131,95 @@ prior_limits_dict = {
 }
 
 
-def universal_prior(cube):
-
-    parameter_indices = mp.parameter_indices(ld._live_model)
-
-    for parameter in parameters_to_cycle_through:
-        if mp.model_uses_parameter(ld._live_model, parameter):
-            try:
-                upper_limit_raw = prior_limits_dict[ld._live_prior][parameter][Limit.Upper]
-            except KeyError:
-                upper_limit_raw = prior_limits_dict['Default'][parameter][Limit.Upper]
-            try:
-                lower_limit_raw = prior_limits_dict[ld._live_prior][parameter][Limit.Lower]
-            except KeyError:
-                lower_limit_raw = prior_limits_dict['Default'][parameter][Limit.Lower]
-            try:
-                # Some limits are given by executing a function - if the dictionary entry is callable, we should call it
-                upper_limit = upper_limit_raw(cube, parameter_indices)
-            except TypeError:
-                upper_limit = upper_limit_raw
-            try:
-                lower_limit = lower_limit_raw(cube, parameter_indices)
-            except TypeError:
-                lower_limit = lower_limit_raw
+def get_raw_limit(prior_name, parameter, limit):
+    # Fall back on the Default prior for anything the named prior doesn't override
+    try:
+        return prior_limits_dict[prior_name][parameter][limit]
+    except KeyError:
+        return prior_limits_dict['Default'][parameter][limit]
+
+class ModelPlan:
+    # Everything the prior and likelihood need to know about the live model, worked out once (by Manager.publish_live_model)
+    # rather than on every call: the cube index of each parameter, default values for unused parameters, and the prior limits
+    # context is the ModelContext the plan is for (None means the module level variables in live_data)
+
+    def __init__(self, model_name, enhancement_model, prior_name, context=None):
+        self.model_name = model_name
+        self.enhancement_model = enhancement_model
+        self.prior_name = prior_name
+        self.context = ld.get_context(context)
+        self.white_dwarf = self.context.white_dwarf
+        self.parameter_indices = mp.parameter_indices(model_name)
+        all_params = mp.get_model_params_in_order()
+        # parameter_positions[i] is the position (in mp.get_model_params_in_order()) of the parameter stored at cube[cube_indices[i]]
+        self.parameter_positions = np.array([all_params.index(param) for param in self.parameter_indices.keys()], dtype=int)
+        self.cube_indices = np.array(list(self.parameter_indices.values()), dtype=int)
+        defaults = mp.default_values.get(enhancement_model)
+        # Using dtype=object because some defaults are None
+        self.default_values = None if defaults is None else np.array([defaults[param] for param in all_params], dtype=object)
+        static_indices = list()
+        static_lower_limits = list()
+        static_scalings = list()
+        # Parameters with a limit that depends on the cube are scaled after the static ones, in the order given by parameters_to_cycle_through
+        # This means a dynamic limit can only depend on static parameters or on dynamic parameters earlier in that list
+        self.dynamic_limits = list()
+        for parameter in parameters_to_cycle_through:
+            if parameter in self.parameter_indices:
+                lower_limit = self.resolve_limit(get_raw_limit(prior_name, parameter, Limit.Lower))
+                upper_limit = self.resolve_limit(get_raw_limit(prior_name, parameter, Limit.Upper))
+                if callable(lower_limit) or callable(upper_limit):
+                    self.dynamic_limits.append((self.parameter_indices[parameter], lower_limit, upper_limit))
+                else:
+                    static_indices.append(self.parameter_indices[parameter])
+                    static_lower_limits.append(lower_limit)
+                    static_scalings.append(upper_limit - lower_limit)
+        self.static_indices = np.array(static_indices, dtype=int)
+        self.static_lower_limits = np.array(static_lower_limits, dtype=float)
+        self.static_scalings = np.array(static_scalings, dtype=float)
+
+    def resolve_limit(self, limit):
+        if limit in white_dwarf_dependent_limits and self.white_dwarf is not None:
+            return limit(None, self.parameter_indices, self.context)
+        return limit
+
+    def matches_live_data(self):
+        return self.model_name == self.context.model and self.enhancement_model == self.context.enhancement_model and self.prior_name == self.context.prior and self.white_dwarf is self.context.white_dwarf
+
+    def transform_cube(self, cube):
+        cube = np.asarray(cube, dtype=float)  # No copy if cube is already a float array, so this still updates cube in place
+        cube[self.static_indices] = (self.static_scalings*cube[self.static_indices]) + self.static_lower_limits
+        for index, lower_limit_raw, upper_limit_raw in self.dynamic_limits:
+            upper_limit = upper_limit_raw(cube, self.parameter_indices, self.context) if callable(upper_limit_raw) else upper_limit_raw
+            lower_limit = lower_limit_raw(cube, self.parameter_indices, self.context) if callable(lower_limit_raw) else lower_limit_raw
             scaling_term = upper_limit - lower_limit
-            cube[parameter_indices[parameter]] = (scaling_term*cube[parameter_indices[parameter]]) + lower_limit
-    return cube
+            cube[index] = (scaling_term*cube[index]) + lower_limit
+        return cube
+
+    def get_input_values(self, cube):
+        # Returns a value for every parameter, in the order given by mp.get_model_params_in_order()
+        if self.default_values is None:
+            raise KeyError('No default parameter values for enhancement model ' + str(self.enhancement_model))
+        input_values = self.default_values.copy()
+        input_values[self.parameter_positions] = np.take(cube, self.cube_indices)
+        return input_values
+
+    def get_input_values_batch(self, cubes):
+        # As get_input_values, but each used parameter is a column of cubes (an (N, n_dims) array)
+        if self.default_values is None:
+            raise KeyError('No default parameter values for enhancement model ' + str(self.enhancement_model))
+        input_values = list(self.default_values)
+        for position, index in zip(self.parameter_positions, self.cube_indices):
+            input_values[position] = cubes[:, index]
+        return input_values
+
+def get_live_model_plan(context=None):
+    # Rebuild the plan if the live data has changed since it was published (some callers set ld._live_model directly)
+    context = ld.get_context(context)
+    plan = context.model_plan
+    if plan is None or not plan.matches_live_data():
+        plan = ModelPlan(context.model, context.enhancement_model, context.prior, context)
+        context.model_plan = plan
+    return plan
+
+def universal_prior(cube, context=None):
+    return get_live_model_plan(context).transform_cube(cube)
@@ -3,6 +3,7 @@
 
 import argparse as ap
 import configparser
+import os
 
 from pathlib import Path
 
@@ -38,8 +39,25 @@ def get_path_to_parent():
     # parents[1] is the path of the parent directory
     return str(Path(__file__).resolve().parents[1]) + '/'
 
+# Environment variables which override where the input data (and the caches made from it) are found
+# Useful when running from somewhere other than a checkout of this repository, or when the data directory is read-only
+data_dir_environment_variable = 'PYLLUTEDWD_DATA_DIR'
+cache_dir_environment_variable = 'PYLLUTEDWD_CACHE_DIR'
+
+def get_path_from_environment(environment_variable, default):
+    toret = os.environ.get(environment_variable)
+    if not toret:
+        return default
+    toret = os.path.abspath(os.path.expanduser(toret))  # Otherwise a relative path would depend on the working directory
+    if not toret.endswith('/'):
+        toret += '/'
+    return toret
+
 def get_path_to_data():
-    return get_path_to_parent() + 'data/'
+    return get_path_from_environment(data_dir_environment_variable, get_path_to_parent() + 'data/')
+
+def get_path_to_cache():
+    return get_path_from_environment(cache_dir_environment_variable, get_path_to_data() + 'cache/')
 
 def get_path_to_feni():
     return get_path_to_parent() + 'feni_src/feni/'
@@ -76,6 +94,22 @@ def get_path_to_historical_output_dir():
     # This will only be useful if you have the output from Harrison et al. 2021 in this directory - I can send this, or it can be generated by running the PWDCode.py script in an earlier version of the codebase
     return get_path_to_output_base_dir() + 'output_for_harrison2021/'
 
+def get_mpi_comm():
+    # mpi4py is only needed for MPI runs. Without it there is only ever one rank, and this returns None
+    try:
+        from mpi4py import MPI
+    except ImportError:
+        return None
+    return MPI.COMM_WORLD
+
+def get_mpi_rank():
+    comm = get_mpi_comm()
+    return 0 if comm is None else comm.Get_rank()
+
+def get_mpi_size():
+    comm = get_mpi_comm()
+    return 1 if comm is None else comm.Get_size()
+
 def parse_command_line_arguments():
     parser = ap.ArgumentParser(description='Manager Arguments')
     parser.add_argument(
@@ -110,6 +144,108 @@ def parse_command_line_arguments():
         type=int,
         help='Seed for random number generation. Should be set to -1 for purposes other than testing'
     )
+    parser.add_argument(
+        '--formation_cache_size',
+        default=0,
+        dest='formation_cache_size',
+        type=int,
+        help='Maximum number of planet formation (core-mantle differentiation) results to cache. 0 disables the cache'
+    )
+    parser.add_argument(
+        '--formation_cache_tolerance',
+        default=0,
+        dest='formation_cache_tolerance',
+        type=float,
+        help='Bin width (in dex) used to match the bulk abundances of cached planet formation results. 0 only matches exact repeats'
+    )
+    parser.add_argument(
+        '--formation_cache_pressure_tolerance',
+        default=0,
+        dest='formation_cache_pressure_tolerance',
+        type=float,
+        help='Bin width (in GPa) used to match the pressure of cached planet formation results. 0 only matches exact repeats'
+    )
+    parser.add_argument(
+        '--formation_cache_fO2_tolerance',
+        default=0,
+        dest='formation_cache_fO2_tolerance',
+        type=float,
+        help='Bin width (in log units) used to match the oxygen fugacity of cached planet formation results. 0 only matches exact repeats'
+    )
+    parser.add_argument(
+        '--warm_start',
+        action='store_true',
+        dest='warm_start',
+        help='Seed each planet formation solve with the nearest previously converged solution'
+    )
+    parser.add_argument(
+        '--solver',
+        default='picard',
+        dest='solver',
+        type=str,
+        choices=['picard', 'anderson', 'secant'],
+        help='Fixed point solver used for planet formation (core-mantle differentiation). picard is the original scheme'
+    )
+    parser.add_argument(
+        '--condensation_table',
+        action='store_true',
+        dest='condensation_table',
+        help='Evaluate feeding zone abundances from a precomputed table of condensed fraction against distance (an approximation)'
+    )
+    parser.add_argument(
+        '--feeding_zone_points',
+        default=0,
+        dest='feeding_zone_points',
+        type=int,
+        help='Number of Gauss-Hermite points used to integrate over the feeding zone. 0 uses the original 601 step grid'
+    )
+    parser.add_argument(
+        '--workers',
+        default=1,
+        dest='workers',
+        type=int,
+        help='Number of worker processes. With more than 1, systems (and the models within each system) are run in parallel'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        dest='profile',
+        help='Time each stage of the likelihood calculation, and write the timings to a _profile.csv file next to each stats file'
+    )
+    parser.add_argument(
+        '--sampler',
+        default='multinest',
+        dest='sampler',
+        type=str,
+        choices=['multinest', 'nested'],
+        help='Nested sampling backend. multinest needs the compiled MultiNest library. nested is a pure Python sampler which evaluates likelihoods in batches'
+    )
+    parser.add_argument(
+        '--sampler_workers',
+        default=1,
+        dest='sampler_workers',
+        type=int,
+        help='Number of worker processes the nested sampler uses to evaluate likelihoods (ignored by multinest, which uses MPI)'
+    )
+    parser.add_argument(
+        '--no_journal',
+        action='store_false',
+        dest='journal',
+        help='Do not keep a run journal. By default, finished models and systems are recorded in the output directory, and skipped if the run is restarted'
+    )
+    parser.add_argument(
+        '--mpi_ranks',
+        default=1,
+        dest='mpi_ranks',
+        type=int,
+        help='Number of MPI ranks. With more than 1, main.py relaunches itself under mpirun, and all ranks share each MultiNest run (only rank 0 writes output). Requires mpi4py and an MPI build of MultiNest, so only works with --sampler multinest'
+    )
+    parser.add_argument(
+        '--validate_timescales',
+        action='store_true',
+        dest='validate_timescales',
+        help='Check that every sinking timescale grid loaded completely before running anything (and report how long loading took)'
+    )
     parser.add_argument(
         dest='pollution_model_names',
         type=str,
@@ -121,7 +257,8 @@ def parse_command_line_arguments():
 
 def main():
     print('Source directory is: ' + get_path_to_parent())
-    print('Looking for input data in: ' + get_path_to_data())
+    print('Looking for input data in: ' + get_path_to_data() + ' (set ' + data_dir_environment_variable + ' to change this)')
+    print('Caching parsed data in: ' + get_path_to_cache() + ' (set ' + cache_dir_environment_variable + ' to change this)')
     print('Looking for partitioning data in: ' + get_path_to_feni())
     print('Looking for utility scripts in: ' + get_path_to_utils())
     print('Looking for original code in: ' + get_path_to_original_src())
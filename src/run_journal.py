@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+# A persistent record of which parts of a Manager run have finished, so that a run which dies partway can pick up where it left off
+# Each line of the file is one JSON entry, appended (and flushed to disk) as soon as the work it describes is done,
+# so a run killed at any point leaves a valid journal behind
+# There are two kinds of entry:
+# - 'model': a MultiNest run of one model (with a given prior, enhancement model and number of live points) on one system has finished
+# - 'system': all models for one system have been run, compared and analysed
+class RunJournal:
+
+    def __init__(self, filename, write_to_file=True):
+        self.filename = filename
+        self.write_to_file = write_to_file  # Under MPI, every rank keeps a journal in memory but only rank 0 writes to the file
+        self.completed_models = dict()
+        self.completed_systems = dict()
+        self.load()
+
+    def __str__(self):
+        return 'RunJournal: ' + str(len(self.completed_models)) + ' completed models, ' + str(len(self.completed_systems)) + ' completed systems (' + self.filename + ')'
+
+    def make_model_key(self, wd_name, model_name, prior_name, enhancement_model, live_points):
+        return (wd_name, model_name, prior_name, enhancement_model, live_points)
+
+    def load(self):
+        if not os.path.isfile(self.filename):
+            return
+        with open(self.filename, encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Most likely the last line, cut off when the run died
+                    print('Warning! Ignoring unreadable line in run journal ' + self.filename + ': ' + line.strip())
+                    continue
+                self.add_entry(entry)
+
+    def add_entry(self, entry):
+        if entry['type'] == 'model':
+            self.completed_models[self.make_model_key(entry['wd_name'], entry['model'], entry['prior'], entry['enhancement_model'], entry['live_points'])] = entry
+        elif entry['type'] == 'system':
+            self.completed_systems[entry['wd_name']] = entry
+        else:
+            raise ValueError('Unrecognised run journal entry type: ' + str(entry['type']))
+
+    def write_entry(self, entry):
+        self.add_entry(entry)
+        if self.write_to_file:
+            with open(self.filename, 'a', encoding='utf-8') as journal_file:
+                journal_file.write(json.dumps(entry) + '\n')
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def record_model(self, N_wd, wd_name, model_name, prior_name, enhancement_model, live_points, chains_prefix):
+        self.write_entry({
+            'type': 'model',
+            'system': N_wd,
+            'wd_name': wd_name,
+            'model': model_name,
+            'prior': prior_name,
+            'enhancement_model': enhancement_model,
+            'live_points': live_points,
+            'chains': chains_prefix
+        })
+
+    def record_system(self, N_wd, wd_name, stats_file):
+        self.write_entry({
+            'type': 'system',
+            'system': N_wd,
+            'wd_name': wd_name,
+            'stats_file': stats_file
+        })
+
+    def get_completed_model(self, wd_name, model_name, prior_name, enhancement_model, live_points):
+        # Returns the journal entry (which includes the location of the chains) or None if this model hasn't been run
+        return self.completed_models.get(self.make_model_key(wd_name, model_name, prior_name, enhancement_model, live_points))
+
+    def is_system_completed(self, wd_name):
+        return wd_name in self.completed_systems
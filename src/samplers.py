@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import json
+import numpy as np
+import os
+
+from scipy.special import gammaln
+
+# pymultinest needs the compiled MultiNest library, and fails on import if it can't find it.
+# That only matters if the MultiNest backend (or MultiNest output) is actually used
+try:
+    import pymultinest as pn
+except (ImportError, OSError, SystemExit):
+    pn = None
+
+# Backends which PollutionModel.execute can use to sample the posterior and calculate the evidence
+# All of them take the same prior/loglike callables that MultiNest does: prior transforms a unit cube (in place) into physical
+# parameter values, and loglike takes those values. loglike_batch (optional) takes an (N, n_dims) array of physical values and
+# returns N log likelihoods, and is used by backends which can evaluate many points at once
+# Each backend's run returns a dict with (at least) logZ, logZerr and samples, as pymultinest.solve does
+
+class MultiNestSampler:
+    # The original backend: a thin wrapper around pymultinest.solve
+
+    def __init__(self):
+        self.name = 'multinest'
+        self.uses_mpi = True  # Under MPI, every rank takes part in the same run
+        self.max_prefix_length = 78  # 100 minus 22 characters that PyMultiNest will add. This limit is hardcoded in MultiNest v3.10
+
+    def run(self, prior, loglike, loglike_batch, n_dims, outputfiles_basename, n_live_points, seed=-1, verbose=True, log_zero=-1e90):
+        if pn is None:
+            raise ImportError('The MultiNest sampler needs pymultinest and the MultiNest library. Try the nested sampler instead')
+        return pn.solve(
+            LogLikelihood=loglike,
+            Prior=prior,
+            n_dims=n_dims,
+            outputfiles_basename=outputfiles_basename,
+            verbose=verbose,
+            n_live_points=n_live_points,
+            seed=seed,
+            #evidence_tolerance = 0.5,
+            #sampling_efficiency = 0.8,
+            #multimodal = False,
+            log_zero=log_zero  # if likelihood < log_zero, point gets ignored (use this for errors)
+        )
+
+# Used by NestedSampler's worker processes: each worker is given the batch likelihood once, then just receives points
+worker_loglike_batch = None
+
+def initialise_worker(loglike_batch):
+    global worker_loglike_batch
+    worker_loglike_batch = loglike_batch
+
+def evaluate_loglike_batch_in_worker(points):
+    return worker_loglike_batch(points)
+
+class NestedSampler:
+    # A pure Python/numpy nested sampler (no compiled dependencies, and no limit on output path length)
+    # New live points are drawn from an enlarged ellipsoid around the current live points (as in single-ellipsoid MultiNest)
+    # Candidates are drawn and evaluated in batches: this is where loglike_batch and (if workers > 1) a process pool get used.
+    # Any candidates left over are kept for later iterations, since a candidate which beats the current likelihood threshold
+    # is a valid draw from the constrained prior for as long as the bounds it was drawn from still enclose the constrained region
+    # Output is written in the same layout as MultiNest's .txt and post_equal_weights.dat files, plus a stats file which
+    # NestedSamplerAnalyzer reads in place of MultiNest's stats.dat
+
+    stats_suffix = 'nested_stats.json'
+
+    def __init__(self, batch_size=100, workers=1, enlargement=1.5, update_interval=None, evidence_tolerance=0.5, max_iterations=None, resume=True):
+        self.name = 'nested'
+        self.uses_mpi = False  # Every MPI rank would run (and write) its own copy, so this can't be run under MPI
+        self.max_prefix_length = None
+        self.batch_size = batch_size
+        self.workers = workers
+        self.enlargement = enlargement  # Volume enlargement factor of the bounding ellipsoid
+        self.update_interval = update_interval  # Iterations between bound updates. Default is a tenth of the number of live points
+        self.evidence_tolerance = evidence_tolerance  # Stop when the live points could only add this much more to ln(Z) (as MultiNest)
+        self.max_iterations = max_iterations
+        self.resume = resume  # If True, and output from a previous run is found, load that instead of sampling again (as MultiNest)
+        self.likelihood_calls = 0
+
+    def transform(self, prior, unit_points):
+        return np.array([prior(point.copy()) for point in unit_points], dtype=float).reshape(unit_points.shape)
+
+    def evaluate(self, loglike, loglike_batch, points, executor, log_zero):
+        self.likelihood_calls += len(points)
+        if len(points) == 0:
+            return np.empty(0)
+        if loglike_batch is None:
+            loglikes = np.array([loglike(point) for point in points], dtype=float)
+        elif executor is None:
+            loglikes = np.asarray(loglike_batch(points), dtype=float)
+        else:
+            chunks = np.array_split(points, min(self.workers, len(points)))
+            loglikes = np.concatenate([np.asarray(result, dtype=float) for result in executor.map(evaluate_loglike_batch_in_worker, chunks)])
+        # A NaN would never be replaced (nothing compares greater than it), so treat it like any other failed point
+        return np.where(np.isnan(loglikes), 1.1*log_zero, loglikes)
+
+    def get_bound(self, live_unit_points):
+        # Returns (centre, transform, log_volume) for the ellipsoid enclosing all the live points, enlarged by self.enlargement
+        n_dims = live_unit_points.shape[1]
+        centre = np.mean(live_unit_points, axis=0)
+        covariance = np.atleast_2d(np.cov(live_unit_points, rowvar=False)) + 1e-12*np.eye(n_dims)
+        offsets = live_unit_points - centre
+        max_distance_sq = np.max(np.einsum('ij,jk,ik->i', offsets, np.linalg.inv(covariance), offsets))
+        covariance *= max_distance_sq*(self.enlargement**(2/n_dims))
+        log_volume = 0.5*n_dims*np.log(np.pi) - gammaln(0.5*n_dims + 1) + 0.5*np.linalg.slogdet(covariance)[1]
+        return centre, np.linalg.cholesky(covariance), log_volume
+
+    def sample_bound(self, rng, bound, n_points, n_dims):
+        centre, transform, log_volume = bound
+        if log_volume >= 0:
+            # The ellipsoid is bigger than the unit cube, so we may as well sample the whole cube
+            return rng.random((n_points, n_dims))
+        directions = rng.standard_normal((n_points, n_dims))
+        directions /= np.linalg.norm(directions, axis=1)[:, None]
+        radii = rng.random(n_points)**(1/n_dims)
+        unit_points = centre + (directions*radii[:, None]) @ transform.T
+        return unit_points[np.all((unit_points > 0) & (unit_points < 1), axis=1)]
+
+    def get_executor(self, loglike_batch):
+        if self.workers <= 1 or loglike_batch is None:
+            return None
+        return concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=initialise_worker, initargs=(loglike_batch,))
+
+    def run(self, prior, loglike, loglike_batch, n_dims, outputfiles_basename, n_live_points, seed=-1, verbose=True, log_zero=-1e90):
+        # Points below log_zero need no special treatment here: they are the first to be replaced, and their weight underflows to 0
+        if self.resume and os.path.isfile(outputfiles_basename + self.stats_suffix):
+            print('Found output from a previous run of ' + outputfiles_basename + ': loading it instead of sampling')
+            analyzer = NestedSamplerAnalyzer(n_dims, outputfiles_basename)
+            stats = analyzer.get_stats()
+            return {'logZ': stats['global evidence'], 'logZerr': stats['global evidence error'], 'samples': analyzer.get_equal_weighted_posterior()[:, 0:n_dims]}
+        rng = np.random.default_rng(None if seed < 0 else seed)
+        update_interval = self.update_interval if self.update_interval is not None else max(1, n_live_points//10)
+        self.likelihood_calls = 0
+        executor = self.get_executor(loglike_batch)
+        try:
+            live_unit_points = rng.random((n_live_points, n_dims))
+            live_points = self.transform(prior, live_unit_points)
+            live_loglikes = self.evaluate(loglike, loglike_batch, live_points, executor, log_zero)
+            dead_points = list()
+            dead_loglikes = list()
+            dead_logweights = list()
+            log_Z = -np.inf
+            information = 0
+            log_X = 0  # Log of the prior volume remaining
+            log_width_factor = np.log(1 - np.exp(-1/n_live_points))
+            bound = self.get_bound(live_unit_points)
+            queued_unit_points = np.empty((0, n_dims))
+            queued_points = np.empty((0, n_dims))
+            queued_loglikes = np.empty(0)
+            iteration = 0
+            while True:
+                worst = np.argmin(live_loglikes)
+                threshold = live_loglikes[worst]
+                log_weight = log_X + log_width_factor + threshold
+                new_log_Z = np.logaddexp(log_Z, log_weight)
+                if np.isfinite(log_Z):
+                    information = np.exp(log_weight - new_log_Z)*threshold + np.exp(log_Z - new_log_Z)*(information + log_Z) - new_log_Z
+                else:
+                    information = threshold - new_log_Z
+                log_Z = new_log_Z
+                dead_points.append(live_points[worst].copy())
+                dead_loglikes.append(threshold)
+                dead_logweights.append(log_weight)
+                log_X -= 1/n_live_points
+                iteration += 1
+                remaining_log_Z = np.max(live_loglikes) + log_X
+                if np.logaddexp(log_Z, remaining_log_Z) - log_Z < self.evidence_tolerance or (self.max_iterations is not None and iteration >= self.max_iterations):
+                    break
+                # Replace the worst point with the first queued candidate that beats it, drawing more candidates if necessary
+                while True:
+                    better = np.nonzero(queued_loglikes > threshold)[0]
+                    if len(better) > 0:
+                        break
+                    queued_unit_points = self.sample_bound(rng, bound, self.batch_size, n_dims)
+                    queued_points = self.transform(prior, queued_unit_points)
+                    queued_loglikes = self.evaluate(loglike, loglike_batch, queued_points, executor, log_zero)
+                replacement = better[0]
+                live_unit_points[worst] = queued_unit_points[replacement]
+                live_points[worst] = queued_points[replacement]
+                live_loglikes[worst] = queued_loglikes[replacement]
+                queued_unit_points = queued_unit_points[better[1:]]
+                queued_points = queued_points[better[1:]]
+                queued_loglikes = queued_loglikes[better[1:]]
+                if iteration % update_interval == 0:
+                    bound = self.get_bound(live_unit_points)
+                if verbose and iteration % (10*n_live_points) == 0:
+                    print('Nested sampler iteration ' + str(iteration) + ': ln(Z) = ' + str(round(log_Z, 3)) + ', ' + str(self.likelihood_calls) + ' likelihood calls')
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        # The remaining live points share out what's left of the prior volume
+        for point, point_loglike in zip(live_points, live_loglikes):
+            log_weight = log_X - np.log(n_live_points) + point_loglike
+            log_Z = np.logaddexp(log_Z, log_weight)
+            dead_points.append(point)
+            dead_loglikes.append(point_loglike)
+            dead_logweights.append(log_weight)
+        log_Z_error = np.sqrt(max(information, 0)/n_live_points)
+        samples = self.write_output(outputfiles_basename, np.array(dead_points), np.array(dead_loglikes), np.array(dead_logweights) - log_Z, log_Z, log_Z_error, rng, iteration)
+        if verbose:
+            print('Nested sampler finished after ' + str(iteration) + ' iterations and ' + str(self.likelihood_calls) + ' likelihood calls')
+        return {'logZ': log_Z, 'logZerr': log_Z_error, 'samples': samples}
+
+    def write_output(self, outputfiles_basename, points, loglikes, log_weights, log_Z, log_Z_error, rng, iterations):
+        weights = np.exp(log_weights)
+        weights /= np.sum(weights)
+        np.savetxt(outputfiles_basename + '.txt', np.column_stack((weights, -2*loglikes, points)))
+        # Equally weighted posterior samples: as many as the effective sample size, drawn by systematic resampling
+        n_samples = max(1, int(1/np.sum(weights**2)))
+        positions = (rng.random() + np.arange(n_samples))/n_samples
+        indices = np.minimum(np.searchsorted(np.cumsum(weights), positions), len(weights) - 1)
+        np.savetxt(outputfiles_basename + 'post_equal_weights.dat', np.column_stack((points[indices], loglikes[indices])))
+        with open(outputfiles_basename + self.stats_suffix, 'w') as f:
+            json.dump({
+                'log_Z': log_Z,
+                'log_Z_error': log_Z_error,
+                'iterations': iterations,
+                'likelihood_calls': self.likelihood_calls
+            }, f, indent=2)
+        return points[indices]
+
+class NestedSamplerAnalyzer:
+    # Reads NestedSampler output, with the parts of the pymultinest.Analyzer interface that ModelAnalyser uses
+
+    def __init__(self, n_params, outputfiles_basename):
+        self.n_params = n_params
+        self.outputfiles_basename = outputfiles_basename
+        self.data = np.loadtxt(outputfiles_basename + '.txt', ndmin=2)
+        with open(outputfiles_basename + NestedSampler.stats_suffix) as f:
+            self.stats = json.load(f)
+
+    def get_data(self):
+        return self.data
+
+    def get_equal_weighted_posterior(self):
+        return np.loadtxt(self.outputfiles_basename + 'post_equal_weights.dat', ndmin=2)
+
+    def get_best_fit(self):
+        best = np.argmin(self.data[:, 1])
+        return {'log_likelihood': -0.5*self.data[best, 1], 'parameters': list(self.data[best, 2:])}
+
+    def get_stats(self):
+        marginals = list()
+        for samples in self.get_equal_weighted_posterior()[:, 0:self.n_params].T:
+            percentiles = np.percentile(samples, [0.135, 2.275, 15.865, 50, 84.135, 97.725, 99.865])
+            marginals.append({
+                'median': percentiles[3],
+                'sigma': 0.5*(percentiles[4] - percentiles[2]),
+                '1sigma': (percentiles[2], percentiles[4]),
+                '2sigma': (percentiles[1], percentiles[5]),
+                '3sigma': (percentiles[0], percentiles[6])
+            })
+        return {
+            'global evidence': self.stats['log_Z'],
+            'global evidence error': self.stats['log_Z_error'],
+            'nested sampling global log-evidence': self.stats['log_Z'],
+            'nested sampling global log-evidence error': self.stats['log_Z_error'],
+            'marginals': marginals
+        }
+
+def get_analyzer(n_params, outputfiles_basename):
+    # Read whichever kind of output is at outputfiles_basename
+    if os.path.isfile(outputfiles_basename + NestedSampler.stats_suffix):
+        return NestedSamplerAnalyzer(n_params, outputfiles_basename)
+    if pn is None:
+        raise ImportError('Reading MultiNest output from ' + outputfiles_basename + ' needs pymultinest')
+    return pn.Analyzer(n_params=n_params, outputfiles_basename=outputfiles_basename)
+
+known_samplers = {
+    'multinest': MultiNestSampler,
+    'nested': NestedSampler
+}
+
+def get_sampler(sampler_name, workers=1):
+    try:
+        sampler = known_samplers[sampler_name]()
+    except KeyError:
+        raise ValueError('Unknown sampler: ' + str(sampler_name) + '. Known samplers: ' + ', '.join(known_samplers.keys()))
+    if workers > 1:
+        if sampler_name == 'multinest':
+            print('Warning! MultiNest runs in parallel using MPI, not worker processes. Ignoring sampler workers')
+        else:
+            sampler.workers = workers
+    return sampler
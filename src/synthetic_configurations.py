@@ -7,6 +7,7 @@ import csv
 import geology_info as gi
 import model_parameters as mp
 import numpy as np
+import pwd_utils as pu
 
 class Distribution(Enum):
     Uniform = 0
@@ -27,7 +28,7 @@ def load_marc_distributions():
     geology_model = gi.GeologyModel()
     file_names = ['combined', 'Mdot_7', 'Mdot_8', 'Mdot_10']
     for file_name in file_names:
-        data = np.load('../data/' + file_name + '.npz', allow_pickle=True)
+        data = np.load(pu.get_path_to_data() + file_name + '.npz', allow_pickle=True)
         CMF = data['bins_CMF'] # core mass fraction
         N_CMF = data['N_CMF'] # weight of this core mass fraction
         bins = np.linspace(0, 0.5, 40)
@@ -51,7 +52,7 @@ def load_tidal_distributions():
     coarse_bins = np.linspace(0, 1, 40)  # For plotting purposes only (the bug above isn't relevant here)
     for file_name in file_names:
         cnfs = list()
-        with open('../data/' + file_name + '.csv', encoding='utf-8') as cmf_csv:
+        with open(pu.get_path_to_data() + file_name + '.csv', encoding='utf-8') as cmf_csv:
             for row in csv.reader(cmf_csv):
                 cnf = geology_model.convert_core_mass_fraction_to_core_number_fraction(float(row[0]))
                 cnfs.append(cnf)
@@ -70,7 +71,7 @@ def load_amy_distributions():
     coarse_bins = np.linspace(0, 1, 40)
     for file_name in amy_filenames:
         cnfs = list()
-        with open('../data/' + file_name + '.dat', encoding='utf-8') as config_csv:
+        with open(pu.get_path_to_data() + file_name + '.dat', encoding='utf-8') as config_csv:
             for row in csv.reader(config_csv, delimiter=' '):
                 mass = float(row[0])
                 if mass < mass_cutoff:
@@ -100,7 +101,7 @@ def load_mwdd_distributions():
         loggs = list()
         teff_dist_name = 'MWDD_' + stellar_suffix + '_Teffs_40pc'
         logg_dist_name = 'MWDD_' + stellar_suffix + '_Loggs_40pc'
-        with open('../data/' + DA_DB_40pc_base_filename + stellar_suffix + 's.csv', encoding='utf-8') as config_csv:
+        with open(pu.get_path_to_data() + DA_DB_40pc_base_filename + stellar_suffix + 's.csv', encoding='utf-8') as config_csv:
             for row in csv.reader(config_csv, delimiter=','):
                 try:
                     teff = float(row[5])
@@ -129,7 +130,7 @@ def load_hollands_distributions():
     file_name = 'WDInputData'
     min_row = 1
     max_row = 201
-    with open('../data/' + file_name + '.csv', encoding='utf-8') as config_csv:
+    with open(pu.get_path_to_data() + file_name + '.csv', encoding='utf-8') as config_csv:
         row_count = 0
         for row in csv.reader(config_csv, delimiter=','):
             if min_row <= row_count <= max_row:
@@ -506,16 +506,18 @@ class SyntheticPopulation:
     def check_sinking_timescales(self, reference_timescale=1E5):
         total_count = 0
         long_timescale_count = 0
-        for system in self.population:
-            wd_timescales = self.timescale_interpolator.get_wd_timescales(
-                str(self.spectral_type_dict[system.wd_properties[mp.WDParameter.spectral_type]]),
-                system.wd_properties[mp.WDParameter.logg],
-                system.wd_properties[mp.WDParameter.temperature],
-                system.pollution_abundances[ci.Element.Ca]
+        mg_index = ci.usual_elements.index(ci.Element.Mg)
+        # Interpolating all systems of each spectral type at once
+        for spectral_type in set(system.wd_properties[mp.WDParameter.spectral_type] for system in self.population):
+            systems = [system for system in self.population if system.wd_properties[mp.WDParameter.spectral_type] == spectral_type]
+            wd_timescales = self.timescale_interpolator.get_wd_timescales_batch(
+                str(self.spectral_type_dict[spectral_type]),
+                [system.wd_properties[mp.WDParameter.logg] for system in systems],
+                [system.wd_properties[mp.WDParameter.temperature] for system in systems],
+                [system.pollution_abundances[ci.Element.Ca] for system in systems]
             )
-            if wd_timescales[ci.Element.Mg] > reference_timescale:
-                long_timescale_count += 1
-            total_count += 1
+            long_timescale_count += np.count_nonzero(wd_timescales[:, mg_index] > reference_timescale)
+            total_count += len(systems)
         print(str(long_timescale_count) + '/' + str(total_count) + ' systems exceeded t_Mg = ' + str(reference_timescale))
 
     def create_population(self, population_size, reset_population=True):
@@ -3,14 +3,28 @@
 
 import collections
 import csv
+import hashlib
 import numpy as np
+import os
 import scipy.interpolate as si
+import tempfile
+import time
 
 import chemistry_info as ci
+import pwd_utils as pu
+
+# Parsing the timescale files dominates the time taken to set up a TimescaleInterpolator, so the parsed grids are saved
+# (as .npz files in the cache directory) and reused. Each cache file is named after a hash of the files it was made from,
+# so editing a timescale file (or the file list) just means a new cache file gets made
+# Bump this if the layout of the cache files changes, so that old ones are ignored
+grid_cache_version = 1
+# Grids which have already been loaded by this process, by cache key. These are shared between TimescaleInterpolators, so are read-only
+_loaded_grids = dict()
 
 class TimescaleInterpolator():
 
-    def __init__(self):
+    # data_dir and cache_dir default to pu.get_path_to_data() and pu.get_path_to_cache() (which can be set by environment variables)
+    def __init__(self, data_dir=None, cache_dir=None):
         use_overshoot = True
         if use_overshoot:
             self.file_dict = {
@@ -42,10 +56,27 @@ class TimescaleInterpolator():
                     8.5: 'timescales_He_g850_ov0.csv'
                 }
             }
-        self.timescale_data = self.load_data()
+        self.data_dir = pu.get_path_to_data() if data_dir is None else data_dir
+        self.cache_dir = pu.get_path_to_cache() if cache_dir is None else cache_dir
+        self._timescale_data = None
         self.wd_data = None
         self.expected_vals = {'H': dict(), 'He': dict()}
+        self.load_times = collections.OrderedDict()  # Stage -> time taken (s), for get_load_report
+        start_time = time.perf_counter()
+        self.grid_source = None  # Where the grids came from: 'memory' (an earlier TimescaleInterpolator), 'cache' or 'files'
+        self.grids = self.load_grids()
+        self.load_times['Grids (from ' + self.grid_source + ')'] = time.perf_counter() - start_time
+        start_time = time.perf_counter()
         self.set_up_interpolators()
+        self.load_times['Interpolators'] = time.perf_counter() - start_time
+
+    @property
+    def timescale_data(self):
+        # The parsed timescale files. Structure: data[HorHe][g][Teff][CaHe] = {'logq': <q>, Element.Li: <t_Li>, ... Element.Zn: <t_Zn> }
+        # The interpolators only need the grids, so (if they came from the cache) the files are only parsed if this is asked for
+        if self._timescale_data is None:
+            self._timescale_data = self.load_data()
+        return self._timescale_data
 
     @staticmethod
     def perform_format(input_file_name, output_file_name):
@@ -129,11 +160,13 @@ class TimescaleInterpolator():
                 return None
         return vals
 
-    def set_up_interpolators(self):
+    def compile_grids(self):
+        # Converts self.timescale_data into arrays. For each HorHe, the grid is (axes, columns, values), where axes are the sorted values
+        # of log(g), Teff and (if present) CaHe, columns are 'logq' then each element, and values[i, j, (k,) column] is the entry
         # This assumes that self.timescale_data has no missing keys anywhere or anything like that
-        self.interpolators = dict()
+        self.expected_vals = {HorHe: dict() for HorHe in self.file_dict.keys()}  # get_values_for_variable fills these in
+        grids = dict()
         for HorHe in self.timescale_data.keys():
-            self.interpolators[HorHe] = dict()
             # You have to call them in this order!
             g_vals = self.get_values_for_variable(HorHe, 'g')
             if g_vals is None:
@@ -142,24 +175,152 @@ class TimescaleInterpolator():
             if t_vals is None:
                 continue  # This needs to be present
             c_vals = self.get_values_for_variable(HorHe, 'c')
-            if c_vals is None:
-                # Then CaHe was not a variable. Set up a 2D interpolator
-                for element in self.timescale_data[HorHe][self.get_arbitrary_val(HorHe, 'g')][self.get_arbitrary_val(HorHe, 't')].keys():
-                    grid_vals = np.zeros((len(g_vals), len(t_vals)))
-                    for i in range(len(g_vals)):
-                        for j in range(len(t_vals)):
-                            grid_vals[i,j] = self.timescale_data[HorHe][g_vals[i]][t_vals[j]][element]
-                    # 'linear', False, None means linear interpolation, no error if we go out of bounds, extrapolate in that case
-                    self.interpolators[HorHe][element] = si.RegularGridInterpolator((g_vals, t_vals), grid_vals, 'linear', False, None)
-            else:
-                for element in self.timescale_data[HorHe][self.get_arbitrary_val(HorHe, 'g')][self.get_arbitrary_val(HorHe, 't')][self.get_arbitrary_val(HorHe, 'c')].keys():
-                    grid_vals = np.zeros((len(g_vals), len(t_vals), len(c_vals)))
-                    for i in range(len(g_vals)):
-                        for j in range(len(t_vals)):
-                            for k in range(len(c_vals)):
-                                grid_vals[i,j,k] = self.timescale_data[HorHe][g_vals[i]][t_vals[j]][c_vals[k]][element]
-                    # 'linear', False, None means linear interpolation, no error if we go out of bounds, extrapolate in that case
-                    self.interpolators[HorHe][element] = si.RegularGridInterpolator((g_vals, t_vals, c_vals), grid_vals, 'linear', False, None)
+            try:
+                grids[HorHe] = self.compile_grid(HorHe, g_vals, t_vals, c_vals)
+            except KeyError as e:
+                print('Warning! Timescale grid for ' + HorHe + ' is incomplete (missing ' + str(e) + '), so ' + HorHe + ' timescales will not be available')
+        return grids
+
+    def compile_grid(self, HorHe, g_vals, t_vals, c_vals):
+        if c_vals is None:
+            # Then CaHe was not a variable: the grid is 2D
+            axes = (g_vals, t_vals)
+            columns = list(self.timescale_data[HorHe][self.get_arbitrary_val(HorHe, 'g')][self.get_arbitrary_val(HorHe, 't')].keys())
+            values = np.zeros((len(g_vals), len(t_vals), len(columns)))
+            for i in range(len(g_vals)):
+                for j in range(len(t_vals)):
+                    values[i,j] = [self.timescale_data[HorHe][g_vals[i]][t_vals[j]][column] for column in columns]
+        else:
+            axes = (g_vals, t_vals, c_vals)
+            columns = list(self.timescale_data[HorHe][self.get_arbitrary_val(HorHe, 'g')][self.get_arbitrary_val(HorHe, 't')][self.get_arbitrary_val(HorHe, 'c')].keys())
+            values = np.zeros((len(g_vals), len(t_vals), len(c_vals), len(columns)))
+            for i in range(len(g_vals)):
+                for j in range(len(t_vals)):
+                    for k in range(len(c_vals)):
+                        values[i,j,k] = [self.timescale_data[HorHe][g_vals[i]][t_vals[j]][c_vals[k]][column] for column in columns]
+        return axes, columns, values
+
+    def get_grid_cache_key(self):
+        # A hash of the timescale files (and which log(g) each one is for). Returns None if any of them can't be read
+        hasher = hashlib.sha256(('version ' + str(grid_cache_version)).encode())
+        try:
+            for HorHe, HorHe_files in self.file_dict.items():
+                for g, input_file in HorHe_files.items():
+                    hasher.update((HorHe + ' ' + str(g) + ' ' + input_file).encode())
+                    with open(self.data_dir + input_file, 'rb') as f:
+                        hasher.update(f.read())
+        except OSError:
+            return None
+        return hasher.hexdigest()[:16]
+
+    def get_grid_cache_file(self, cache_key):
+        return self.cache_dir + 'timescales_' + cache_key + '.npz'
+
+    def load_grids(self):
+        cache_key = self.get_grid_cache_key()
+        if cache_key is None:
+            # Let load_data report the problem
+            self.grid_source = 'files'
+            return self.compile_grids()
+        grids = _loaded_grids.get(cache_key)
+        self.grid_source = 'memory'
+        if grids is None:
+            grids = self.read_grid_cache(self.get_grid_cache_file(cache_key))
+            self.grid_source = 'cache'
+        if grids is None:
+            grids = self.compile_grids()
+            self.grid_source = 'files'
+            self.write_grid_cache(self.get_grid_cache_file(cache_key), grids)
+        for axes, columns, values in grids.values():
+            for array in axes + (values,):
+                array.flags.writeable = False
+        _loaded_grids[cache_key] = grids
+        return grids
+
+    def read_grid_cache(self, cache_file):
+        # Returns None if there is no (usable) cache file
+        if not os.path.isfile(cache_file):
+            return None
+        grids = dict()
+        try:
+            with np.load(cache_file) as cache:
+                for HorHe in self.file_dict.keys():
+                    if HorHe + '_values' not in cache:
+                        continue
+                    values = cache[HorHe + '_values']
+                    axes = tuple(cache[HorHe + '_axis' + str(i)] for i in range(values.ndim - 1))
+                    columns = ['logq' if column == 0 else ci.Element(column) for column in cache[HorHe + '_columns'].tolist()]
+                    grids[HorHe] = (axes, columns, values)
+        except (OSError, KeyError, ValueError) as e:
+            print('Warning! Could not read timescale cache ' + cache_file + ' (' + str(e) + '), parsing the timescale files instead')
+            return None
+        return grids
+
+    def write_grid_cache(self, cache_file, grids):
+        arrays = dict()
+        for HorHe, (axes, columns, values) in grids.items():
+            for i, axis in enumerate(axes):
+                arrays[HorHe + '_axis' + str(i)] = axis
+            arrays[HorHe + '_columns'] = np.array([0 if column == 'logq' else column.value for column in columns], dtype=int)  # 0 means logq
+            arrays[HorHe + '_values'] = values
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first, so that another process can never read a half-written cache file
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix='.npz', delete=False) as f:
+                np.savez(f, **arrays)
+            os.chmod(f.name, 0o644)  # Temporary files are only readable by their owner
+            os.replace(f.name, cache_file)
+        except OSError as e:
+            print('Warning! Could not write timescale cache ' + cache_file + ' (' + str(e) + ')')
+
+    def set_up_interpolators(self):
+        # As well as one interpolator per column (logq, then each element), there's one stacked interpolator per HorHe which does
+        # every column at once: self.stacked_columns[HorHe] says which column of its output is which
+        self.interpolators = dict()
+        self.stacked_interpolators = dict()
+        self.stacked_columns = dict()
+        self.grid_indices = dict()  # For each HorHe, one dict per axis of value -> index, to find out whether a point is on the grid
+        for HorHe in self.file_dict.keys():
+            self.interpolators[HorHe] = dict()
+            if HorHe not in self.grids:
+                continue
+            axes, columns, values = self.grids[HorHe]
+            self.expected_vals[HorHe] = dict(zip(['g', 't', 'c'], axes))
+            self.grid_indices[HorHe] = [{value: i for i, value in enumerate(axis.tolist())} for axis in axes]
+            # 'linear', False, None means linear interpolation, no error if we go out of bounds, extrapolate in that case
+            for column_index, column in enumerate(columns):
+                self.interpolators[HorHe][column] = si.RegularGridInterpolator(axes, values[..., column_index], 'linear', False, None)
+            self.stacked_interpolators[HorHe] = si.RegularGridInterpolator(axes, values, 'linear', False, None)
+            self.stacked_columns[HorHe] = columns
+
+    def validate_grids(self):
+        # Returns a list of problems with the timescale grids (empty if there are none), so that bad or missing data can be
+        # caught at startup rather than showing up as NaN/None timescales partway through a run
+        problems = list()
+        for HorHe, HorHe_files in self.file_dict.items():
+            for g, input_file in HorHe_files.items():
+                if not os.path.isfile(self.data_dir + input_file):
+                    problems.append('Missing timescale file for ' + HorHe + ' log(g) = ' + str(g) + ': ' + self.data_dir + input_file)
+            if HorHe not in self.grids:
+                problems.append('No timescale grid for ' + HorHe)
+                continue
+            axes, columns, values = self.grids[HorHe]
+            if sorted(HorHe_files.keys()) != axes[0].tolist():
+                problems.append('Timescale grid for ' + HorHe + ' has log(g) values ' + str(axes[0].tolist()) + ', expected ' + str(sorted(HorHe_files.keys())))
+            if not np.all(np.isfinite(values)):
+                problems.append('Timescale grid for ' + HorHe + ' has ' + str(np.sum(~np.isfinite(values))) + ' non-finite value(s)')
+        return problems
+
+    def check_grids(self):
+        # Prints the load report, and raises an error if validate_grids finds anything
+        print(self.get_load_report())
+        problems = self.validate_grids()
+        if len(problems) > 0:
+            raise ValueError('Timescale grids in ' + self.data_dir + ' failed validation:\n' + '\n'.join(problems))
+        print('Timescale grids OK')
+
+    def get_load_report(self):
+        return 'Timescale data from ' + self.data_dir + ' (cache: ' + self.cache_dir + '): ' + ', '.join([stage + ' ' + str(round(1000*load_time, 1)) + ' ms' for stage, load_time in self.load_times.items()])
 
     def load_data(self):
         toret = dict()
@@ -171,7 +332,7 @@ class TimescaleInterpolator():
                 current_Teff = None
                 current_CaHe_vals = None
                 try:
-                    with open('../data/' + input_file) as csvfile:
+                    with open(self.data_dir + input_file) as csvfile:
                         read = csv.reader(csvfile, delimiter=',')
                         if HorHe == 'H':
                             i = 0
@@ -212,12 +373,12 @@ class TimescaleInterpolator():
                         else:
                             print('Unrecognised HorHe value: ' + str(HorHe) + ', could not read input')
                 except (TypeError, FileNotFoundError):
-                    print('Warning! Could not open an input file')
+                    print('Warning! Could not open timescale file ' + self.data_dir + str(input_file) + ' (set ' + pu.data_dir_environment_variable + ' if the data is somewhere else)')
         return toret
 
     def load_wd_data(self, wd_data_file='WDInputData.csv'):
         toret = collections.OrderedDict()
-        with open('../data/' + wd_data_file) as csvfile:
+        with open(self.data_dir + wd_data_file) as csvfile:
             read = csv.reader(csvfile, delimiter=',')
             i = 0
             for row in read:
@@ -261,36 +422,26 @@ class TimescaleInterpolator():
             # This only applies to He though because H doesn't include CaHe as a dimension
             print('This is a He WD but no Ca is present. Therefore interpolation is not possible. Returning None')
             return None
-        try:
-            if HorHe == 'He':
-                return self.timescale_data[HorHe][logg][Teff][CaHe]
-            elif HorHe == 'H':
-                return self.timescale_data[HorHe][logg][Teff]
-            else:
-                print('Unrecognised HorHe value: ' + str(HorHe) + ', could not find timescales')
-                return None
-        except KeyError:
-            pass
-        # Need to interpolate!
-        # Firstly, check we actually have an appropriate interpolator!
-        if HorHe not in self.interpolators.keys() or self.interpolators[HorHe] == dict():
-            print('Warning! Could not interpolate. Did not find an interpolator for ' + str(HorHe))
-            return None
-        toret = dict()
         if HorHe == 'H':
-            for element in self.timescale_data[HorHe][self.get_arbitrary_val(HorHe, 'g')][self.get_arbitrary_val(HorHe, 't')].keys():
-                interpolator = self.interpolators[HorHe][element]
-                point_to_sample = np.array([[logg, Teff]])
-                toret[element] = interpolator(point_to_sample)[0]  # The float value is wrapped in a numpy array so indexing [0] extracts what we actually want
+            point_to_sample = (logg, Teff)
         elif HorHe == 'He':
-            for element in self.timescale_data[HorHe][self.get_arbitrary_val(HorHe, 'g')][self.get_arbitrary_val(HorHe, 't')][self.get_arbitrary_val(HorHe, 'c')].keys():
-                interpolator = self.interpolators[HorHe][element]
-                point_to_sample = np.array([[logg, Teff, CaHe]])
-                toret[element] = interpolator(point_to_sample)[0]  # The float value is wrapped in a numpy array so indexing [0] extracts what we actually want
+            point_to_sample = (logg, Teff, CaHe)
         else:
             print('Unrecognised HorHe value: ' + str(HorHe) + ', could not find timescales')
             return None
-        return toret
+        # Check we actually have an appropriate interpolator!
+        if HorHe not in self.stacked_interpolators:
+            print('Warning! Could not interpolate. Did not find an interpolator for ' + str(HorHe))
+            return None
+        try:
+            grid_position = tuple(axis_indices[value] for axis_indices, value in zip(self.grid_indices[HorHe], point_to_sample))
+            # The point is on the grid, so there's no need to interpolate
+            return dict(zip(self.stacked_columns[HorHe], self.grids[HorHe][2][grid_position].tolist()))
+        except KeyError:
+            pass
+        # Need to interpolate!
+        interpolated_values = self.stacked_interpolators[HorHe](np.array([point_to_sample]))[0]  # Returns one row per point. We only have 1 point
+        return dict(zip(self.stacked_columns[HorHe], interpolated_values))
 
     def get_wd_timescales(self, HorHe, logg, Teff, CaHe=None, all_timescales=False): # TODO: could HorHe be a ci.Element rather than a str?
         timescales = self.extract_timescales(HorHe, logg, Teff, CaHe)
@@ -298,6 +449,33 @@ class TimescaleInterpolator():
             return None
         return self.return_wd_timescales_as_dict(timescales, all_timescales)
 
+    def get_wd_timescales_batch(self, HorHe, logg, Teff, CaHe=None, elements=ci.usual_elements):
+        # Equivalent to calling get_wd_timescales for each of N white dwarfs of the same type, all with one interpolation
+        # logg, Teff and CaHe can be arrays (one entry per white dwarf) or scalars. Returns an (N, len(elements)) array of timescales,
+        # with 0 for elements that aren't in the tables (as in get_wd_timescales)
+        # He white dwarfs with no Ca (CaHe None or 0) have no timescales (get_wd_timescales returns None): their rows are NaN
+        if HorHe not in self.stacked_interpolators:
+            print('Warning! Could not interpolate. Did not find an interpolator for ' + str(HorHe))
+            return None
+        if HorHe == 'He':
+            CaHe = np.array([np.nan if value is None else value for value in np.ravel(np.asarray(CaHe, dtype=object))], dtype=float)
+            CaHe[CaHe == 0] = np.nan
+            points_to_sample = np.column_stack(np.broadcast_arrays(logg, Teff, CaHe))
+        else:
+            points_to_sample = np.column_stack(np.broadcast_arrays(logg, Teff))
+        points_to_sample = points_to_sample.astype(float)
+        columns = self.stacked_columns[HorHe]
+        column_indices = [columns.index(element) if element in columns else -1 for element in elements]
+        toret = np.zeros((len(points_to_sample), len(elements)))
+        has_timescales = ~np.any(np.isnan(points_to_sample), axis=1)
+        if np.any(has_timescales):
+            interpolated_values = self.stacked_interpolators[HorHe](points_to_sample[has_timescales])
+            for i, column_index in enumerate(column_indices):
+                if column_index >= 0:
+                    toret[has_timescales, i] = 10**interpolated_values[:, column_index]
+        toret[~has_timescales] = np.nan
+        return toret
+
     def return_wd_timescales_as_dict(self, wd_entry, all_timescales=False):
         toret = dict()
         toret['logq'] = wd_entry['logq']
@@ -341,6 +519,7 @@ class TimescaleInterpolator():
 
 def main():
     timescale_interpolator = TimescaleInterpolator()
+    timescale_interpolator.check_grids()
     HorHe = 'He'
     logg = 7.99
     Teff = 6115
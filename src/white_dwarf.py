@@ -3,6 +3,7 @@
 
 from copy import deepcopy
 from enum import Enum
+import collections
 
 import numpy as np
 
@@ -365,6 +366,16 @@ class WhiteDwarfPropertyData():
     def __neq__(self, other):
         return not self == other
 
+# Everything log_likelihood needs to know about the measurements, in the order of the model output
+LikelihoodArrays = collections.namedtuple('LikelihoodArrays', [
+    'measurement_indices',  # Positions of the (included) measured elements
+    'measurement_values',
+    'inverse_variances',  # 1/error**2 for each measurement
+    'normalisation',  # The part of the log likelihood which doesn't depend on the model
+    'upper_bounds',  # One per element: inf unless there is an (included) upper bound
+    'lower_bounds'  # One per element: -inf unless there is an (included) lower bound
+])
+
 class WhiteDwarf():
 
     def __init__(self, name, properties, abundances):
@@ -384,6 +395,8 @@ class WhiteDwarf():
                 raise ValueError('Must supply an atmospheric type if supplying abundances') # otherwise the abundances mean nothing
         self.abundances.abundance_data_dict[self.properties.get_property_data(mp.WDParameter.atmospheric_type).value] = WhiteDwarfDataPoint(WhiteDwarfDataPointType.measurement, 0, 0, False)
         self.timescale_dict = dict()
+        self.likelihood_elements = None  # The elements which likelihood_arrays was made for
+        self.likelihood_arrays = None
 
     def get_plottable_points(self, elements_to_plot, reference_element=None, included=True, scale_to_solar=False): # Switch included to False to get the excluded points
         if reference_element is None:
@@ -445,32 +458,68 @@ class WhiteDwarf():
         return np.array(errors_to_use)
 
     def log_likelihood(self, model_result, min_likelihood):
-        data_abundances_to_use = list()
-        model_abundances_to_use = list()
-        errors_to_use = list()
+        # model_result is a dict of element -> model abundance
+        likelihood_arrays = self.get_likelihood_arrays(model_result.keys())
+        model_values = np.fromiter(model_result.values(), dtype=float, count=len(model_result))
         # First check if we violate any bounds:
-        for el, el_result in model_result.items():
+        if (model_values > likelihood_arrays.upper_bounds).any() or (model_values < likelihood_arrays.lower_bounds).any():
+            return 0.9*min_likelihood
+        like = likelihood_arrays.normalisation - 0.5*(((likelihood_arrays.measurement_values - model_values[likelihood_arrays.measurement_indices])**2)*likelihood_arrays.inverse_variances).sum()
+        if like == -np.inf:
+            like = 0.9*min_likelihood
+        return like
+
+    def log_likelihood_batch(self, model_results, elements, min_likelihood):
+        # Equivalent to calling log_likelihood on each row of model_results, an (N, n_elements) array with columns ordered as elements
+        model_results = np.atleast_2d(model_results)
+        likelihood_arrays = self.get_likelihood_arrays(elements)
+        out_of_bounds = np.any(model_results > likelihood_arrays.upper_bounds, axis=1) | np.any(model_results < likelihood_arrays.lower_bounds, axis=1)
+        like = likelihood_arrays.normalisation - 0.5*np.sum(((likelihood_arrays.measurement_values - model_results[:, likelihood_arrays.measurement_indices])**2)*likelihood_arrays.inverse_variances, axis=1)
+        like[like == -np.inf] = 0.9*min_likelihood
+        like[out_of_bounds] = 0.9*min_likelihood
+        return like
+
+    def get_likelihood_arrays(self, elements):
+        # The likelihood is always evaluated for the same elements (in the same order), so only the most recent set of arrays is kept
+        # If the abundances are changed after the likelihood has been evaluated, reset likelihood_elements to None
+        elements = tuple(elements)
+        if elements != self.likelihood_elements:
+            self.likelihood_arrays = self.compile_likelihood_arrays(elements)
+            self.likelihood_elements = elements
+        return self.likelihood_arrays
+
+    def compile_likelihood_arrays(self, elements):
+        # Works out which elements enter the likelihood as bounds and which as measurements, and everything about the measurements which
+        # doesn't depend on the model. Elements without an (included) upper bound get an upper bound of inf, and similarly for lower bounds
+        upper_bounds = np.full(len(elements), np.inf)
+        lower_bounds = np.full(len(elements), -np.inf)
+        measurement_indices = list()
+        measurement_values = list()
+        measurement_errors = list()
+        for i, el in enumerate(elements):
             relevant_data = self.get_abundance(el)
             if relevant_data is not None and relevant_data.included:
-                if relevant_data.data_point_type == WhiteDwarfDataPointType.upper_bound and el_result > relevant_data.value:
-                    return 0.9*min_likelihood
-                elif relevant_data.data_point_type == WhiteDwarfDataPointType.lower_bound and el_result < relevant_data.value:
-                    return 0.9*min_likelihood
+                if relevant_data.data_point_type == WhiteDwarfDataPointType.upper_bound:
+                    upper_bounds[i] = relevant_data.value
+                elif relevant_data.data_point_type == WhiteDwarfDataPointType.lower_bound:
+                    lower_bounds[i] = relevant_data.value
                 elif relevant_data.data_point_type == WhiteDwarfDataPointType.measurement and relevant_data.value not in [None, np.nan]:
-                    data_abundances_to_use.append(relevant_data.value)
-                    model_abundances_to_use.append(el_result)
-                    errors_to_use.append(relevant_data.upper_error)
+                    measurement_indices.append(i)
+                    measurement_values.append(relevant_data.value)
+                    measurement_errors.append(relevant_data.upper_error)
                 else:
                     pass
-        data_abundances_to_use = np.array(data_abundances_to_use)
-        model_abundances_to_use = np.array(model_abundances_to_use)
-        errors_to_use = np.array(errors_to_use)
-        neg = 1/((2*np.pi)*(errors_to_use**2))
-        chi2 = ((data_abundances_to_use - model_abundances_to_use)**2)*(neg)*2*np.pi
-        like = -0.5*np.sum(chi2 - np.log(neg))
-        if like == -np.inf:
-            like = 0.9*min_likelihood
-        return like
+        measurement_errors = np.array(measurement_errors, dtype=float)
+        # Each measurement contributes -0.5*(((value - model)/error)**2 + log(2*pi*error**2)) to the log likelihood
+        normalisation = -0.5*np.sum(np.log((2*np.pi)*(measurement_errors**2)))
+        return LikelihoodArrays(
+            np.array(measurement_indices, dtype=int),
+            np.array(measurement_values, dtype=float),
+            1/(measurement_errors**2),
+            normalisation,
+            upper_bounds,
+            lower_bounds
+        )
 
     def estimate_minimum_pollution_fraction(self, elements_to_consider=ci.all_elements):
         list_of_abundances_for_pol_frac = list()
@@ -1,22 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from numba import jit
 import numpy as np
 
 import chemistry_info as ci
 import graph_factory as gf
 
 # A newer, neater version of white_dwarf_model.py
-# I use this version in the synthetic pipeline, and plan to use it in the main Bayesian code as well
-# Problem being that this version is much slower for some reason that I haven't investigated yet (prohibitively slow for the Bayesian model) (TODO!)
+# I use this version in the synthetic pipeline, and the main Bayesian code uses it as well
+# The snapshot (accretion and sinking) calculation is done by the Numba kernels below. It used to be a handful of small numpy operations,
+# which for 12 elements spend far longer on the overhead of each call than on the arithmetic, and made this version much slower than the old one
 
 # Function to take a set of planetesimal abundances and calculate their abundance in a wd atmosphere after a certain time
-# Ideally we'd like planetesimal_abundance and wd_timescales to be numpy arrays but will cast from list if necessary
+# planetesimal_abundance and wd_timescales can be lists or numpy arrays
 def process_abundances(t_sinceaccretion, t_disc, planetesimal_abundance, wd_timescales, pollution_level, snapshot=True):
-    if isinstance(planetesimal_abundance, list):
-        planetesimal_abundance = np.array(planetesimal_abundance)
-    if isinstance(wd_timescales, list):
-        wd_timescales = np.array(wd_timescales)
     if snapshot:
         return process_snapshot_abundances(
             t_sinceaccretion,
@@ -26,6 +24,10 @@ def process_abundances(t_sinceaccretion, t_disc, planetesimal_abundance, wd_time
             pollution_level
         )
     else:
+        if isinstance(planetesimal_abundance, list):
+            planetesimal_abundance = np.array(planetesimal_abundance)
+        if isinstance(wd_timescales, list):
+            wd_timescales = np.array(wd_timescales)
         return process_lifetime_abundances(
             t_sinceaccretion,
             t_disc,
@@ -36,35 +38,120 @@ def process_abundances(t_sinceaccretion, t_disc, planetesimal_abundance, wd_time
 
 # Function to take a set of planetesimal abundances and calculate their abundance in a wd atmosphere after a certain time t_sinceaccretion is in Myr, t_disc is in yr
 def process_snapshot_abundances(t_sinceaccretion, t_disc, planetesimal_abundance, wd_timescales, pollution_level):
-    t_sinceaccretion_years = t_sinceaccretion*1000000
-    buildup_scaling_factors = calculate_buildup_scaling_factors(t_sinceaccretion_years, t_disc, wd_timescales)
-    sinkout_scaling_factors = calculate_sinkout_scaling_factors(t_sinceaccretion_years, t_disc, wd_timescales)
-    proposed_abundances = planetesimal_abundance*buildup_scaling_factors*sinkout_scaling_factors
-    # The summation is the bottleneck: bizarrely, manually summing like this seems to be faster than using the built in sum or np.sum functions
-    summation = 0
-    for pa in proposed_abundances:
-        summation += pa
-    normalised_abundances = proposed_abundances/summation
-    toret = np.log10(normalised_abundances) + pollution_level
-    return toret
+    return process_snapshot_abundances_kernel(
+        float(t_sinceaccretion),
+        float(t_disc),
+        np.asarray(planetesimal_abundance, dtype=np.float64),
+        np.asarray(wd_timescales, dtype=np.float64),
+        float(pollution_level)
+    )
 
 def calculate_buildup_scaling_factors(t_sinceaccretion_years, t_disc, sinking_timescales): # Accounts for build-up while accretion ongoing
-    # Sending in inverse timescales to avoid (slow) division operations - can just multiply by the inverse timescales instead. Means we only have to do the division once.
-    if t_sinceaccretion_years <= 0:
-        return np.ones_like(sinking_timescales)
-    else:
-        if isinstance(sinking_timescales, list):
-            sinking_timescales = np.array(sinking_timescales)
-        return sinking_timescales*(1 - np.exp(-(min(t_sinceaccretion_years, t_disc)/sinking_timescales)))
+    # sinking_timescales can be a single timescale, in which case so is the result
+    if np.ndim(sinking_timescales) == 0:
+        return buildup_scaling_factors_kernel(float(t_sinceaccretion_years), float(t_disc), np.array([sinking_timescales], dtype=np.float64))[0]
+    return buildup_scaling_factors_kernel(float(t_sinceaccretion_years), float(t_disc), np.asarray(sinking_timescales, dtype=np.float64))
 
 def calculate_sinkout_scaling_factors(t_sinceaccretion_years, t_disc, sinking_timescales): # Accounts for sinking out after accretion ends
+    if np.ndim(sinking_timescales) == 0:
+        return sinkout_scaling_factors_kernel(float(t_sinceaccretion_years), float(t_disc), np.array([sinking_timescales], dtype=np.float64))[0]
+    return sinkout_scaling_factors_kernel(float(t_sinceaccretion_years), float(t_disc), np.asarray(sinking_timescales, dtype=np.float64))
+
+@jit(nopython=True, error_model='numpy')
+def buildup_scaling_factors_kernel(t_sinceaccretion_years, t_disc, sinking_timescales):
+    toret = np.ones(len(sinking_timescales))
     if t_sinceaccretion_years <= 0:
-        return np.ones_like(sinking_timescales)
+        return toret
+    t_accreting = min(t_sinceaccretion_years, t_disc)
+    for i in range(len(sinking_timescales)):
+        toret[i] = sinking_timescales[i]*(1 - np.exp(-(t_accreting/sinking_timescales[i])))
+    return toret
+
+@jit(nopython=True, error_model='numpy')
+def sinkout_scaling_factors_kernel(t_sinceaccretion_years, t_disc, sinking_timescales):
+    toret = np.ones(len(sinking_timescales))
+    if t_sinceaccretion_years <= 0:
+        return toret
+    t_sinking = min(t_disc - t_sinceaccretion_years, 0)
+    for i in range(len(sinking_timescales)):
+        toret[i] = np.exp(t_sinking/sinking_timescales[i])
+    return toret
+
+# Writes the snapshot abundances for one point into toret. Everything is done in one pass (with no temporary arrays),
+# in the same order as the numpy version so that the answers are unchanged
+@jit(nopython=True, error_model='numpy')
+def fill_snapshot_abundances(t_sinceaccretion, t_disc, planetesimal_abundance, wd_timescales, pollution_level, toret):
+    t_sinceaccretion_years = t_sinceaccretion*1000000
+    accreting = not (t_sinceaccretion_years <= 0)
+    t_accreting = min(t_sinceaccretion_years, t_disc)
+    t_sinking = min(t_disc - t_sinceaccretion_years, 0)
+    summation = 0.0
+    for i in range(len(planetesimal_abundance)):
+        if accreting:
+            buildup_scaling_factor = wd_timescales[i]*(1 - np.exp(-(t_accreting/wd_timescales[i])))
+            sinkout_scaling_factor = np.exp(t_sinking/wd_timescales[i])
+            toret[i] = planetesimal_abundance[i]*buildup_scaling_factor*sinkout_scaling_factor
+        else:
+            toret[i] = planetesimal_abundance[i]
+        summation += toret[i]
+    for i in range(len(planetesimal_abundance)):
+        toret[i] = np.log10(toret[i]/summation) + pollution_level
+
+@jit(nopython=True, error_model='numpy')
+def process_snapshot_abundances_kernel(t_sinceaccretion, t_disc, planetesimal_abundance, wd_timescales, pollution_level):
+    toret = np.empty(len(planetesimal_abundance))
+    fill_snapshot_abundances(t_sinceaccretion, t_disc, planetesimal_abundance, wd_timescales, pollution_level, toret)
+    return toret
+
+# Each row of planetesimal_abundances (and wd_timescales) is one point, with t_sinceaccretion, t_disc and pollution_level having one entry per point
+@jit(nopython=True, error_model='numpy')
+def process_snapshot_abundances_batch_kernel(t_sinceaccretion, t_disc, planetesimal_abundances, wd_timescales, pollution_level):
+    toret = np.empty(planetesimal_abundances.shape)
+    for i in range(planetesimal_abundances.shape[0]):
+        fill_snapshot_abundances(t_sinceaccretion[i], t_disc[i], planetesimal_abundances[i], wd_timescales[i], pollution_level[i], toret[i])
+    return toret
+
+# Batch versions of the above: planetesimal_abundances is an (N, n_elements) array, and t_sinceaccretion, t_disc and pollution_level
+# can be arrays (one entry per point) or scalars. wd_timescales can be one set of timescales for all points, or an (N, n_elements) array
+# Returns an (N, n_elements) array
+def process_abundances_batch(t_sinceaccretion, t_disc, planetesimal_abundances, wd_timescales, pollution_level, snapshot=True):
+    planetesimal_abundances = np.atleast_2d(planetesimal_abundances)
+    if snapshot:
+        n_points = planetesimal_abundances.shape[0]
+        return process_snapshot_abundances_batch_kernel(
+            get_per_point_values(t_sinceaccretion, n_points),
+            get_per_point_values(t_disc, n_points),
+            np.ascontiguousarray(planetesimal_abundances, dtype=np.float64),
+            np.ascontiguousarray(np.broadcast_to(np.asarray(wd_timescales, dtype=np.float64), planetesimal_abundances.shape)),
+            get_per_point_values(pollution_level, n_points)
+        )
     else:
-        if isinstance(sinking_timescales, list):
-            sinking_timescales = np.array(sinking_timescales)
-        return np.exp(min(t_disc - t_sinceaccretion_years, 0)/sinking_timescales)
+        wd_timescales = np.array(wd_timescales)
+        # Reshaping to column vectors so that these broadcast along the element axis
+        return process_lifetime_abundances_batch(
+            np.reshape(t_sinceaccretion, (-1, 1)),
+            np.reshape(t_disc, (-1, 1)),
+            planetesimal_abundances,
+            wd_timescales,
+            np.reshape(pollution_level, (-1, 1))
+        )
 
+def get_per_point_values(values, n_points):
+    # A scalar or one value per point -> a float array with one value per point
+    return np.ascontiguousarray(np.broadcast_to(np.ravel(np.asarray(values, dtype=np.float64)), (n_points,)))
+
+def process_lifetime_abundances_batch(t_sinceaccretion, t_disc, planetesimal_abundances, wd_timescales, pollution_level):
+    t_sinceaccretion_years = t_sinceaccretion*1000000
+    compensation_factor = np.where(
+        t_sinceaccretion_years == 0,
+        1,
+        np.where(
+            (0 < t_sinceaccretion_years) & (t_sinceaccretion_years < t_disc),
+            (t_sinceaccretion_years/wd_timescales) + np.exp(-t_sinceaccretion_years/wd_timescales),
+            (t_disc/wd_timescales) + np.exp((t_sinceaccretion_years-t_disc)/wd_timescales) + np.exp(-t_disc/wd_timescales)
+        )
+    )
+    return np.log10(planetesimal_abundances*compensation_factor) + pollution_level
 
 #def process_snapshot_abundances(t_sinceaccretion, t_disc, planetesimal_abundance, wd_timescales, pollution_level):
 #    t_sinceaccretion_years = t_sinceaccretion*1000000
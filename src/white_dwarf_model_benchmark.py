@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import numpy as np
+import timeit
+
+import white_dwarf_model as wdm
+
+# Micro-benchmark for the snapshot accretion/sinking calculation in white_dwarf_model.py, on 12-element vectors (one per element in
+# ci.usual_elements) and on batches of them. Compares the Numba kernels against the numpy implementation they replaced (copied below),
+# and checks that both give the same answers
+
+# The numpy implementation as it was before the Numba kernels
+def numpy_process_snapshot_abundances(t_sinceaccretion, t_disc, planetesimal_abundance, wd_timescales, pollution_level):
+    t_sinceaccretion_years = t_sinceaccretion*1000000
+    if t_sinceaccretion_years <= 0:
+        buildup_scaling_factors = np.ones_like(wd_timescales)
+        sinkout_scaling_factors = np.ones_like(wd_timescales)
+    else:
+        buildup_scaling_factors = wd_timescales*(1 - np.exp(-(min(t_sinceaccretion_years, t_disc)/wd_timescales)))
+        sinkout_scaling_factors = np.exp(min(t_disc - t_sinceaccretion_years, 0)/wd_timescales)
+    proposed_abundances = planetesimal_abundance*buildup_scaling_factors*sinkout_scaling_factors
+    summation = 0
+    for pa in proposed_abundances:
+        summation += pa
+    normalised_abundances = proposed_abundances/summation
+    return np.log10(normalised_abundances) + pollution_level
+
+def numpy_process_snapshot_abundances_batch(t_sinceaccretion, t_disc, planetesimal_abundances, wd_timescales, pollution_level):
+    t_sinceaccretion_years = np.reshape(t_sinceaccretion, (-1, 1))*1000000
+    t_disc = np.reshape(t_disc, (-1, 1))
+    accreting = t_sinceaccretion_years > 0
+    buildup_scaling_factors = np.where(accreting, wd_timescales*(1 - np.exp(-(np.minimum(t_sinceaccretion_years, t_disc)/wd_timescales))), 1)
+    sinkout_scaling_factors = np.where(accreting, np.exp(np.minimum(t_disc - t_sinceaccretion_years, 0)/wd_timescales), 1)
+    proposed_abundances = planetesimal_abundances*buildup_scaling_factors*sinkout_scaling_factors
+    summation = np.zeros((proposed_abundances.shape[0], 1))
+    for i in range(proposed_abundances.shape[1]):
+        summation += proposed_abundances[:, i:i+1]
+    return np.log10(proposed_abundances/summation) + np.reshape(pollution_level, (-1, 1))
+
+def get_inputs(n_points, n_elements=12, seed=0):
+    rng = np.random.default_rng(seed)
+    planetesimal_abundances = rng.uniform(0.001, 1, (n_points, n_elements))
+    wd_timescales = 10**rng.uniform(4, 6, n_elements)  # yr
+    t_sinceaccretion = 10**rng.uniform(-3, -1, n_points)  # Myr. Much later than this, the shortest timescale elements sink out completely
+    t_disc = 10**rng.uniform(3, 6, n_points)  # yr
+    pollution_level = rng.uniform(-8, -4, n_points)
+    return t_sinceaccretion, t_disc, planetesimal_abundances, wd_timescales, pollution_level
+
+def time_function(function, n_repeats):
+    # Best of 5, in microseconds per call
+    return 1e6*min(timeit.repeat(function, number=n_repeats, repeat=5))/n_repeats
+
+def run_benchmarks(n_repeats, batch_size):
+    t_sinceaccretion, t_disc, planetesimal_abundances, wd_timescales, pollution_level = get_inputs(batch_size)
+    single_args = (t_sinceaccretion[0], t_disc[0], planetesimal_abundances[0], wd_timescales, pollution_level[0])
+    batch_args = (t_sinceaccretion, t_disc, planetesimal_abundances, wd_timescales, pollution_level)
+
+    # Also compiles the kernels, so that isn't timed
+    max_difference = max(
+        np.max(np.abs(wdm.process_abundances(*single_args) - numpy_process_snapshot_abundances(*single_args))),
+        np.max(np.abs(wdm.process_abundances_batch(*batch_args) - numpy_process_snapshot_abundances_batch(*batch_args)))
+    )
+    print('Largest difference between implementations: ' + str(max_difference))
+
+    results = {
+        'process_abundances (12 elements)': (
+            time_function(lambda: numpy_process_snapshot_abundances(*single_args), n_repeats),
+            time_function(lambda: wdm.process_abundances(*single_args), n_repeats)
+        ),
+        'process_abundances_batch (' + str(batch_size) + ' x 12 elements)': (
+            time_function(lambda: numpy_process_snapshot_abundances_batch(*batch_args), max(1, n_repeats//10)),
+            time_function(lambda: wdm.process_abundances_batch(*batch_args), max(1, n_repeats//10))
+        ),
+        'calculate_buildup_scaling_factors (12 elements)': (
+            time_function(lambda: wd_timescales*(1 - np.exp(-(min(1e5, 2e5)/wd_timescales))), n_repeats),
+            time_function(lambda: wdm.calculate_buildup_scaling_factors(1e5, 2e5, wd_timescales), n_repeats)
+        ),
+        'calculate_sinkout_scaling_factors (12 elements)': (
+            time_function(lambda: np.exp(min(2e5 - 1e5, 0)/wd_timescales), n_repeats),
+            time_function(lambda: wdm.calculate_sinkout_scaling_factors(1e5, 2e5, wd_timescales), n_repeats)
+        )
+    }
+    for name, (numpy_time, numba_time) in results.items():
+        print(name.ljust(55) + ' | numpy ' + ('%.2f' % numpy_time).rjust(9) + ' us | numba ' + ('%.2f' % numba_time).rjust(9) + ' us | x' + ('%.1f' % (numpy_time/numba_time)))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the white dwarf accretion/sinking calculation')
+    parser.add_argument('--n_repeats', default=10000, type=int, help='Number of calls per timing')
+    parser.add_argument('--batch_size', default=100, type=int, help='Number of points in the batch timings (100 is the NestedSampler default)')
+    args = parser.parse_args()
+    run_benchmarks(args.n_repeats, args.batch_size)
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,8 @@
 # TODO: Find a less hacky way to import from /src/
 # Maybe add an __init__.py to /src/
 
+import collections
+import concurrent.futures
 import csv
 import numpy as np
 import os
@@ -54,8 +56,12 @@ import complete_model as cm
 import disc_model as dm
 import enhancement_model as em
 import excess_oxygen_calculator as eoc
+import formation_cache as fc
+import formation_solvers as fs
 import geology_info as gi
+import likelihood_profiler as lp
 import live_data as ld
+import loglike_functions as lf
 import manager as mn
 import model_analyser as ma
 import model_parameters as mp
@@ -64,7 +70,11 @@ import original_complete_model as ocm
 import original_enhancement_model as oe
 import original_pressure_model as op
 import partition_model as pam
+import prior_functions as pf
+import pollution_model as pm
 import pwd_utils as pu
+import run_journal as rj
+import samplers as smp
 import rpy2.robjects as robjects
 import solar_abundances as sa
 import synthetic_bandpass as sb
@@ -297,6 +307,66 @@ class TimescaleInterpolatorTests(unittest.TestCase):
         self.assertEqual(expected_real_timescales, test_real_extraction)
         self.assertEqual(expected_real_timescales, processed_wd_data['SDSSJ0002+3209'])
 
+    def test_batch_interpolation(self):
+        test_ti = ti.TimescaleInterpolator()
+        loggs = np.array([8.1, 7.6, 8.0, 8.4])
+        Teffs = np.array([3123, 12000, 6000, 20409])
+        CaHes = [-7.2, -9.5, None, -11]  # No Ca means no timescales
+        batch_timescales = test_ti.get_wd_timescales_batch('He', loggs, Teffs, CaHes)
+        self.assertEqual((4, 12), batch_timescales.shape)
+        self.assertTrue(np.all(np.isnan(batch_timescales[2])))
+        for i in [0, 1, 3]:
+            wd_timescales = test_ti.get_wd_timescales('He', loggs[i], Teffs[i], CaHes[i])
+            for j, el in enumerate(ci.usual_elements):
+                self.assertAlmostEqual(1, batch_timescales[i, j]/wd_timescales[el])
+        batch_timescales = test_ti.get_wd_timescales_batch('H', loggs, Teffs, elements=[ci.Element.Mg, ci.Element.Zn, ci.Element.U])
+        self.assertEqual((4, 3), batch_timescales.shape)
+        for i in range(4):
+            wd_timescales = test_ti.get_wd_timescales('H', loggs[i], Teffs[i], all_timescales=True)
+            self.assertAlmostEqual(1, batch_timescales[i, 0]/wd_timescales[ci.Element.Mg])
+            self.assertAlmostEqual(1, batch_timescales[i, 1]/wd_timescales[ci.Element.Zn])
+            self.assertEqual(0, batch_timescales[i, 2])  # Not in the tables
+
+    def test_grid_cache(self):
+        test_ti = ti.TimescaleInterpolator()
+        self.assertIs(test_ti.grids, ti.TimescaleInterpolator().grids)  # Loaded once per process
+        self.assertFalse(test_ti.grids['He'][2].flags.writeable)
+        parsed_grids = test_ti.compile_grids()
+        test_ti.cache_dir = 'test_timescale_cache/'
+        cache_file = test_ti.get_grid_cache_file(test_ti.get_grid_cache_key())
+        self.assertEqual(None, test_ti.read_grid_cache(cache_file))
+        test_ti.write_grid_cache(cache_file, parsed_grids)
+        cached_grids = test_ti.read_grid_cache(cache_file)
+        shutil.rmtree('test_timescale_cache')
+        self.assertEqual(['H', 'He'], list(cached_grids.keys()))
+        for HorHe, (axes, columns, values) in parsed_grids.items():
+            cached_axes, cached_columns, cached_values = cached_grids[HorHe]
+            self.assertEqual(len(axes), len(cached_axes))
+            for axis, cached_axis in zip(axes, cached_axes):
+                self.assertTrue(np.array_equal(axis, cached_axis))
+            self.assertEqual(columns, cached_columns)
+            self.assertTrue(np.array_equal(values, cached_values))
+            self.assertTrue(np.array_equal(values, test_ti.grids[HorHe][2]))
+
+    def test_data_dir(self):
+        old_data_dir = os.environ.pop(pu.data_dir_environment_variable, None)
+        default_data_dir = pu.get_path_to_data()
+        os.environ[pu.data_dir_environment_variable] = 'test_data_dir'
+        self.assertEqual(os.path.abspath('test_data_dir') + '/', pu.get_path_to_data())
+        self.assertEqual(os.path.abspath('test_data_dir') + '/cache/', pu.get_path_to_cache())
+        del os.environ[pu.data_dir_environment_variable]
+        if old_data_dir is not None:
+            os.environ[pu.data_dir_environment_variable] = old_data_dir
+        test_ti = ti.TimescaleInterpolator(data_dir=default_data_dir)
+        self.assertEqual(default_data_dir, test_ti.data_dir)
+        self.assertEqual([], test_ti.validate_grids())
+        self.assertEqual(2, len(test_ti.load_times))
+        missing_ti = ti.TimescaleInterpolator(data_dir='test_data_dir/')
+        self.assertEqual(dict(), missing_ti.grids)
+        self.assertEqual(10, len(missing_ti.validate_grids()))  # 8 missing files, and both grids
+        with self.assertRaises(ValueError):
+            missing_ti.check_grids()
+
 class WhiteDwarfDataPointTests(unittest.TestCase):
 
     def test_init(self):
@@ -679,6 +749,40 @@ class WhiteDwarfTests(unittest.TestCase):
         self.assertEqual(white_dwarf1.estimate_minimum_pollution_fraction(ci.usual_elements), expected_min_pol_frac_ue)
         self.assertEqual(white_dwarf1.estimate_maximum_pollution_fraction(ci.usual_elements), expected_max_pol_frac_ue)
 
+    def test_log_likelihood(self):
+        wd_property_data_raw = {
+            mp.WDParameter.atmospheric_type: wd.WhiteDwarfDataPoint(wd.WhiteDwarfDataPointType.label, ci.Element.He)
+        }
+        wd_abundance_data_raw = {
+            ci.Element.Ca: wd.WhiteDwarfDataPoint(wd.WhiteDwarfDataPointType.measurement, -7.6, 0.1),
+            ci.Element.Mg: wd.WhiteDwarfDataPoint(wd.WhiteDwarfDataPointType.measurement, -6.2, 0.2),
+            ci.Element.Fe: wd.WhiteDwarfDataPoint(wd.WhiteDwarfDataPointType.measurement, -6.5, 0.3, False),
+            ci.Element.Al: wd.WhiteDwarfDataPoint(wd.WhiteDwarfDataPointType.upper_bound, -7),
+            ci.Element.Si: wd.WhiteDwarfDataPoint(wd.WhiteDwarfDataPointType.lower_bound, -7)
+        }
+        white_dwarf1 = wd.WhiteDwarf('TestWD', wd.WhiteDwarfPropertyData(wd_property_data_raw), wd.WhiteDwarfAbundanceData(wd_abundance_data_raw))
+        elements = [ci.Element.Al, ci.Element.Ca, ci.Element.Mg, ci.Element.Si, ci.Element.Fe]
+        model_results = np.array([
+            [-8, -7.5, -6.2, -6, -3],  # Fe is excluded, so doesn't matter
+            [-6.9, -7.5, -6.2, -6, -3],  # Al is above its upper bound
+            [-8, -7.5, -6.2, -7.1, -3],  # Si is below its lower bound
+            [-8, -np.inf, -6.2, -6, -3]  # Infinitely far from the Ca measurement
+        ])
+        min_likelihood = -1e90
+        expected_like = -0.5*((((-7.6 + 7.5)/0.1)**2) + np.log(2*np.pi*(0.1**2)) + np.log(2*np.pi*(0.2**2)))
+        expected_likes = [expected_like, 0.9*min_likelihood, 0.9*min_likelihood, 0.9*min_likelihood]
+        batch_likes = white_dwarf1.log_likelihood_batch(model_results, elements, min_likelihood)
+        for i, model_result in enumerate(model_results):
+            like = white_dwarf1.log_likelihood(collections.OrderedDict(zip(elements, model_result)), min_likelihood)
+            self.assertAlmostEqual(expected_likes[i], like)
+            self.assertEqual(like, batch_likes[i])
+        # The arrays are only made once for each set of elements
+        likelihood_arrays = white_dwarf1.get_likelihood_arrays(elements)
+        self.assertIs(likelihood_arrays, white_dwarf1.get_likelihood_arrays(tuple(elements)))
+        self.assertEqual([1, 2], list(likelihood_arrays.measurement_indices))
+        self.assertEqual([-7, np.inf, np.inf, np.inf, np.inf], list(likelihood_arrays.upper_bounds))
+        self.assertEqual([-np.inf, -np.inf, -np.inf, -7, -np.inf], list(likelihood_arrays.lower_bounds))
+
 class SolarAbundancesTests(unittest.TestCase):
 
     def test_get_rel_abundance(self):
@@ -805,6 +909,92 @@ class ManagerTests(unittest.TestCase):
         self.assertEqual(958, len(test_mn.stellar_compositions))
         self.assertEqual(0, len(test_mn.models.keys()))
 
+    def test_workers(self):
+        test_mn = mn.Manager(self.test_args_golden)
+        self.assertEqual(1, test_mn.workers)
+        parallel_args = Namespace(**vars(self.test_args_golden), workers=4)
+        test_mn = mn.Manager(parallel_args)
+        self.assertEqual(4, test_mn.workers)
+        mn.initialise_worker(parallel_args)
+        self.assertEqual(1, mn._worker_manager.workers)
+        self.assertEqual(4, parallel_args.workers)
+        self.assertEqual(len(test_mn.white_dwarfs), len(mn._worker_manager.white_dwarfs))
+        self.assertEqual(['Model_24'], list(mn._worker_manager.models.keys()))
+
+    def test_mpi_rank(self):
+        # Outside mpirun there's a single rank, which writes all the output
+        self.assertEqual(0, pu.get_mpi_rank())
+        self.assertEqual(1, pu.get_mpi_size())
+        test_mn = mn.Manager(self.test_args_golden)
+        self.assertEqual(0, test_mn.mpi_rank)
+        self.assertTrue(test_mn.is_root)
+        class TwoRankComm:
+            # Stands in for MPI.COMM_WORLD under mpirun -np 2
+            def Get_rank(self):
+                return 0
+            def Get_size(self):
+                return 2
+        get_mpi_comm = pu.get_mpi_comm
+        pu.get_mpi_comm = lambda: TwoRankComm()
+        try:
+            self.assertEqual(2, mn.Manager(Namespace(**vars(self.test_args_golden), sampler='multinest', sampler_workers=1)).mpi_comm.Get_size())
+            # The nested sampler would run separately (and write the same files) on every rank
+            with self.assertRaises(ValueError):
+                mn.Manager(Namespace(**vars(self.test_args_golden), sampler='nested', sampler_workers=1))
+        finally:
+            pu.get_mpi_comm = get_mpi_comm
+
+    def test_run_journal(self):
+        journal_file = 'test_run_journal.jsonl'
+        if os.path.isfile(journal_file):
+            os.remove(journal_file)
+        journal = rj.RunJournal(journal_file)
+        self.assertIsNone(journal.get_completed_model('WD0', 'Model_24', 'Default', 'NonEarthlike', 1500))
+        self.assertFalse(journal.is_system_completed('WD0'))
+        journal.record_model(0, 'WD0', 'Model_24', 'Default', 'NonEarthlike', 1500, 'c/WD0_chains')
+        journal.record_system(0, 'WD0', 'WD0_stats.csv')
+        with open(journal_file, 'a', encoding='utf-8') as f:
+            f.write('{"type": "mod')  # As if the run died mid-write
+        # Restarting picks up the finished work, but only for matching settings
+        journal = rj.RunJournal(journal_file)
+        self.assertEqual('c/WD0_chains', journal.get_completed_model('WD0', 'Model_24', 'Default', 'NonEarthlike', 1500)['chains'])
+        self.assertIsNone(journal.get_completed_model('WD0', 'Model_24', 'Default', 'NonEarthlike', 2000))
+        self.assertIsNone(journal.get_completed_model('WD1', 'Model_24', 'Default', 'NonEarthlike', 1500))
+        self.assertTrue(journal.is_system_completed('WD0'))
+        # A journal which isn't allowed to write (e.g. on MPI ranks other than 0) keeps track in memory only
+        journal = rj.RunJournal(journal_file, False)
+        journal.record_system(1, 'WD1', 'WD1_stats.csv')
+        self.assertTrue(journal.is_system_completed('WD1'))
+        self.assertFalse(rj.RunJournal(journal_file).is_system_completed('WD1'))
+        os.remove(journal_file)
+
+    def test_speculative_execution(self):
+        class RecordingExecutor:
+            # Stands in for a process pool: records what was submitted, and completes each task immediately
+            def __init__(self):
+                self.submitted = list()
+            def submit(self, function, N_wd, model_name, prior_name, model_definition):
+                self.submitted.append(model_name)
+                future = concurrent.futures.Future()
+                future.set_result((model_name, None))
+                return future
+        test_mn = mn.Manager(self.test_args_hierarchy)
+        test_mn.executor = RecordingExecutor()
+        base_model_name = test_mn.build_model([0])
+        comparison_model_name = test_mn.build_model([0, 1])
+        test_mn.models[base_model_name] = pm.PollutionModel(base_model_name, test_mn.enhancement_model, test_mn.default_prior, test_mn.n_live_points, test_mn.seed)
+        test_mn.execute_models(0, {comparison_model_name: test_mn.default_prior})
+        self.assertEqual([base_model_name, comparison_model_name], test_mn.executor.submitted)
+        self.assertEqual([base_model_name], test_mn.executed_models[0])
+        self.assertEqual([(0, comparison_model_name)], list(test_mn.pending_models.keys()))
+        # The base model has already run, and the speculative run of the comparison model gets picked up rather than resubmitted
+        test_mn.models[comparison_model_name] = pm.PollutionModel(comparison_model_name, test_mn.enhancement_model, test_mn.default_prior, test_mn.n_live_points, test_mn.seed)
+        test_mn.execute_models(0)
+        self.assertEqual([base_model_name, comparison_model_name], test_mn.executor.submitted)
+        self.assertEqual([base_model_name, comparison_model_name], test_mn.executed_models[0])
+        self.assertEqual(comparison_model_name, test_mn.models[comparison_model_name].result)
+        self.assertEqual(dict(), test_mn.pending_models)
+
     def test_load_compositions(self):
         test_mn = mn.Manager(self.test_args_none)
         self.assertIsNone(test_mn.stellar_compositions_filename)
@@ -1085,6 +1275,27 @@ class EnhancementTests(unittest.TestCase):
         self.assertEqual(expected_enhancements1, enhancements1)
         self.assertEqual(expected_enhancements2, enhancements2)
 
+        # The cached models (and the cached Earth reference abundances) should give exactly the same answers
+        with self.assertRaises(ValueError):
+            em.get_enhancement_model('Dummy')
+        cached_model = em.get_enhancement_model('Earthlike')
+        self.assertIs(cached_model, em.get_enhancement_model('Earthlike'))
+        self.assertIs(em.get_earthlike_geo_model(False), em.get_earthlike_geo_model(False))
+        for i in range(2):
+            cached_enhancements, ignore = cached_model.find_enhancements(
+                geo_model,
+                test_disc_abundances,
+                elements,
+                test_N_c,
+                test_N_o,
+                test_f_c,
+                test_f_o,
+                test_pressure,
+                test_fO2,
+                False
+            )
+            self.assertEqual(expected_enhancements1, cached_enhancements)
+
 
 #TODO: See if it's possible to put this in the GeologyTests class, or otherwise not have this lying around
 def get_mock_partition_coefficient(element, pressure=None, fO2=None):
@@ -1175,6 +1386,96 @@ class AbundanceTests(unittest.TestCase):
             required_dp = 7
             self.assertAlmostEqual(golden_results[element], calculated_results[element], required_dp)
 
+    def test_condensation_table(self):
+        ld._live_stellar_compositions = self.load_generic_float_data_csv('StellarCompositionsSortFE.csv')
+        table = am.CondensationTable(1.5)
+        self.assertFalse(table.covers(ci.usual_elements, 2))
+        self.assertFalse(table.covers([ci.Element.K], 1.5))
+        self.assertTrue(table.covers(ci.usual_elements, 1.5))
+        ld._condensation_table = table
+        try:
+            for linear_d_formation, z_formation in [(0.5, 0.1), (0.05, 0.15), (2, 0.01), (20, 0.1)]:
+                exact_results = am.get_abundances_for_positive_z(ci.usual_elements, linear_d_formation, z_formation, 1.5)
+                table_results = am.get_all_abundances(ci.usual_elements, linear_d_formation, z_formation, 1.5, 156)
+                for el_index, element in enumerate(ci.usual_elements):
+                    if element != ci.Element.O:
+                        self.assertAlmostEqual(exact_results[el_index], table_results[element], 4)
+            # Non-positive feeding zones don't need the table
+            self.assertEqual(
+                am.get_abundances_for_negative_z(ci.usual_elements, 0.5, 1.5)[0],
+                am.get_all_abundances(ci.usual_elements, 0.5, 0, 1.5, 156)[ci.Element.Al]
+            )
+        finally:
+            ld._condensation_table = None
+
+    def test_gauss_hermite_quadrature(self):
+        ld._live_stellar_compositions = self.load_generic_float_data_csv('StellarCompositionsSortFE.csv')
+        self.assertTrue(am.get_typed_elements(ci.usual_elements) is am.get_typed_elements(list(ci.usual_elements)))
+        ld._feeding_zone_quadrature = am.GaussHermiteQuadrature(80)
+        try:
+            for linear_d_formation, z_formation in [(0.5, 0.1), (2, 0.05), (20, 0.1)]:
+                grid_results = am.get_abundances_for_positive_z(ci.usual_elements, linear_d_formation, z_formation, 1.5)
+                quadrature_results = am.get_all_abundances(ci.usual_elements, linear_d_formation, z_formation, 1.5, 156)
+                for el_index, element in enumerate(ci.usual_elements):
+                    if element != ci.Element.O:
+                        self.assertAlmostEqual(grid_results[el_index], quadrature_results[element], 2)
+        finally:
+            ld._feeding_zone_quadrature = None
+
+    def test_disc_model(self):
+        self.assertAlmostEqual(614.1271216104129, dm.S_disc(1.5))
+        self.assertEqual(5000, dm.T_disc(-1, 1.5))
+        # Distances span the inner, viscous and radiative regions of the disc
+        distances = np.array([-1, 0, 0.1, 1, 2, 10, 100, 1000])
+        array_results = dm.default_disc_model.T_disc(distances, 1.5)
+        for distance, array_result in zip(distances, array_results):
+            self.assertEqual(dm.T_disc(distance, 1.5), array_result)
+        times = np.array([0, 0.1, 1.5, 20])
+        array_results = dm.default_disc_model.S_disc(times)
+        for time, array_result in zip(times, array_results):
+            self.assertEqual(dm.S_disc(time), array_result)
+        heavier_disc_model = dm.DiscModel(3)
+        self.assertTrue(heavier_disc_model.T_disc(10, 1.5)[0] > dm.T_disc(10, 1.5))
+
+    def test_oxygen_batch(self):
+        ld._live_stellar_compositions = self.load_generic_float_data_csv('StellarCompositionsSortFE.csv')
+        # These distances span all the branches of the O condensation function
+        linear_d_formations = np.array([0.5, 1, 1.4, 2, 2.5, 3.3, 5, 20])
+        fe_stars = np.array([156, 0, 957, 400.5, 156, 3, 800, 600])
+        python_results = list()
+        for use_compiled_oxygen in [False, True]:
+            am.use_compiled_oxygen = use_compiled_oxygen
+            try:
+                batch_results = am.get_all_abundances_batch(ci.usual_elements, linear_d_formations, 0.05, 1.5, fe_stars)
+                for i, (linear_d_formation, fe_star) in enumerate(zip(linear_d_formations, fe_stars)):
+                    results = am.get_all_abundances(ci.usual_elements, linear_d_formation, 0.05, 1.5, fe_star)
+                    for el_index, element in enumerate(ci.usual_elements):
+                        self.assertEqual(results[element], batch_results[i][el_index])
+                        if use_compiled_oxygen:
+                            # The compiled O calculation only agrees with the pure Python one to ~1e-6 (see am.use_compiled_oxygen)
+                            self.assertTrue(np.isclose(python_results[i][element], results[element], rtol=1e-5, atol=0))
+                    if not use_compiled_oxygen:
+                        python_results.append(results)
+            finally:
+                am.use_compiled_oxygen = False
+
+    def test_condensation_batch(self):
+        ld._live_stellar_compositions = self.load_generic_float_data_csv('StellarCompositionsSortFE.csv')
+        linear_d_formations = np.array([0.5, 0.05, 2, 20, 1.4, 0.8])
+        z_formations = np.array([0.1, 0.15, 0.01, 0.1, 0, -0.05])  # Including non-positive feeding zones
+        fe_stars = np.array([156, 0, 957, 400.5, 156, 3])
+        for method in ['grid', 'table', 'quadrature']:
+            ld._condensation_table = am.CondensationTable(1.5) if method == 'table' else None
+            ld._feeding_zone_quadrature = am.GaussHermiteQuadrature() if method == 'quadrature' else None
+            try:
+                batch_results = am.get_all_abundances_batch(ci.usual_elements, linear_d_formations, z_formations, 1.5, fe_stars)
+                for i in range(len(linear_d_formations)):
+                    results = am.get_all_abundances(ci.usual_elements, linear_d_formations[i], z_formations[i], 1.5, fe_stars[i])
+                    self.assertEqual([results[element] for element in ci.usual_elements], list(batch_results[i]))
+            finally:
+                ld._condensation_table = None
+                ld._feeding_zone_quadrature = None
+
 class PamelaTests(unittest.TestCase):
 
     def test_init_and_gammas(self):
@@ -1355,10 +1656,37 @@ class PamelaTests(unittest.TestCase):
         self.assertEqual(-0.22918003981901158, eps_e[6][0])  # V - C gets overriden by es
         gammas = pamela.calculate_gammas(3300)
         gammas_e = pamela_es.calculate_gammas(3300)
-        self.assertEqual(0.3906320799707601, gammas[ci.Element.O])
-        self.assertEqual(1.186036978787397, gammas[ci.Element.V])
+        self.assertEqual(0.39063207997076016, gammas[ci.Element.O])
+        self.assertEqual(1.1860369787873972, gammas[ci.Element.V])
         self.assertEqual(1.2185224417219145, gammas_e[ci.Element.V]) # I'm assuming this is OK, I didn't check by hand...TODO
 
+    def test_compiled_gammas(self):
+        pamela = pam.PartitionModel(
+            get_path_to_feni() + 'data/part_param_fischer_blanchard_epsilon_update.dat',
+            get_path_to_feni() + 'data/int_param_fischer_blanchard_update.dat',
+            get_path_to_feni() + 'data/composition.dat',
+            get_path_to_feni() + 'data/e_param_fischer_epsilon_update.dat'
+        )
+        composition = np.array(pamela.alloy)
+        composition[3] = 0  # Zero abundances need special treatment
+        for T in [pamela.T0, 3300]:
+            for test_composition in [None, composition]:
+                pamela.use_compiled_kernels = False
+                numpy_gammas = pamela.calculate_gammas(T, test_composition)
+                pamela.use_compiled_kernels = True
+                compiled_gammas = pamela.calculate_gammas(T, test_composition)
+                self.assertEqual(numpy_gammas.keys(), compiled_gammas.keys())
+                for el, gamma in numpy_gammas.items():
+                    # The compiled kernel sums in a different order (and uses a different log), so only agrees to rounding error
+                    self.assertTrue(np.isclose(gamma, compiled_gammas[el], rtol=1e-12, atol=0))
+        self.assertEqual(3300, pamela.eps_table_T)
+        self.assertTrue(pamela.construct_eps_table(3300, composition[1:]) is pamela.eps_table)
+        self.assertEqual(-0.22918003981901158, pamela.construct_eps_table(3300, composition[1:])[6][0])
+        Ds = pamela.calculate_D(40, 3300, -2, pamela.nbot, pamela.log10_gammaFe_sil)
+        Ds_array = pamela.calculate_D_array(40, 3300, -2, pamela.nbot, pamela.log10_gammaFe_sil)
+        self.assertEqual(pamela.els_to_iterate_over, list(Ds.keys()))
+        self.assertEqual(list(Ds.values()), list(Ds_array))
+
     def test_convert_abundance_dict_to_layer_composition(self):
         pamela = pam.PartitionModel(
             get_path_to_feni() + 'data/part_param_fischer_blanchard_epsilon_update.dat',
@@ -1624,6 +1952,96 @@ class GeologyTests(unittest.TestCase):
         self.assertEqual(len(Ds), 24)
         self.assertEqual(all_Ds, None)  # We didn't tell it to store these
 
+    def test_formation_cache(self):
+        geology_model = gi.GeologyModel()
+        uncached_result = geology_model.form_a_planet_iteratively(54, -2)
+        geology_model.formation_cache = fc.PlanetFormationCache(2)
+        first_result = geology_model.form_a_planet_iteratively(54, -2)
+        second_result = geology_model.form_a_planet_iteratively(54, -2)
+        self.assertEqual(geology_model.formation_cache.misses, 1)
+        self.assertEqual(geology_model.formation_cache.hits, 1)
+        for result in [first_result, second_result]:
+            self.assertEqual(result[0], uncached_result[0])
+            self.assertEqual(result[1], uncached_result[1])
+            self.assertEqual(result[2], uncached_result[2])
+        self.assertIsNot(first_result[0], second_result[0])  # Cached results should be copied
+        geology_model.form_a_planet_iteratively(54.1, -2)  # Not within tolerance (which is 0)
+        geology_model.form_a_planet_iteratively(54, -2, initial_w_met=0.3)  # Seeded solves bypass the cache
+        self.assertEqual(geology_model.formation_cache.misses, 2)
+        self.assertEqual(len(geology_model.formation_cache), 2)
+        geology_model.form_a_planet_iteratively(30, -2)
+        self.assertEqual(len(geology_model.formation_cache), 2)  # Oldest entry evicted
+        geology_model.formation_cache = fc.PlanetFormationCache(10, 0.5)
+        geology_model.form_a_planet_iteratively(54.1, -2)
+        geology_model.form_a_planet_iteratively(54.2, -2)
+        self.assertEqual(geology_model.formation_cache.hits, 1)
+        self.assertEqual(geology_model.formation_cache.get_hit_rate(), 0.5)
+
+    def test_warm_start(self):
+        geology_model = gi.GeologyModel()
+        geology_model.warm_start_index = fc.WarmStartIndex(rebuild_interval=2)
+        cold_abundances, cold_w_met, cold_Ds, ignore = geology_model.form_a_planet_iteratively(54, -2)
+        cold_iterations = geology_model.last_iteration_count
+        self.assertEqual(len(geology_model.warm_start_index), 1)
+        warm_abundances, warm_w_met, warm_Ds, ignore = geology_model.form_a_planet_iteratively(54, -2)
+        self.assertTrue(geology_model.last_iteration_count < cold_iterations)
+        self.assertAlmostEqual(warm_w_met, cold_w_met, 2)
+        geology_model.form_a_planet_iteratively(50, -2)
+        geology_model.form_a_planet_iteratively(20, -1.5)
+        self.assertEqual(len(geology_model.warm_start_index), 4)
+        stats = geology_model.warm_start_index.get_iteration_stats()
+        self.assertEqual(stats['cold']['solves'], 1)
+        self.assertEqual(stats['cold']['mean_iterations'], cold_iterations)
+        self.assertEqual(stats['warm']['solves'], 3)
+        # The nearest solution to a point should be the one formed at the closest pressure
+        nearest_w_met, nearest_Ds = geology_model.warm_start_index.find_nearest(geology_model.warm_start_index.make_point(geology_model.get_bulk_abundances(), 21, -1.5))
+        self.assertEqual(nearest_w_met, geology_model.warm_start_index.solutions[-1][0])
+
+    def test_formation_solvers(self):
+        geology_model = gi.GeologyModel()
+        picard_abundances, picard_w_met, picard_Ds, ignore = geology_model.form_a_planet_iteratively(54, -2)
+        picard_iterations = geology_model.last_iteration_count
+        for solver_name in ['anderson', 'secant']:
+            geology_model.solver = fs.get_solver(solver_name)
+            abundances, w_met, Ds, all_Ds = geology_model.form_a_planet_iteratively(54, -2, return_all_Ds=True)
+            self.assertTrue(geology_model.last_iteration_count < picard_iterations)
+            self.assertEqual(len(all_Ds), geology_model.last_iteration_count + 1)
+            self.assertAlmostEqual(w_met, picard_w_met, 2)
+            for element in [ci.Element.Fe, ci.Element.Ni, ci.Element.Si, ci.Element.O]:
+                self.assertAlmostEqual(abundances[element][gi.Layer.core], picard_abundances[element][gi.Layer.core], 2)
+            # The solver keeps no state between solves, so can be shared by geology models
+            other_geology_model = gi.GeologyModel()
+            other_geology_model.solver = geology_model.solver
+            self.assertEqual(other_geology_model.form_a_planet_iteratively(54, -2)[1], w_met)
+            self.assertEqual(geology_model.form_a_planet_iteratively(54, -2)[1], w_met)
+        geology_model.solver = fs.get_solver('picard')
+        self.assertEqual(geology_model.form_a_planet_iteratively(54, -2)[1], picard_w_met)
+        with self.assertRaises(ValueError):
+            fs.get_solver('Not a solver')
+
+    def test_layer_abundances(self):
+        geology_model = gi.GeologyModel()
+        Ds = geology_model.pamela.get_all_partition_coefficients(54, -2)
+        layer_abundances, total_core_abundance = geology_model.calculate_layer_abundances(Ds, 0.2)
+        self.assertEqual(len(Ds), len(layer_abundances))
+        self.assertEqual((gi.Layer.bulk, gi.Layer.core), layer_abundances.layers)
+        self.assertIsNone(layer_abundances.get(ci.Element.Fe, gi.Layer.mantle))
+        self.assertEqual(0, layer_abundances.get(ci.Element.K, gi.Layer.core, 0))
+        self.assertAlmostEqual(1, np.sum(layer_abundances.values[:, gi.Layer.core.value]), 10)
+        abundances, dict_total_core_abundance = geology_model.calculate_abundances(Ds, 0.2, True)
+        self.assertEqual(total_core_abundance, dict_total_core_abundance)
+        self.assertEqual(list(Ds.keys()), list(abundances.keys()))
+        for element, abundance in abundances.items():
+            self.assertEqual([gi.Layer.bulk, gi.Layer.core, gi.Layer.mantle], list(abundance.keys()))
+            self.assertEqual(abundance[gi.Layer.core], layer_abundances.get(element, gi.Layer.core))
+        self.assertEqual(geology_model.get_bulk_abundance(ci.Element.Fe), abundances[ci.Element.Fe][gi.Layer.bulk])
+        # The partitioning model should give the same answer for either representation
+        layer_abundances, total_core_abundance = geology_model.calculate_layer_abundances(Ds, 0.2, True)
+        self.assertEqual(
+            geology_model.pamela.get_all_partition_coefficients(54, -2, abundances),
+            geology_model.pamela.get_all_partition_coefficients(54, -2, layer_abundances)
+        )
+
     def test_find_system_specific_abundances(self):
         geology_model = gi.GeologyModel()
         abundances = {'A': {gi.Layer.core: 0.5, gi.Layer.mantle: 0.25}, 'B': {gi.Layer.core: 0.5, gi.Layer.mantle: 0.75}}
@@ -1838,6 +2256,8 @@ class ModelParameterTests(unittest.TestCase):
         self.assertEqual(mp.get_model_params_in_order(), model_params_in_order)
 
     def test_model_parameters_logic(self):
+        # Later tests (e.g. LoglikeTests) need the real model definitions back
+        self.addCleanup(setattr, mp, 'model_definitions_dict', mp.model_definitions_dict)
         mp.model_definitions_dict = {
             'Model_Mock1': {
             },
@@ -1965,6 +2385,53 @@ class WhiteDwarfModelTests(unittest.TestCase):
             for i, val in enumerate(lifetime_result):
                 self.assertEqual(val, expected_lifetime_result[i])
 
+    def test_white_dwarf_model_batch(self):
+        planetesimal_abundances = np.array([[0.2, 0.3, 0.4, 0.5], [0.5, 0.1, 0.1, 0.3], [0.2, 0.3, 0.4, 0.5], [0.25, 0.25, 0.25, 0.25]])
+        wd_timescales = np.array([50000, 60000, 70000, 80000])
+        t_sinceaccretions = np.array([0, 0.1, 0.4, 1])
+        pollution_levels = np.array([-6, -5, -7, -6])
+        for snapshot in [True, False]:
+            batch_result = wdm.process_abundances_batch(t_sinceaccretions, 200000, planetesimal_abundances, wd_timescales, pollution_levels, snapshot)
+            self.assertEqual(batch_result.shape, (4, 4))
+            for i in range(4):
+                result = wdm.process_abundances(t_sinceaccretions[i], 200000, planetesimal_abundances[i], wd_timescales, pollution_levels[i], snapshot)
+                for j, val in enumerate(result):
+                    self.assertAlmostEqual(val, batch_result[i][j])
+        # The snapshot calculation uses the same kernel for both, so should match exactly, including with per-point timescales
+        batch_result = wdm.process_abundances_batch(t_sinceaccretions, 200000, planetesimal_abundances, np.tile(wd_timescales, (4, 1)), pollution_levels)
+        for i in range(4):
+            self.assertTrue((batch_result[i] == wdm.process_abundances(t_sinceaccretions[i], 200000, list(planetesimal_abundances[i]), list(wd_timescales), pollution_levels[i])).all())
+
+    def test_scaling_factors(self):
+        wd_timescales = np.array([50000, 60000, 70000, 80000])
+        for t_sinceaccretion_years in [0, 100000, 400000]:
+            buildup_scaling_factors = wdm.calculate_buildup_scaling_factors(t_sinceaccretion_years, 200000, wd_timescales)
+            sinkout_scaling_factors = wdm.calculate_sinkout_scaling_factors(t_sinceaccretion_years, 200000, wd_timescales)
+            self.assertEqual((4,), buildup_scaling_factors.shape)
+            for i, wd_timescale in enumerate(wd_timescales):
+                # A single timescale should give the same as the corresponding entry for an array of them
+                self.assertEqual(buildup_scaling_factors[i], wdm.calculate_buildup_scaling_factors(t_sinceaccretion_years, 200000, wd_timescale))
+                self.assertEqual(sinkout_scaling_factors[i], wdm.calculate_sinkout_scaling_factors(t_sinceaccretion_years, 200000, wd_timescale))
+                if t_sinceaccretion_years == 0:
+                    self.assertEqual(1, buildup_scaling_factors[i])
+                    self.assertEqual(1, sinkout_scaling_factors[i])
+                else:
+                    self.assertAlmostEqual(wd_timescale*(1 - np.exp(-min(t_sinceaccretion_years, 200000)/wd_timescale)), buildup_scaling_factors[i])
+                    self.assertAlmostEqual(np.exp(min(200000 - t_sinceaccretion_years, 0)/wd_timescale), sinkout_scaling_factors[i])
+
+    def test_degenerate_accretion(self):
+        # These divide by zero, which should give nan (as numpy does) rather than an exception
+        planetesimal_abundance = np.array([0.1, 0.2, 0.3, 0.4])
+        wd_timescales = np.array([50000, 60000, 70000, 80000])
+        # So soon after accretion starts that nothing has built up: 1 - exp(-t/timescale) rounds to 0 for every element
+        self.assertTrue(np.all(np.isnan(wdm.process_abundances(1e-20, 100000, planetesimal_abundance, wd_timescales, -6))))
+        batch_abundances = wdm.process_abundances_batch([1e-20, 0.1], 100000, np.array([planetesimal_abundance, planetesimal_abundance]), wd_timescales, -6)
+        self.assertTrue(np.all(np.isnan(batch_abundances[0])))
+        self.assertTrue(np.all(np.isfinite(batch_abundances[1])))
+        zero_timescales = np.array([0, 60000, 70000, 80000])
+        self.assertTrue(np.all(np.isnan(wdm.process_abundances(0.1, 100000, planetesimal_abundance, zero_timescales, -6))))
+        self.assertEqual(0, wdm.calculate_buildup_scaling_factors(100000, 200000, 0))
+
 class ModelAnalyserTests(unittest.TestCase):
 
     def test_confidence_intervals(self):
@@ -1998,6 +2465,38 @@ class ModelAnalyserTests(unittest.TestCase):
         self.assertAlmostEqual(4.4862, arr_high2)
         self.assertAlmostEqual(4.4991, arr_high3)
 
+class SamplerTests(unittest.TestCase):
+
+    def test_nested_sampler(self):
+        # 2D unit Gaussian likelihood with a uniform prior on [-5, 5]: the evidence is very nearly 1/100
+        def prior(cube):
+            cube[:] = 10*cube - 5
+            return cube
+        def loglike(x):
+            return -0.5*np.sum(x**2) - np.log(2*np.pi)
+        def loglike_batch(xs):
+            return -0.5*np.sum(xs**2, axis=1) - np.log(2*np.pi)
+        prefix = 'test_nested_'
+        output_files = [prefix + '.txt', prefix + 'post_equal_weights.dat', prefix + smp.NestedSampler.stats_suffix]
+        sampler = smp.get_sampler('nested')
+        result = sampler.run(prior, loglike, loglike_batch, 2, prefix, 400, 1, False)
+        self.assertAlmostEqual(np.log(0.01), result['logZ'], delta=3*result['logZerr'])
+        analyzer = smp.get_analyzer(2, prefix)
+        self.assertEqual(result['logZ'], analyzer.get_stats()['global evidence'])
+        self.assertAlmostEqual(0, analyzer.get_stats()['marginals'][0]['median'], delta=0.2)
+        self.assertAlmostEqual(1, analyzer.get_stats()['marginals'][1]['sigma'], delta=0.2)
+        self.assertGreater(analyzer.get_best_fit()['log_likelihood'], -np.log(2*np.pi) - 0.01)
+        self.assertEqual(3, analyzer.get_equal_weighted_posterior().shape[1])
+        # The one point at a time likelihood gives the same answer (just more slowly), and a rerun picks up the previous output
+        for output_file in output_files:
+            os.remove(output_file)
+        self.assertEqual(result['logZ'], sampler.run(prior, loglike, None, 2, prefix, 400, 1, False)['logZ'])
+        self.assertEqual(result['logZ'], sampler.run(None, None, None, 2, prefix, 400, 1, False)['logZ'])
+        for output_file in output_files:
+            os.remove(output_file)
+        with self.assertRaises(ValueError):
+            smp.get_sampler('foo')
+
 class SyntheticSystemTests(unittest.TestCase):
 
     #TODO: This should be split into smaller tests
@@ -4209,6 +4708,163 @@ class LoglikeTests(unittest.TestCase):
         likelihood = manager.models['Model_Full_No_Crust'].loglike(dummy_cube)
         self.assertEqual(likelihood, -9e89)  # This should have triggered the Al bound (we just raised the pollution fraction by 2.5 orders of magnitude, putting Al above its upper bound)
 
+    def test_model_plan(self):
+        manager = mn.Manager(self.test_args)
+        manager.publish_live_data(226)
+        manager.publish_live_model('Model_Full_No_Crust', 'LowPressure')
+        plan = ld._live_model_plan
+        self.assertIs(pf.get_live_model_plan(), plan)
+        # Model_Full_No_Crust uses metallicity, t_sinceaccretion, formation_distance, feeding_zone_size, fragment_core_frac, pollution_frac, accretion_timescale, pressure, oxygen_fugacity
+        self.assertEqual(list(plan.cube_indices), [0, 1, 2, 3, 4, 5, 6, 7, 8])
+        self.assertEqual(list(plan.parameter_positions), [0, 1, 2, 3, 6, 8, 9, 10, 11])
+        self.assertEqual(len(plan.dynamic_limits), 1)  # Only t_sinceaccretion depends on the cube
+        cube = np.array([0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5])
+        transformed = pf.universal_prior(cube)
+        self.assertIs(transformed, cube)
+        self.assertEqual(cube[0], 479)
+        self.assertEqual(cube[6], 4)
+        self.assertEqual(cube[7], 7.5)  # LowPressure prior
+        self.assertEqual(cube[8], -2)
+        self.assertAlmostEqual(cube[1], 0.5*((12*ld._live_t_mg) + 10**4)/1000000)
+        input_values = plan.get_input_values(cube)
+        self.assertEqual(len(input_values), 12)
+        self.assertEqual(input_values[4], 0.17)  # Default parent_core_frac
+        self.assertEqual(input_values[7], 0)  # Default fragment_crust_frac
+        # Changing the live model directly should cause the plan to be rebuilt
+        ld._live_model = 'Model_24'
+        self.assertIsNot(pf.get_live_model_plan(), plan)
+        self.assertEqual(len(pf.get_live_model_plan().cube_indices), 10)
+
+    def test_batch(self):
+        manager = mn.Manager(self.test_args)
+        manager.publish_live_data(226)
+        manager.publish_live_model('Model_Full_No_Crust')
+        dummy_cubes = np.array([
+            [470, 1, 1.5, 0.02, 0.05, -7, 1, 54, -2],
+            [470, 1, 1.5, 0.02, 0.05, -4.5, 1, 54, -2],
+            [300, 0.5, 0.5, 0.05, 0.3, -6.5, 5, 30, -1.5],
+            [300, 0, -0.5, 0, 0.3, -6.5, 5, 30, -1.5]
+        ])
+        batch_likelihoods = manager.models['Model_Full_No_Crust'].loglike_batch(dummy_cubes)
+        self.assertEqual(len(batch_likelihoods), len(dummy_cubes))
+        for i, dummy_cube in enumerate(dummy_cubes):
+            likelihood = manager.models['Model_Full_No_Crust'].loglike(dummy_cube)
+            self.assertAlmostEqual(likelihood, batch_likelihoods[i])
+        self.assertEqual(batch_likelihoods[1], -9e89)
+
+    def test_complete_model_batch(self):
+        # The second Earthlike point is unphysical (fragment core fraction too large)
+        parameters = np.array([
+            [470, 1, 0.2, 0.02, 0.17, 0.05, 0.6, 0.005, -7, 1e5, 54, -2],
+            [300, 0.5, -0.3, 0.05, 0.1, 0.05, 0.9, 0.05, -6.5, 1e4, 30, -1.5],
+            [300, 0, -0.5, 0, 0.05, 0.02, 0.2, 0, -6.5, 1e4, 5, -1.5]
+        ])
+        for enhancement_model in ['Earthlike', 'NonEarthlike']:
+            manager = mn.Manager(Namespace(**dict(vars(self.test_args), enhancement_model=enhancement_model)))
+            context = manager.create_context(226)
+            for differentiated in [True, False]:
+                batch_parameters = [column if differentiated or j not in [4, 5, 6, 7] else None for j, column in enumerate(parameters.T)]
+                batch_results, valid = cm.complete_model_calculation_batch(*batch_parameters, enhancement_model, context=context)
+                for i in range(len(parameters)):
+                    results, diagnostics = cm.complete_model_calculation(*[None if column is None else column[i] for column in batch_parameters], enhancement_model, context=context)
+                    self.assertEqual(results is not None, valid[i])
+                    if results is not None:
+                        self.assertEqual([np.nan if value is None else value for value in results.values()], list(batch_results[i]))
+                if enhancement_model == 'Earthlike' and differentiated:
+                    self.assertEqual([True, False, True], list(valid))
+
+    def test_model_context(self):
+        manager = mn.Manager(self.test_args)
+        dummy_cubes = [
+            [0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5],
+            [0.7, 0.4, 0.4, 0.2, 0.2, 0.6, 0.5, 0.5, 0.3]
+        ]
+        expected = dict()
+        for N_wd in [0, 226]:
+            manager.publish_live_data(N_wd)
+            manager.publish_live_model('Model_Full_No_Crust')
+            expected[N_wd] = [lf.universal_loglike(pf.universal_prior(list(cube))) for cube in dummy_cubes]
+        self.assertNotEqual(expected[0], expected[226])
+        contexts = {N_wd: manager.create_context(N_wd, 'Model_Full_No_Crust', share_caches=False) for N_wd in [0, 226]}
+        self.assertIsNot(contexts[0].formation_solver, contexts[226].formation_solver)
+        # The contexts should not depend on (or change) the module level live data, which still refers to white dwarf 226
+        def run_context(N_wd):
+            return [lf.universal_loglike(pf.universal_prior(list(cube), contexts[N_wd]), contexts[N_wd]) for cube in dummy_cubes]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            results = dict(zip([0, 226], executor.map(run_context, [0, 226])))
+        for N_wd in [0, 226]:
+            self.assertEqual(expected[N_wd], results[N_wd])
+        self.assertIs(ld._live_white_dwarf, manager.white_dwarfs[226])
+        self.assertIsNot(contexts[0].geo_model, ld._geo_model)
+        contexts[0].formation_cache = fc.PlanetFormationCache(10, 0.01)
+        contexts[0].warm_start_index = fc.WarmStartIndex(20)
+        copied_context = contexts[0].copy()
+        self.assertIsNone(copied_context.geo_model)
+        self.assertIs(copied_context.white_dwarf, contexts[0].white_dwarf)
+        self.assertIsNot(copied_context.formation_solver, contexts[0].formation_solver)
+        self.assertEqual(copied_context.formation_solver.name, contexts[0].formation_solver.name)
+        self.assertIsNone(contexts[0].profiler)
+        self.assertIsNone(copied_context.profiler)
+        self.assertIsNot(copied_context.formation_cache, contexts[0].formation_cache)
+        self.assertEqual(0.01, copied_context.formation_cache.tolerance)
+        self.assertIsNot(copied_context.warm_start_index, contexts[0].warm_start_index)
+        self.assertEqual(20, copied_context.warm_start_index.max_size)
+        with self.assertRaises(KeyError):
+            ld.ModelContext(not_an_attribute=1)
+
+    def test_formation_cache_options(self):
+        manager = mn.Manager(Namespace(**vars(self.test_args), formation_cache_size=10, formation_cache_tolerance=0.1, formation_cache_pressure_tolerance=2, formation_cache_fO2_tolerance=0.5))
+        self.assertEqual(manager.formation_cache.tolerance, 0.1)
+        self.assertEqual(manager.formation_cache.pressure_tolerance, 2)
+        self.assertEqual(manager.formation_cache.fO2_tolerance, 0.5)
+        # The abundance tolerance (in dex) shouldn't be applied to pressure or fO2
+        manager = mn.Manager(Namespace(**vars(self.test_args), formation_cache_size=10, formation_cache_tolerance=0.1))
+        self.assertEqual(manager.formation_cache.pressure_tolerance, 0)
+        self.assertEqual(manager.formation_cache.fO2_tolerance, 0)
+
+    def test_likelihood_profiler(self):
+        manager = mn.Manager(Namespace(**vars(self.test_args), profile=True))
+        context = manager.create_context(0, 'Model_Full_No_Crust')
+        self.assertIs(manager.profiler, context.profiler)
+        unshared_context = manager.create_context(0, 'Model_Full_No_Crust', share_caches=False)
+        self.assertIsNotNone(unshared_context.profiler)
+        self.assertIsNot(manager.profiler, unshared_context.profiler)
+        dummy_cubes = [
+            [0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5],
+            [0.7, 0.4, 0.4, 0.2, 0.2, 0.6, 0.5, 0.5, 0.3]
+        ]
+        unprofiled_context = manager.create_context(0, 'Model_Full_No_Crust')
+        unprofiled_context.profiler = None
+        cubes = [pf.universal_prior(list(cube), context) for cube in dummy_cubes]
+        likelihoods = [lf.universal_loglike(cube, context) for cube in cubes]
+        # Profiling shouldn't change the answer
+        self.assertEqual(likelihoods, [lf.universal_loglike(cube, unprofiled_context) for cube in cubes])
+        profiler = manager.profiler
+        self.assertEqual(2, profiler.model_calls)
+        self.assertEqual(0, profiler.failed_model_calls)
+        for stage in lp.stages:
+            self.assertEqual(2, profiler.calls[stage])
+            self.assertGreater(profiler.total_times[stage], 0)
+        self.assertGreater(sum(profiler.iteration_counts.values()), 0)
+        lf.universal_loglike_batch(np.array(cubes), context)
+        self.assertEqual(4, profiler.model_calls)
+        self.assertEqual(4, profiler.calls['Likelihood'])
+        merged_profiler = lp.LikelihoodProfiler()
+        merged_profiler.merge(profiler)
+        merged_profiler.merge(profiler)
+        self.assertEqual(8, merged_profiler.model_calls)
+        self.assertEqual(8, merged_profiler.calls['Enhancements'])
+        profile_file = 'test_likelihood_profile.csv'
+        profiler.write(profile_file)
+        with open(profile_file, encoding='utf-8') as f:
+            rows = [row for row in csv.reader(f)]
+        self.assertEqual(['Model calculations:', '4'], rows[0])
+        self.assertEqual(['Stage', 'Calls', 'Total time /s', 'Time per call /us', 'Fraction of time'], rows[4])
+        self.assertEqual(lp.stages, [row[0] for row in rows[5:5 + len(lp.stages)]])
+        os.remove(profile_file)
+        profiler.reset()
+        self.assertEqual(0, profiler.model_calls)
+
 #@unittest.skip("Skip for now")
 class IntegrationTests(unittest.TestCase):
 